@@ -1,59 +1,2129 @@
-from flask import Flask, render_template, request, redirect, session, url_for, flash, jsonify
+from flask import Flask, render_template, request, redirect, session, url_for, flash, jsonify, Response, stream_with_context, g, make_response, send_file
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from itsdangerous import BadSignature, Signer
 import psycopg2
 import psycopg2.extras
+import psycopg2.pool
+from werkzeug.datastructures import CallbackDict
 from werkzeug.security import generate_password_hash, check_password_hash
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from urllib.parse import urlparse
 import random
+import re
 import os
 from dotenv import load_dotenv
 import json
+import time
+import hashlib
+import secrets
+import string
+import io
+import csv
+import gzip
+from html.parser import HTMLParser
+import base64
+from datetime import datetime, timezone
+import sqlite3
+from collections import OrderedDict
+import atexit
+import multiprocessing
+import threading
+import contextvars
+import logging
+import sys
+from contextlib import contextmanager
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+try:
+    import fcntl
+except ImportError:  # Windows dev machines
+    fcntl = None
 from groq import Groq
+import click
+try:
+    import brotli
+except ImportError:  # optional; responses fall back to gzip
+    brotli = None
+try:
+    from PIL import Image
+except ImportError:  # optional; the image proxy then caches originals without resizing
+    Image = None
+
+# Async serving mode: under `gunicorn -k gevent` sockets are already cooperative,
+# so TMDB/Spotify/Groq waits park a greenlet instead of a worker thread. psycopg2
+# talks to libpq directly and needs psycogreen's wait callback to do the same.
+try:
+    from gevent import monkey as gevent_monkey
+except ImportError:
+    gevent_monkey = None
+ASYNC_SERVING = False
+
+def enable_async_serving():
+    """Install psycogreen's wait callback if gevent has patched sockets. Returns ASYNC_SERVING.
+
+    Runs at import and again from gunicorn's post_worker_init hook
+    (gunicorn.conf.py): with --preload the app is imported before the gevent
+    worker patches anything, so the import-time check alone comes out false.
+    """
+    global ASYNC_SERVING
+    if ASYNC_SERVING or not (gevent_monkey and gevent_monkey.is_module_patched('socket')):
+        return ASYNC_SERVING
+    from psycogreen.gevent import patch_psycopg
+    patch_psycopg()
+    if psycopg2.extensions.get_wait_callback() is None:
+        raise RuntimeError("gevent is active but psycopg2 has no green wait callback; DB calls would block the hub.")
+    ASYNC_SERVING = True
+    return ASYNC_SERVING
+
+enable_async_serving()
 
 load_dotenv()
 
 app = Flask(__name__)
 app.secret_key = os.getenv('FLASK_SECRET_KEY', 'a_very_secret_and_random_fallback_key_for_dev_only')
 
-# --- API Configurations ---
-GROQ_API_KEY = os.getenv('GROQ_API_KEY')
-TMDB_API_KEY = os.getenv('TMDB_API_KEY')
-SPOTIFY_CLIENT_ID = os.getenv('SPOTIFY_CLIENT_ID')
-SPOTIFY_CLIENT_SECRET = os.getenv('SPOTIFY_CLIENT_SECRET')
-SPOTIFY_MARKET = os.getenv('SPOTIFY_MARKET')
-SPOTIFY_FALLBACK_MARKETS = [m.strip().upper() for m in os.getenv('SPOTIFY_FALLBACK_MARKETS', 'IN,US,GB,DE').split(',') if m.strip()]
-VALID_SECTIONS = ['movies', 'songs', 'bookmarks', 'books']
+# --- API Configurations ---
+GROQ_API_KEY = os.getenv('GROQ_API_KEY')
+TMDB_API_KEY = os.getenv('TMDB_API_KEY')
+SPOTIFY_CLIENT_ID = os.getenv('SPOTIFY_CLIENT_ID')
+SPOTIFY_CLIENT_SECRET = os.getenv('SPOTIFY_CLIENT_SECRET')
+SPOTIFY_MARKET = os.getenv('SPOTIFY_MARKET')
+SPOTIFY_FALLBACK_MARKETS = [m.strip().upper() for m in os.getenv('SPOTIFY_FALLBACK_MARKETS', 'IN,US,GB,DE').split(',') if m.strip()]
+SPOTIFY_TOKEN_REFRESH_MARGIN = int(os.getenv('SPOTIFY_TOKEN_REFRESH_MARGIN', '60'))
+SPOTIFY_TOKEN_CACHE_FILE = os.getenv('SPOTIFY_TOKEN_CACHE_FILE')
+VALID_SECTIONS = ['movies', 'songs', 'bookmarks', 'books']
+HOME_PAGE_SIZE = int(os.getenv('HOME_PAGE_SIZE', '50'))
+MAX_PAGE_SIZE = 100
+ADMIN_PAGE_SIZE = int(os.getenv('ADMIN_PAGE_SIZE', '50'))
+EXPORT_FETCH_SIZE = int(os.getenv('EXPORT_FETCH_SIZE', '1000'))
+SEARCH_PAGE_SIZE = int(os.getenv('SEARCH_PAGE_SIZE', '20'))
+SEARCH_MAX_OFFSET = 500
+SEARCH_MIN_FUZZY_LENGTH = 3  # trigram indexes cannot serve shorter patterns
+SEARCH_STATEMENT_TIMEOUT_MS = int(os.getenv('SEARCH_STATEMENT_TIMEOUT_MS', '500'))
+
+# --- Enrichment Configuration ---
+# With ASYNC_ENRICHMENT on, movie/song adds return immediately and a separate
+# `flask --app app enrichment-worker` process fills in the TMDB/Spotify details.
+ENRICHED_SECTIONS = ('movies', 'songs')
+ASYNC_ENRICHMENT = os.getenv('ASYNC_ENRICHMENT', '').lower() in ('1', 'true', 'yes')
+ENRICHMENT_MAX_ATTEMPTS = int(os.getenv('ENRICHMENT_MAX_ATTEMPTS', '5'))
+ENRICHMENT_RETRY_BASE = float(os.getenv('ENRICHMENT_RETRY_BASE', '5'))
+ENRICHMENT_LEASE_SECONDS = int(os.getenv('ENRICHMENT_LEASE_SECONDS', '120'))
+ENRICHMENT_POLL_INTERVAL = float(os.getenv('ENRICHMENT_POLL_INTERVAL', '1'))
+
+# --- Recommendation Queue Configuration ---
+# A `flask --app app recommendation-worker` process keeps a ranked queue of
+# recommendations per (user, category); /api/recommend pops from it and only
+# falls back to live upstream calls when the queue is empty.
+RECOMMENDATION_CATEGORIES = ('movies', 'songs', 'books')
+RECS_PER_REQUEST = 5
+RECS_QUEUE_SIZE = int(os.getenv('RECS_QUEUE_SIZE', '40'))
+RECS_SEEDS_PER_REFRESH = int(os.getenv('RECS_SEEDS_PER_REFRESH', '6'))
+RECS_REFRESH_DEBOUNCE = float(os.getenv('RECS_REFRESH_DEBOUNCE', '5'))
+RECS_REFRESH_MAX_ATTEMPTS = int(os.getenv('RECS_REFRESH_MAX_ATTEMPTS', '5'))
+# Book prompts describe a bounded sample of the reading list instead of all of
+# it; results are filtered against the full list afterwards.
+BOOK_PROFILE_MAX_TITLES = int(os.getenv('BOOK_PROFILE_MAX_TITLES', '25'))
+BOOK_PROFILE_PER_AUTHOR = int(os.getenv('BOOK_PROFILE_PER_AUTHOR', '3'))
+BOOK_PROFILE_HALF_LIFE = float(os.getenv('BOOK_PROFILE_HALF_LIFE', '20'))  # in list positions, newest first
+BOOK_PROMPT_MAX_EXCLUDED = int(os.getenv('BOOK_PROMPT_MAX_EXCLUDED', '20'))
+BOOK_PROMPT_MAX_TOKENS = int(os.getenv('BOOK_PROMPT_MAX_TOKENS', '600'))
+
+# --- Deletion Configuration ---
+# Deletes are soft: rows are tombstoned with deleted_at, can be restored for
+# DELETE_UNDO_WINDOW seconds, and are then removed by `flask --app app purge-deleted`.
+DELETE_UNDO_WINDOW = int(os.getenv('DELETE_UNDO_WINDOW', '30'))
+DELETE_BATCH_MAX = int(os.getenv('DELETE_BATCH_MAX', '500'))
+PURGE_BATCH_SIZE = int(os.getenv('PURGE_BATCH_SIZE', '500'))
+PURGE_POLL_INTERVAL = float(os.getenv('PURGE_POLL_INTERVAL', '60'))
+
+# --- Bulk Import Configuration ---
+IMPORT_MAX_ROWS = int(os.getenv('IMPORT_MAX_ROWS', '1000'))
+IMPORT_LOOKUP_CONCURRENCY = int(os.getenv('IMPORT_LOOKUP_CONCURRENCY', '4'))
+IMPORT_LOOKUPS_PER_SECOND = float(os.getenv('IMPORT_LOOKUPS_PER_SECOND', '8'))
+# Uncached movie/song rows are queued for the enrichment worker when
+# ASYNC_ENRICHMENT is on. Otherwise they are looked up in the request, and rows
+# not started within this many seconds are reported back to retry, so the
+# response lands well inside gunicorn's default 30s worker timeout.
+IMPORT_SYNC_DEADLINE = float(os.getenv('IMPORT_SYNC_DEADLINE', '20'))
+
+# --- Autocomplete Configuration ---
+AUTOCOMPLETE_SECTIONS = ('movies', 'songs')
+AUTOCOMPLETE_MIN_LENGTH = 2
+AUTOCOMPLETE_LIMIT = 8
+AUTOCOMPLETE_CACHE_TTL = int(os.getenv('AUTOCOMPLETE_CACHE_TTL', str(6 * 3600)))
+AUTOCOMPLETE_REQUESTS_PER_SECOND = float(os.getenv('AUTOCOMPLETE_REQUESTS_PER_SECOND', '4'))
+AUTOCOMPLETE_BURST = int(os.getenv('AUTOCOMPLETE_BURST', '10'))
+
+# --- Authentication Configuration ---
+# werkzeug method string with explicit parameters; stored hashes using anything
+# else are upgraded the next time their owner logs in.
+PASSWORD_HASH_METHOD = os.getenv('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', '2'))  # 0 hashes inline on the request thread
+PASSWORD_HASH_MAX_PENDING = int(os.getenv('PASSWORD_HASH_MAX_PENDING', '8'))
+PASSWORD_HASH_TIMEOUT = float(os.getenv('PASSWORD_HASH_TIMEOUT', '10'))
+LOGIN_ATTEMPTS_PER_MINUTE_PER_IP = float(os.getenv('LOGIN_ATTEMPTS_PER_MINUTE_PER_IP', '20'))
+LOGIN_BURST_PER_IP = int(os.getenv('LOGIN_BURST_PER_IP', '10'))
+LOGIN_ATTEMPTS_PER_MINUTE_PER_USER = float(os.getenv('LOGIN_ATTEMPTS_PER_MINUTE_PER_USER', '5'))
+LOGIN_BURST_PER_USER = int(os.getenv('LOGIN_BURST_PER_USER', '5'))
+# Share login buckets across workers through the SQLite cache file (when SHARED_CACHE_PATH is set).
+LOGIN_LIMIT_SHARED = os.getenv('LOGIN_LIMIT_SHARED', '1').lower() in ('1', 'true', 'yes')
+
+# --- Database Pool Configuration ---
+DB_POOL_MIN = int(os.getenv('DB_POOL_MIN', '1'))
+DB_POOL_MAX = int(os.getenv('DB_POOL_MAX', '10'))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '5'))
+DB_POOL_HEALTHCHECK_AFTER = float(os.getenv('DB_POOL_HEALTHCHECK_AFTER', '30'))
+DB_POOL_DRAIN_TIMEOUT = float(os.getenv('DB_POOL_DRAIN_TIMEOUT', '10'))
+
+# --- Outbound HTTP Configuration ---
+# Base URLs are overridable so the benchmark harness (bench/) can point the app at local stand-ins.
+TMDB_API_BASE = os.getenv('TMDB_API_BASE', 'https://api.themoviedb.org').rstrip('/')
+SPOTIFY_API_BASE = os.getenv('SPOTIFY_API_BASE', 'https://api.spotify.com').rstrip('/')
+SPOTIFY_ACCOUNTS_BASE = os.getenv('SPOTIFY_ACCOUNTS_BASE', 'https://accounts.spotify.com').rstrip('/')
+GROQ_BASE_URL = os.getenv('GROQ_BASE_URL')
+# (connect, read) timeouts in seconds per upstream.
+UPSTREAM_TIMEOUTS = {
+    'tmdb': (float(os.getenv('TMDB_CONNECT_TIMEOUT', '3')), float(os.getenv('TMDB_READ_TIMEOUT', '5'))),
+    'spotify': (float(os.getenv('SPOTIFY_CONNECT_TIMEOUT', '3')), float(os.getenv('SPOTIFY_READ_TIMEOUT', '5'))),
+    'spotify_accounts': (float(os.getenv('SPOTIFY_CONNECT_TIMEOUT', '3')), float(os.getenv('SPOTIFY_READ_TIMEOUT', '5'))),
+    'groq': (float(os.getenv('GROQ_CONNECT_TIMEOUT', '3')), float(os.getenv('GROQ_READ_TIMEOUT', '30'))),
+    'images': (float(os.getenv('IMAGE_CONNECT_TIMEOUT', '3')), float(os.getenv('IMAGE_READ_TIMEOUT', '10'))),
+}
+HTTP_MAX_RETRIES = int(os.getenv('HTTP_MAX_RETRIES', '2'))
+HTTP_BACKOFF_FACTOR = float(os.getenv('HTTP_BACKOFF_FACTOR', '0.3'))
+HTTP_RETRY_AFTER_MAX = float(os.getenv('HTTP_RETRY_AFTER_MAX', '5'))
+HTTP_POOL_MAXSIZE = int(os.getenv('HTTP_POOL_MAXSIZE', '20'))
+FANOUT_MAX_WORKERS = int(os.getenv('FANOUT_MAX_WORKERS', '16'))
+FANOUT_DEADLINE = float(os.getenv('FANOUT_DEADLINE', '10'))
+
+# --- HTTP Caching Configuration ---
+COMPRESS_MIN_SIZE = int(os.getenv('COMPRESS_MIN_SIZE', '1024'))
+COMPRESS_GZIP_LEVEL = int(os.getenv('COMPRESS_GZIP_LEVEL', '6'))
+COMPRESS_BROTLI_QUALITY = int(os.getenv('COMPRESS_BROTLI_QUALITY', '5'))
+COMPRESSIBLE_MIMETYPES = {'text/html', 'text/plain', 'text/css', 'application/json', 'application/javascript'}
+STATIC_MAX_AGE = int(os.getenv('STATIC_MAX_AGE', str(365 * 24 * 3600)))
+
+# --- Image Proxy Configuration ---
+# Album art and posters are served from /img as WebP thumbnails cached on disk.
+IMAGE_CACHE_DIR = os.getenv('IMAGE_CACHE_DIR', '/tmp/laterlist-images')
+IMAGE_CACHE_MAX_BYTES = int(os.getenv('IMAGE_CACHE_MAX_BYTES', str(512 * 1024 * 1024)))
+IMAGE_SIZES = (80, 160, 320)  # output widths in pixels; 80 is the dashboard's 40px thumbnail at 2x
+IMAGE_WEBP_QUALITY = int(os.getenv('IMAGE_WEBP_QUALITY', '80'))
+IMAGE_MAX_SOURCE_BYTES = int(os.getenv('IMAGE_MAX_SOURCE_BYTES', str(8 * 1024 * 1024)))
+IMAGE_PROXY_HOSTS = {'i.scdn.co', 'mosaic.scdn.co', 'image-cdn-ak.spotifycdn.com', 'image-cdn-fa.spotifycdn.com', 'image.tmdb.org'}
+TMDB_IMAGE_BASE = os.getenv('TMDB_IMAGE_BASE', 'https://image.tmdb.org/t/p').rstrip('/')
+POSTER_BACKFILL_PER_SECOND = float(os.getenv('POSTER_BACKFILL_PER_SECOND', '20'))
+
+# --- Response Cache Configuration ---
+CACHE_MAX_ENTRIES = int(os.getenv('CACHE_MAX_ENTRIES', '2048'))
+SHARED_CACHE_PATH = os.getenv('SHARED_CACHE_PATH')  # SQLite file shared by all workers on a host
+SHARED_CACHE_MAX_ENTRIES = int(os.getenv('SHARED_CACHE_MAX_ENTRIES', '50000'))
+TMDB_SEARCH_CACHE_TTL = int(os.getenv('TMDB_SEARCH_CACHE_TTL', str(24 * 3600)))
+TMDB_RECS_CACHE_TTL = int(os.getenv('TMDB_RECS_CACHE_TTL', str(6 * 3600)))
+SPOTIFY_TRACK_CACHE_TTL = int(os.getenv('SPOTIFY_TRACK_CACHE_TTL', str(24 * 3600)))
+SPOTIFY_SEARCH_CACHE_TTL = int(os.getenv('SPOTIFY_SEARCH_CACHE_TTL', str(12 * 3600)))
+SPOTIFY_RECS_CACHE_TTL = int(os.getenv('SPOTIFY_RECS_CACHE_TTL', str(6 * 3600)))
+
+# --- Session Configuration ---
+# 'postgres' (user_sessions table) or 'sqlite' (a file shared by the workers on
+# one host) keep session data server-side behind an opaque cookie, so sessions
+# can be revoked; 'cookie' (the default) keeps Flask's signed-cookie sessions.
+# 'postgres' needs the user_sessions table from `flask --app app migrate`.
+SESSION_BACKEND = os.getenv('SESSION_BACKEND', 'cookie').lower()
+SESSION_SQLITE_PATH = os.getenv('SESSION_SQLITE_PATH') or SHARED_CACHE_PATH or '/tmp/laterlist-sessions.sqlite3'
+SESSION_CACHE_TTL = float(os.getenv('SESSION_CACHE_TTL', '30'))  # also how long a revoked session may linger in other workers
+SESSION_CACHE_MAX_ENTRIES = int(os.getenv('SESSION_CACHE_MAX_ENTRIES', '10000'))
+SESSION_REFRESH_AFTER = float(os.getenv('SESSION_REFRESH_AFTER', '3600'))  # extend an unchanged session's expiry at most this often
+USER_PROFILE_CACHE_TTL = int(os.getenv('USER_PROFILE_CACHE_TTL', '300'))
+# Granted admin in addition to users.is_admin.
+ADMIN_USERNAMES = {name.strip() for name in os.getenv('ADMIN_USERNAMES', 'DuniyaKaPapa').split(',') if name.strip()}
+
+# --- LLM Configuration ---
+GROQ_MODEL = os.getenv('GROQ_MODEL', 'gemma2-9b-it')
+LLM_CACHE_TTL = int(os.getenv('LLM_CACHE_TTL', str(6 * 3600)))
+LLM_CACHE_VARIANTS = int(os.getenv('LLM_CACHE_VARIANTS', '3'))
+# Serve a cached answer even when stale (up to LLM_CACHE_STALE_TTL past its TTL) and refresh it in the background.
+LLM_CACHE_SERVE_STALE = os.getenv('LLM_CACHE_SERVE_STALE', '').lower() in ('1', 'true', 'yes')
+LLM_CACHE_STALE_TTL = int(os.getenv('LLM_CACHE_STALE_TTL', str(24 * 3600)))
+
+# --- Outbound HTTP Session ---
+class _CappedRetry(Retry):
+    """Honor Retry-After, but never park a worker longer than HTTP_RETRY_AFTER_MAX."""
+    def get_retry_after(self, response):
+        retry_after = super().get_retry_after(response)
+        if retry_after is None:
+            return None
+        return min(retry_after, HTTP_RETRY_AFTER_MAX)
+
+def _build_http_session(allowed_methods=Retry.DEFAULT_ALLOWED_METHODS):
+    retry = _CappedRetry(
+        total=HTTP_MAX_RETRIES,
+        backoff_factor=HTTP_BACKOFF_FACTOR,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset(allowed_methods),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=HTTP_POOL_MAXSIZE, max_retries=retry)
+    http = requests.Session()
+    http.mount('https://', adapter)
+    http.mount('http://', adapter)
+    return http
+
+# Only idempotent methods are retried. The Spotify client-credentials token
+# POST is safe to repeat, so it gets its own session that retries POST too.
+http_session = _build_http_session()
+token_http_session = _build_http_session(Retry.DEFAULT_ALLOWED_METHODS | {'POST'})
+
+# --- Instrumentation ---
+# Per-request timings, SQL statement counts/durations and upstream call spans,
+# exported as Prometheus metrics on /metrics and as one JSON log line per
+# request. Request state lives in a ContextVar rather than flask.g, so work
+# fanned out to executor threads (see submit_in_context) is still attributed
+# to the request that started it.
+EXPOSE_REQUEST_COUNTERS = os.getenv('EXPOSE_REQUEST_COUNTERS', '').lower() in ('1', 'true', 'yes')
+LOG_REQUESTS = os.getenv('LOG_REQUESTS', '1').lower() in ('1', 'true', 'yes')
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+# With SHARED_CACHE_PATH set, each worker writes its metric totals there at
+# most this often and /metrics sums every worker on the host.
+METRICS_FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', '5'))
+# Opt-in sampling profiler: profile this fraction of requests and log the
+# hottest stacks of those that take longer than PROFILE_SLOW_REQUEST_MS.
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_SLOW_REQUEST_MS = float(os.getenv('PROFILE_SLOW_REQUEST_MS', '1000'))
+PROFILE_INTERVAL_MS = float(os.getenv('PROFILE_INTERVAL_MS', '5'))
+
+_request_counters = contextvars.ContextVar('request_counters', default=None)
+_logger = logging.getLogger('laterlist')
+_logger.setLevel(logging.INFO)
+if not _logger.handlers:
+    _log_handler = logging.StreamHandler()
+    _log_handler.setFormatter(logging.Formatter('%(message)s'))
+    _logger.addHandler(_log_handler)
+    _logger.propagate = False
+
+def log_event(event, level=logging.INFO, **fields):
+    """Write one structured JSON log line."""
+    _logger.log(level, json.dumps({'ts': round(time.time(), 3), 'level': logging.getLevelName(level).lower(), 'event': event, 'pid': os.getpid(), **fields}, default=str))
+
+class _Metric:
+    def __init__(self, name, documentation, kind, labelnames=()):
+        self.name, self.documentation, self.kind, self.labelnames = name, documentation, kind, tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def _format_labels(self, key, extra=()):
+        pairs = list(zip(self.labelnames, key)) + list(extra)
+        if not pairs:
+            return ''
+        escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+        return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+    def snapshot(self):
+        """JSON-serializable [[label values], value] pairs, for aggregation across processes."""
+        with self._lock:
+            # Round-trip through JSON so histogram entries are copied before the lock is released.
+            return json.loads(json.dumps([[list(key), value] for key, value in self._values.items()]))
+
+    def reset(self):
+        with self._lock:
+            self._values.clear()
+
+    @staticmethod
+    def add(a, b):
+        """Combine two processes' values for one label set."""
+        return a + b
+
+    def render(self, values=None):
+        """Exposition lines for this process, or for `values` ({label key: value}) when given."""
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        if values is None:
+            with self._lock:
+                values = dict(self._values)
+        for key, value in sorted(values.items()):
+            lines.extend(self._render_value(key, value))
+        return lines
+
+    def _render_value(self, key, value):
+        return [f"{self.name}{self._format_labels(key)} {value}"]
+
+class Counter(_Metric):
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, 'counter', labelnames)
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge(_Metric):
+    """Gauge whose value is read from a callback at scrape time; summed across live workers."""
+    def __init__(self, name, documentation, read):
+        super().__init__(name, documentation, 'gauge')
+        self.read = read
+
+    def snapshot(self):
+        return [[[], self.read()]]
+
+    def render(self, values=None):
+        return super().render({(): self.read()} if values is None else values)
+
+class Histogram(_Metric):
+    def __init__(self, name, documentation, buckets, labelnames=()):
+        super().__init__(name, documentation, 'histogram', labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * len(self.buckets), 0, 0.0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    entry[0][index] += 1
+            entry[1] += 1
+            entry[2] += value
+
+    @staticmethod
+    def add(a, b):
+        return [[x + y for x, y in zip(a[0], b[0])], a[1] + b[1], a[2] + b[2]]
+
+    def _render_value(self, key, value):
+        bucket_counts, count, total = value
+        lines = [f"{self.name}_bucket{self._format_labels(key, [('le', repr(float(bound)))])} {bucket_count}" for bound, bucket_count in zip(self.buckets, bucket_counts)]
+        lines.append(f"{self.name}_bucket{self._format_labels(key, [('le', '+Inf')])} {count}")
+        lines.append(f"{self.name}_count{self._format_labels(key)} {count}")
+        lines.append(f"{self.name}_sum{self._format_labels(key)} {total}")
+        return lines
+
+_LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+HTTP_REQUESTS = Counter('laterlist_http_requests_total', 'HTTP requests handled.', ('route', 'method', 'status'))
+HTTP_REQUEST_DURATION = Histogram('laterlist_http_request_duration_seconds', 'HTTP request handling time.', _LATENCY_BUCKETS, ('route', 'method'))
+DB_QUERIES = Counter('laterlist_db_queries_total', 'SQL statements executed.', ('route',))
+DB_QUERY_DURATION = Histogram('laterlist_db_query_duration_seconds', 'SQL statement execution time.', _LATENCY_BUCKETS)
+UPSTREAM_REQUESTS = Counter('laterlist_upstream_requests_total', 'Calls to TMDB, Spotify and Groq.', ('upstream', 'status'))
+UPSTREAM_DURATION = Histogram('laterlist_upstream_request_duration_seconds', 'Upstream call latency.', _LATENCY_BUCKETS, ('upstream',))
+METRICS = [HTTP_REQUESTS, HTTP_REQUEST_DURATION, DB_QUERIES, DB_QUERY_DURATION, UPSTREAM_REQUESTS, UPSTREAM_DURATION]
+
+_metrics_process = {'pid': None, 'key': None, 'flushed_at': 0.0}
+
+def _metrics_process_key():
+    # The pid alone is not enough: a later worker may reuse a dead worker's pid.
+    if _metrics_process['pid'] != os.getpid():
+        _metrics_process.update(pid=os.getpid(), key=f"{os.getpid()}:{secrets.token_hex(4)}", flushed_at=0.0)
+    return _metrics_process['key']
+
+def _reset_metrics_after_fork():
+    # A forked worker must not re-report the totals it inherited from its parent.
+    for metric in METRICS:
+        metric.reset()
+    _metrics_process['pid'] = None
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_metrics_after_fork)
+
+def flush_metrics(force=False):
+    """Write this process's totals to the shared tier, at most every METRICS_FLUSH_INTERVAL seconds."""
+    if shared_cache is None:
+        return
+    process_key = _metrics_process_key()
+    now = time.monotonic()
+    if not force and now - _metrics_process['flushed_at'] < METRICS_FLUSH_INTERVAL:
+        return
+    _metrics_process['flushed_at'] = now
+    shared_cache.write_metric_snapshot(process_key, os.getpid(), {metric.name: metric.snapshot() for metric in METRICS})
+
+def _process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def _merge_metric_snapshots(snapshots):
+    """Sum (snapshot, include_gauges) pairs into {metric name: {label key: value}}."""
+    by_name = {metric.name: metric for metric in METRICS}
+    merged = {}
+    for snapshot, include_gauges in snapshots:
+        for name, items in snapshot.items():
+            metric = by_name.get(name)
+            if metric is None or (isinstance(metric, Gauge) and not include_gauges):
+                continue
+            values = merged.setdefault(name, {})
+            for key, value in items:
+                key = tuple(key)
+                values[key] = metric.add(values[key], value) if key in values else value
+    return merged
+
+def _retire_metric_snapshots(snapshots):
+    """Fold the counters and histograms of exited workers into one snapshot; their gauges no longer apply."""
+    merged = _merge_metric_snapshots([(snapshot, False) for snapshot in snapshots])
+    return {name: [[list(key), value] for key, value in values.items()] for name, values in merged.items()}
+
+def collect_host_metrics():
+    """{metric name: {label key: value}} summed over every worker on the host, or None without a shared tier.
+
+    Exited workers keep contributing their final counts, so counters never go
+    backwards when gunicorn replaces a worker.
+    """
+    if shared_cache is None:
+        return None
+    flush_metrics(force=True)
+    rows = shared_cache.read_metric_snapshots()
+    if rows is None:
+        return None
+    dead = [process_key for process_key, pid, _ in rows if pid and not _process_alive(pid)]
+    if dead:
+        shared_cache.retire_metric_snapshots(dead, _retire_metric_snapshots)
+    return _merge_metric_snapshots([(snapshot, pid != 0 and process_key not in dead) for process_key, pid, snapshot in rows])
+
+def render_metrics():
+    values = collect_host_metrics()
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render(values.get(metric.name, {}) if values is not None else None))
+    return '\n'.join(lines) + '\n'
+
+def current_request_route():
+    counters = _request_counters.get()
+    return counters['route'] if counters else 'background'
+
+def count_request_event(name, amount=1):
+    counters = _request_counters.get()
+    if counters is not None:
+        counters[name] = counters.get(name, 0) + amount
+
+def record_db_query(elapsed_s):
+    count_request_event('db_queries')
+    count_request_event('db_ms', elapsed_s * 1000)
+    DB_QUERIES.inc(route=current_request_route())
+    DB_QUERY_DURATION.observe(elapsed_s)
+
+def submit_in_context(executor, fn, *args):
+    return executor.submit(contextvars.copy_context().run, fn, *args)
+
+class StackSampler:
+    """Samples one thread's Python stack every PROFILE_INTERVAL_MS on a helper thread.
+
+    Under gevent workers all greenlets share the hub thread, so samples show
+    whichever greenlet happens to be running.
+    """
+    def __init__(self, thread_id, interval_s):
+        self.thread_id = thread_id
+        self.interval_s = interval_s
+        self.samples = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True, name='stack-sampler')
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval_s):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(f"{frame.f_code.co_name} ({os.path.basename(frame.f_code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            if stack:
+                key = ';'.join(reversed(stack))
+                self.samples[key] = self.samples.get(key, 0) + 1
+
+    def top_stacks(self, limit=10):
+        return [{'stack': stack, 'samples': count} for stack, count in sorted(self.samples.items(), key=lambda item: -item[1])[:limit]]
+
+@app.before_request
+def _start_request_instrumentation():
+    rule = request.url_rule
+    counters = {
+        'route': rule.rule if rule else 'unmatched', 'started': time.perf_counter(),
+        'db_queries': 0, 'db_ms': 0.0, 'upstream_calls': 0, 'spans': [], 'sampler': None,
+    }
+    if PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE:
+        counters['sampler'] = StackSampler(threading.get_ident(), PROFILE_INTERVAL_MS / 1000).start()
+    _request_counters.set(counters)
+
+@app.after_request
+def _finish_request_instrumentation(response):
+    counters = _request_counters.get()
+    if counters is None:
+        return response
+    # Streamed bodies are still being produced at this point; their counts are partial.
+    elapsed_s = time.perf_counter() - counters['started']
+    HTTP_REQUESTS.inc(route=counters['route'], method=request.method, status=response.status_code)
+    HTTP_REQUEST_DURATION.observe(elapsed_s, route=counters['route'], method=request.method)
+    if EXPOSE_REQUEST_COUNTERS:
+        response.headers['X-DB-Queries'] = str(counters['db_queries'])
+        response.headers['X-Upstream-Calls'] = str(counters['upstream_calls'])
+    response.headers['Server-Timing'] = f"app;dur={elapsed_s * 1000:.1f}, db;dur={counters['db_ms']:.1f}"
+    if LOG_REQUESTS and counters['route'] != '/metrics':
+        log_event(
+            'request', method=request.method, route=counters['route'], path=request.path, status=response.status_code,
+            duration_ms=round(elapsed_s * 1000, 2), db_queries=counters['db_queries'], db_ms=round(counters['db_ms'], 2),
+            upstream_calls=counters['upstream_calls'], spans=counters['spans'],
+        )
+    flush_metrics()
+    sampler = counters['sampler']
+    if sampler:
+        sampler.stop()
+        if elapsed_s * 1000 >= PROFILE_SLOW_REQUEST_MS:
+            log_event('slow_request_profile', level=logging.WARNING, route=counters['route'], duration_ms=round(elapsed_s * 1000, 2), top_stacks=sampler.top_stacks())
+    return response
+
+_upstream_stats = {name: {'calls': 0, 'errors': 0, 'total_ms': 0.0, 'max_ms': 0.0} for name in UPSTREAM_TIMEOUTS}
+_upstream_stats_lock = threading.Lock()
+
+def record_upstream_call(upstream, elapsed_ms, error=False, status=None, **counters):
+    """Account one upstream call; extra keyword counters (e.g. token usage) are summed per upstream.
+
+    status is the HTTP status, or None for 'ok'/'error' when there is none to report.
+    """
+    status = status if status is not None else ('error' if error else 'ok')
+    count_request_event('upstream_calls')
+    request_counters = _request_counters.get()
+    if request_counters is not None:
+        request_counters['spans'].append({'upstream': upstream, 'status': status, 'ms': round(elapsed_ms, 2)})
+    UPSTREAM_REQUESTS.inc(upstream=upstream, status=status)
+    UPSTREAM_DURATION.observe(elapsed_ms / 1000, upstream=upstream)
+    with _upstream_stats_lock:
+        stats = _upstream_stats.setdefault(upstream, {'calls': 0, 'errors': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+        stats['calls'] += 1
+        stats['total_ms'] += elapsed_ms
+        stats['max_ms'] = max(stats['max_ms'], elapsed_ms)
+        if error:
+            stats['errors'] += 1
+        for name, value in counters.items():
+            stats[name] = stats.get(name, 0) + (value or 0)
+
+def upstream_request(upstream, method, url, session=None, **kwargs):
+    """Send a request to an upstream API over the shared keep-alive session.
+
+    Returns the Response (after retries on 429/5xx), or None if the upstream
+    could not be reached or timed out.
+    """
+    kwargs.setdefault('timeout', UPSTREAM_TIMEOUTS[upstream])
+    start = time.perf_counter()
+    try:
+        resp = (session or http_session).request(method, url, **kwargs)
+    except requests.RequestException as e:
+        record_upstream_call(upstream, (time.perf_counter() - start) * 1000, error=True, status=e.__class__.__name__)
+        # The exception text embeds the full URL, query string (and TMDB api_key) included.
+        parts = urlparse(url)
+        log_event('upstream_request_failed', level=logging.WARNING, upstream=upstream, error=e.__class__.__name__, target=f"{parts.netloc}{parts.path}")
+        return None
+    record_upstream_call(upstream, (time.perf_counter() - start) * 1000, error=resp.status_code == 429 or resp.status_code >= 500, status=resp.status_code)
+    return resp
+
+def get_upstream_stats():
+    with _upstream_stats_lock:
+        return {name: {**stats, 'avg_ms': round(stats['total_ms'] / stats['calls'], 2) if stats['calls'] else 0.0} for name, stats in _upstream_stats.items()}
+
+def groq_chat_completion(**kwargs):
+    """groq_client.chat.completions.create with latency, error and token-usage accounting."""
+    start = time.perf_counter()
+    try:
+        completion = groq_client.chat.completions.create(**kwargs)
+    except Exception:
+        record_upstream_call('groq', (time.perf_counter() - start) * 1000, error=True)
+        raise
+    usage = getattr(completion, 'usage', None)
+    record_upstream_call(
+        'groq', (time.perf_counter() - start) * 1000,
+        prompt_tokens=getattr(usage, 'prompt_tokens', 0), completion_tokens=getattr(usage, 'completion_tokens', 0),
+    )
+    return completion
+
+# --- Concurrent Fan-out ---
+_fanout_executor = ThreadPoolExecutor(max_workers=FANOUT_MAX_WORKERS, thread_name_prefix='fanout')
+
+def first_acceptable_result(calls, accept=lambda result: result is not None, deadline=FANOUT_DEADLINE):
+    """Run zero-argument callables concurrently and return the first acceptable result in list order.
+
+    The list order is the preference order: a later call's result is only used
+    once every earlier call has finished without an acceptable one. Calls still
+    queued when a winner is found (or the deadline passes) are cancelled, and
+    results from in-flight stragglers are ignored. Returns None if nothing wins.
+    """
+    futures = [submit_in_context(_fanout_executor, call) for call in calls]
+    end = time.monotonic() + deadline
+    try:
+        for future in futures:
+            try:
+                result = future.result(timeout=max(0, end - time.monotonic()))
+            except FutureTimeoutError:
+                log_event('fan_out_deadline_exceeded', level=logging.WARNING, deadline_s=deadline)
+                return None
+            except Exception as e:
+                log_event('fan_out_call_failed', level=logging.WARNING, error=str(e))
+                continue
+            if accept(result):
+                return result
+        return None
+    finally:
+        for future in futures:
+            future.cancel()
+
+# --- Rate Limiting ---
+class TokenBucket:
+    """Thread-safe token bucket refilling `rate` tokens per second up to `capacity`."""
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_acquire(self, tokens=1):
+        with self._lock:
+            self._refill()
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return True
+            return False
+
+    def acquire(self, tokens=1, timeout=None):
+        """Block until tokens are available; False if that would take longer than timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return True
+                wait = (tokens - self._tokens) / self.rate
+            if deadline is not None and time.monotonic() + wait > deadline:
+                return False
+            time.sleep(wait)
+
+class KeyedTokenBuckets:
+    """One TokenBucket per key (e.g. per user), forgetting keys idle for `idle_ttl` seconds.
+
+    With a `shared` SQLiteCache the buckets live in its file and are enforced
+    across every worker on the host; if that file errors, the in-process
+    buckets take over.
+    """
+    def __init__(self, rate, capacity, max_keys=10000, idle_ttl=600, shared=None, namespace='bucket'):
+        self.rate = rate
+        self.capacity = capacity
+        self.idle_ttl = idle_ttl
+        self.shared = shared
+        self.namespace = namespace
+        self._buckets = TTLCache(max_keys)
+        self._lock = threading.Lock()
+
+    def try_acquire(self, key, tokens=1):
+        if self.shared is not None:
+            allowed = self.shared.consume_token(f"{self.namespace}:{key}", self.rate, self.capacity, tokens, self.idle_ttl)
+            if allowed is not None:
+                return allowed
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = TokenBucket(self.rate, self.capacity)
+            self._buckets.set(key, bucket, self.idle_ttl)
+        return bucket.try_acquire(tokens)
+
+# --- Response Cache ---
+class TTLCache:
+    """Thread-safe in-process LRU cache whose entries expire after a per-entry TTL."""
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            if entry[1] <= time.time():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return entry[0]
+
+    def set(self, key, value, ttl):
+        self.set_until(key, value, time.time() + ttl)
+
+    def set_until(self, key, value, expires_at):
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def __len__(self):
+        return len(self._data)
+
+class SQLiteCache:
+    """Cache tier shared by every worker on the host, stored as JSON in a local SQLite file."""
+    def __init__(self, path, max_entries):
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=1)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL, accessed_at REAL NOT NULL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS token_buckets (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS metric_snapshots (process_key TEXT PRIMARY KEY, pid INTEGER NOT NULL, data TEXT NOT NULL, updated_at REAL NOT NULL)")
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def get(self, key):
+        """Return (value, expires_at) or None."""
+        try:
+            conn = self._conn()
+            row = conn.execute("SELECT value, expires_at FROM cache WHERE key = ?", (key,)).fetchone()
+            if row is None or row[1] <= time.time():
+                return None
+            with conn:
+                conn.execute("UPDATE cache SET accessed_at = ? WHERE key = ?", (time.time(), key))
+            return json.loads(row[0]), row[1]
+        except (sqlite3.Error, ValueError) as e:
+            log_event('shared_cache_error', level=logging.WARNING, operation='read', error=str(e))
+            return None
+
+    def set(self, key, value, ttl):
+        now = time.time()
+        try:
+            conn = self._conn()
+            with conn:
+                conn.execute("INSERT OR REPLACE INTO cache (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)", (key, json.dumps(value), now + ttl, now))
+                # Prune on roughly 1% of writes to keep the file bounded without a separate job.
+                if random.random() < 0.01:
+                    conn.execute("DELETE FROM cache WHERE expires_at <= ?", (now,))
+                    conn.execute("DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)", (self.max_entries,))
+        except (sqlite3.Error, TypeError, ValueError) as e:
+            log_event('shared_cache_error', level=logging.WARNING, operation='write', error=str(e))
+
+    def consume_token(self, key, rate, capacity, tokens=1, idle_ttl=600):
+        """Token-bucket take shared by all workers; True/False, or None if the file is unusable."""
+        now = time.time()
+        try:
+            conn = self._conn()
+            # BEGIN IMMEDIATE takes the write lock up front so refill-and-take is atomic across processes.
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute("SELECT tokens, updated_at FROM token_buckets WHERE key = ?", (key,)).fetchone()
+                available = capacity if row is None else min(capacity, row[0] + (now - row[1]) * rate)
+                allowed = available >= tokens
+                conn.execute("INSERT OR REPLACE INTO token_buckets (key, tokens, updated_at) VALUES (?, ?, ?)", (key, available - tokens if allowed else available, now))
+                if random.random() < 0.01:
+                    conn.execute("DELETE FROM token_buckets WHERE updated_at <= ?", (now - idle_ttl,))
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            return allowed
+        except sqlite3.Error as e:
+            log_event('shared_cache_error', level=logging.WARNING, operation='token_bucket', error=str(e))
+            return None
+
+    def write_metric_snapshot(self, process_key, pid, snapshot):
+        try:
+            conn = self._conn()
+            with conn:
+                conn.execute("INSERT OR REPLACE INTO metric_snapshots (process_key, pid, data, updated_at) VALUES (?, ?, ?, ?)", (process_key, pid, json.dumps(snapshot), time.time()))
+        except (sqlite3.Error, TypeError, ValueError) as e:
+            log_event('shared_cache_error', level=logging.WARNING, operation='metrics_write', error=str(e))
+
+    def read_metric_snapshots(self):
+        """[(process_key, pid, snapshot)] for every worker that has flushed; pid 0 is retired workers. None on error."""
+        try:
+            rows = self._conn().execute("SELECT process_key, pid, data FROM metric_snapshots").fetchall()
+            return [(process_key, pid, json.loads(data)) for process_key, pid, data in rows]
+        except (sqlite3.Error, ValueError) as e:
+            log_event('shared_cache_error', level=logging.WARNING, operation='metrics_read', error=str(e))
+            return None
+
+    def retire_metric_snapshots(self, process_keys, fold):
+        """Replace the given snapshots and the 'retired' row with one row holding fold([snapshots])."""
+        try:
+            conn = self._conn()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                keys = ['retired'] + list(process_keys)
+                placeholders = ', '.join('?' * len(keys))
+                rows = conn.execute(f"SELECT data FROM metric_snapshots WHERE process_key IN ({placeholders})", keys).fetchall()
+                conn.execute(f"DELETE FROM metric_snapshots WHERE process_key IN ({placeholders})", keys)
+                conn.execute(
+                    "INSERT INTO metric_snapshots (process_key, pid, data, updated_at) VALUES ('retired', 0, ?, ?)",
+                    (json.dumps(fold([json.loads(data) for data, in rows])), time.time()),
+                )
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        except (sqlite3.Error, ValueError) as e:
+            log_event('shared_cache_error', level=logging.WARNING, operation='metrics_retire', error=str(e))
+
+    def delete(self, key):
+        try:
+            conn = self._conn()
+            with conn:
+                conn.execute("DELETE FROM cache WHERE key = ?", (key,))
+        except sqlite3.Error as e:
+            log_event('shared_cache_error', level=logging.WARNING, operation='delete', error=str(e))
+
+local_cache = TTLCache(CACHE_MAX_ENTRIES)
+shared_cache = SQLiteCache(SHARED_CACHE_PATH, SHARED_CACHE_MAX_ENTRIES) if SHARED_CACHE_PATH else None
+_cache_stats = {}
+_cache_stats_lock = threading.Lock()
+
+def _count_cache_event(namespace, event):
+    with _cache_stats_lock:
+        stats = _cache_stats.setdefault(namespace, {'local_hits': 0, 'shared_hits': 0, 'misses': 0, 'coalesced': 0})
+        stats[event] += 1
+
+def normalize_cache_key(text):
+    return ' '.join(str(text).lower().split())
+
+# normalize_cache_key(title) in SQL: lowercased, whitespace runs collapsed and trimmed.
+NORMALIZED_TITLE_SQL = "btrim(regexp_replace(lower(title), '\\s+', ' ', 'g'))"
+
+_inflight_calls = {}
+_inflight_calls_lock = threading.Lock()
+
+def coalesced_call(key, loader):
+    """Run loader() once for concurrent callers with the same key; all of them get its result or exception."""
+    with _inflight_calls_lock:
+        future = _inflight_calls.get(key)
+        leader = future is None
+        if leader:
+            future = _inflight_calls[key] = Future()
+    if not leader:
+        return future.result()
+    try:
+        value = loader()
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    else:
+        future.set_result(value)
+        return value
+    finally:
+        with _inflight_calls_lock:
+            _inflight_calls.pop(key, None)
+
+def cached_call(namespace, key, ttl, loader):
+    """Read-through cache: return the cached value for namespace/key or call loader() and cache it.
+
+    Checks the in-process LRU first, then the shared tier. Concurrent misses for
+    the same key share one loader() call. Loader results of None are treated as
+    failures and not cached. Values must be JSON-serializable.
+    """
+    value = cache_get(namespace, key)
+    if value is not None:
+        return value
+
+    def load():
+        value = loader()
+        if value is not None:
+            cache_set(namespace, key, value, ttl)
+        return value
+
+    with _inflight_calls_lock:
+        joining = f"{namespace}:{key}" in _inflight_calls
+    if joining:
+        _count_cache_event(namespace, 'coalesced')
+    return coalesced_call(f"{namespace}:{key}", load)
+
+def cache_get(namespace, key):
+    """Look up namespace/key in the in-process tier, then the shared tier. None on a miss."""
+    cache_key = f"{namespace}:{key}"
+    value = local_cache.get(cache_key)
+    if value is not None:
+        _count_cache_event(namespace, 'local_hits')
+        return value
+    if shared_cache:
+        shared = shared_cache.get(cache_key)
+        if shared is not None:
+            _count_cache_event(namespace, 'shared_hits')
+            local_cache.set_until(cache_key, shared[0], shared[1])
+            return shared[0]
+    _count_cache_event(namespace, 'misses')
+    return None
+
+def cache_set(namespace, key, value, ttl):
+    cache_key = f"{namespace}:{key}"
+    local_cache.set(cache_key, value, ttl)
+    if shared_cache:
+        shared_cache.set(cache_key, value, ttl)
+
+def invalidate_cached(namespace, key):
+    cache_key = f"{namespace}:{key}"
+    local_cache.delete(cache_key)
+    if shared_cache:
+        shared_cache.delete(cache_key)
+
+def get_cache_stats():
+    with _cache_stats_lock:
+        return {'local_entries': len(local_cache), 'shared_enabled': shared_cache is not None, 'namespaces': {name: dict(stats) for name, stats in _cache_stats.items()}}
+
+# --- LLM Response Cache ---
+# Entries hold up to LLM_CACHE_VARIANTS answers for the same normalized prompt;
+# a hit returns one at random so repeated clicks still see some variety.
+_background_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='background')
+_llm_refreshing = set()
+_llm_refreshing_lock = threading.Lock()
+
+def normalize_prompt(text):
+    """Fold case, punctuation and whitespace so near-identical prompts share a cache entry."""
+    return ' '.join(str(text).lower().translate(str.maketrans('', '', string.punctuation)).split())
+
+def _store_llm_variant(namespace, key, value):
+    entry = cache_get(namespace, key) or {'variants': []}
+    entry = {'variants': (entry['variants'] + [value])[-LLM_CACHE_VARIANTS:], 'refreshed_at': time.time()}
+    hard_ttl = LLM_CACHE_TTL + (LLM_CACHE_STALE_TTL if LLM_CACHE_SERVE_STALE else 0)
+    cache_set(namespace, key, entry, hard_ttl)
+
+def _refresh_llm_cache_in_background(namespace, key, create):
+    with _llm_refreshing_lock:
+        if (namespace, key) in _llm_refreshing:
+            return
+        _llm_refreshing.add((namespace, key))
+
+    def refresh():
+        try:
+            value = create()
+            if value is not None:
+                _store_llm_variant(namespace, key, value)
+        except Exception as e:
+            log_event('llm_refresh_failed', level=logging.WARNING, namespace=namespace, error=str(e))
+        finally:
+            with _llm_refreshing_lock:
+                _llm_refreshing.discard((namespace, key))
+
+    _background_executor.submit(refresh)
+
+def _llm_cache_key(key_text):
+    return hashlib.sha256(f"{GROQ_MODEL}|{key_text}".encode()).hexdigest()
+
+def llm_cached_variant(namespace, key_text, create):
+    """A cached answer for key_text, or None when there is no usable entry.
+
+    With LLM_CACHE_SERVE_STALE on, stale entries are served and refreshed in
+    the background via create(), as are entries holding fewer than
+    LLM_CACHE_VARIANTS answers.
+    """
+    key = _llm_cache_key(key_text)
+    entry = cache_get(namespace, key)
+    if entry and entry['variants']:
+        fresh = time.time() - entry['refreshed_at'] < LLM_CACHE_TTL
+        if fresh or LLM_CACHE_SERVE_STALE:
+            if LLM_CACHE_SERVE_STALE and (not fresh or len(entry['variants']) < LLM_CACHE_VARIANTS):
+                _refresh_llm_cache_in_background(namespace, key, create)
+            return random.choice(entry['variants'])
+    return None
+
+def llm_store_variant(namespace, key_text, value):
+    _store_llm_variant(namespace, _llm_cache_key(key_text), value)
+
+def llm_cached_completion(namespace, key_text, create):
+    """Return a cached LLM answer for key_text, or call create() and cache its result.
+
+    create() must return a JSON-serializable value, or None to skip caching.
+    """
+    cached = llm_cached_variant(namespace, key_text, create)
+    if cached is not None:
+        return cached
+    value = create()
+    if value is not None:
+        llm_store_variant(namespace, key_text, value)
+    return value
+
+class JSONArrayItemParser:
+    """Pull complete objects out of a streamed JSON document as soon as each one closes.
+
+    Only objects that are direct elements of an array are emitted, so for
+    {"suggestions": [{...}, {...}]} each suggestion comes out individually.
+    """
+    def __init__(self):
+        self._buffer = ''
+        self._scan_pos = 0
+        self._stack = []
+        self._starts = []
+        self._in_string = False
+        self._escaped = False
+
+    def feed(self, text):
+        self._buffer += text
+        items = []
+        for pos in range(self._scan_pos, len(self._buffer)):
+            char = self._buffer[pos]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == '\\':
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char in '{[':
+                self._stack.append(char)
+                self._starts.append(pos)
+            elif char in '}]' and self._stack:
+                self._stack.pop()
+                start = self._starts.pop()
+                if char == '}' and self._stack and self._stack[-1] == '[':
+                    try:
+                        items.append(json.loads(self._buffer[start:pos + 1]))
+                    except ValueError:
+                        pass
+        self._scan_pos = len(self._buffer)
+        return items
+
+def stream_groq_array_items(messages):
+    """Yield each array element object from a streamed Groq completion as it completes."""
+    start = time.perf_counter()
+    parser = JSONArrayItemParser()
+    usage = None
+    try:
+        stream = groq_client.chat.completions.create(messages=messages, model=GROQ_MODEL, temperature=0.7, stream=True)
+        for chunk in stream:
+            if chunk.choices:
+                yield from parser.feed(chunk.choices[0].delta.content or '')
+            usage = getattr(getattr(chunk, 'x_groq', None), 'usage', None) or usage
+    except Exception:
+        record_upstream_call('groq', (time.perf_counter() - start) * 1000, error=True)
+        raise
+    record_upstream_call(
+        'groq', (time.perf_counter() - start) * 1000,
+        prompt_tokens=getattr(usage, 'prompt_tokens', 0), completion_tokens=getattr(usage, 'completion_tokens', 0),
+    )
+
+# --- API Clients ---
+groq_client = None
+if GROQ_API_KEY:
+    try:
+        groq_client = Groq(api_key=GROQ_API_KEY, base_url=GROQ_BASE_URL, timeout=sum(UPSTREAM_TIMEOUTS['groq']), max_retries=HTTP_MAX_RETRIES)
+        print("Groq client initialized successfully.")
+    except Exception as e:
+        print(f"Could not initialize Groq client: {e}")
+
+# --- Database Connection Pool ---
+# One pool per worker process. Gunicorn forks workers after importing the app,
+# so the pool is created lazily and rebuilt if the PID changes.
+_db_pool = None
+_db_pool_pid = None
+_db_pool_lock = threading.Lock()
+_db_pool_slots = threading.BoundedSemaphore(DB_POOL_MAX)
+_db_pool_last_used = {}
+_db_pool_stats = {'checkouts': 0, 'in_use': 0, 'timeouts': 0, 'recycled': 0, 'health_check_failures': 0, 'connect_errors': 0}
+_db_pool_stats_lock = threading.Lock()
+
+def _count_pool_event(name, amount=1):
+    # Request, fan-out and background threads all check out connections; += on a dict entry is not atomic.
+    with _db_pool_stats_lock:
+        _db_pool_stats[name] += amount
+
+class _InstrumentedCursorMixin:
+    def execute(self, query, vars=None):
+        start = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            record_db_query(time.perf_counter() - start)
+
+class InstrumentedCursor(_InstrumentedCursorMixin, psycopg2.extensions.cursor):
+    pass
+
+class InstrumentedRealDictCursor(_InstrumentedCursorMixin, psycopg2.extras.RealDictCursor):
+    pass
+
+class InstrumentedConnection(psycopg2.extensions.connection):
+    """Pool connection whose cursors time and count every execute()."""
+    def cursor(self, *args, cursor_factory=None, **kwargs):
+        cursor_factory = {None: InstrumentedCursor, psycopg2.extras.RealDictCursor: InstrumentedRealDictCursor}.get(cursor_factory, cursor_factory)
+        return super().cursor(*args, cursor_factory=cursor_factory, **kwargs)
+
+def get_db_pool():
+    global _db_pool, _db_pool_pid, _db_pool_slots
+    pid = os.getpid()
+    if _db_pool is not None and _db_pool_pid == pid:
+        return _db_pool
+    with _db_pool_lock:
+        if _db_pool is None or _db_pool_pid != pid:
+            try:
+                _db_pool = psycopg2.pool.ThreadedConnectionPool(DB_POOL_MIN, DB_POOL_MAX, os.getenv('DATABASE_URL'), connection_factory=InstrumentedConnection)
+                _db_pool_pid = pid
+                _db_pool_slots = threading.BoundedSemaphore(DB_POOL_MAX)
+                _db_pool_last_used.clear()
+                with _db_pool_stats_lock:
+                    _db_pool_stats['in_use'] = 0
+            except psycopg2.OperationalError as e:
+                _count_pool_event('connect_errors')
+                log_event('db_connect_failed', level=logging.ERROR, error=str(e))
+                return None
+    return _db_pool
+
+def _is_connection_healthy(conn):
+    if conn.closed:
+        return False
+    last_used = _db_pool_last_used.get(id(conn))
+    if last_used is not None and time.monotonic() - last_used < DB_POOL_HEALTHCHECK_AFTER:
+        return True
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT 1")
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+def _checkout_connection(pool):
+    """Take a connection from the pool, replacing any that fail the health check."""
+    for _ in range(DB_POOL_MAX + 1):
+        conn = pool.getconn()
+        if _is_connection_healthy(conn):
+            return conn
+        _count_pool_event('health_check_failures')
+        _db_pool_last_used.pop(id(conn), None)
+        pool.putconn(conn, close=True)
+    raise psycopg2.OperationalError("No healthy database connection available.")
+
+def _return_connection(pool, conn, discard=False):
+    """Hand a connection back, rolling back open transactions and recycling broken ones."""
+    if not discard and not conn.closed:
+        status = conn.get_transaction_status()
+        if status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN:
+            discard = True
+        elif status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                discard = True
+    if discard or conn.closed:
+        _count_pool_event('recycled')
+        _db_pool_last_used.pop(id(conn), None)
+        pool.putconn(conn, close=True)
+    else:
+        _db_pool_last_used[id(conn)] = time.monotonic()
+        pool.putconn(conn)
+
+@contextmanager
+def get_db_connection():
+    """Borrow a pooled connection for the duration of a `with` block.
+
+    Yields None when the database is unreachable or the pool stays exhausted
+    past DB_POOL_TIMEOUT, so routes keep their `if not conn` error paths.
+    """
+    pool = get_db_pool()
+    if pool is None:
+        yield None
+        return
+    slots = _db_pool_slots
+    if not slots.acquire(timeout=DB_POOL_TIMEOUT):
+        _count_pool_event('timeouts')
+        log_event('db_pool_timeout', level=logging.ERROR, pool_max=DB_POOL_MAX)
+        yield None
+        return
+    try:
+        conn = _checkout_connection(pool)
+    except psycopg2.Error as e:
+        slots.release()
+        _count_pool_event('connect_errors')
+        log_event('db_connect_failed', level=logging.ERROR, error=str(e))
+        yield None
+        return
+    _count_pool_event('checkouts')
+    _count_pool_event('in_use')
+    discard = False
+    try:
+        yield conn
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        discard = True
+        raise
+    finally:
+        _count_pool_event('in_use', -1)
+        try:
+            _return_connection(pool, conn, discard=discard)
+        finally:
+            slots.release()
+
+def get_db_pool_stats():
+    with _db_pool_stats_lock:
+        stats = dict(_db_pool_stats)
+    return {**stats, 'min_size': DB_POOL_MIN, 'max_size': DB_POOL_MAX, 'pid': os.getpid(), 'initialized': _db_pool is not None and _db_pool_pid == os.getpid()}
+
+METRICS.extend([
+    Gauge('laterlist_db_pool_in_use', 'Pooled PostgreSQL connections currently borrowed.', lambda: _db_pool_stats['in_use']),
+    Gauge('laterlist_db_pool_max', 'Pool size limit, summed over workers.', lambda: DB_POOL_MAX),
+    Gauge('laterlist_db_pool_timeouts', 'Checkouts that timed out waiting for a connection.', lambda: _db_pool_stats['timeouts']),
+])
+
+def close_db_pool():
+    """Drain the pool on worker shutdown: wait for borrowed connections, then close them all."""
+    global _db_pool
+    if _db_pool is None or _db_pool_pid != os.getpid():
+        return
+    deadline = time.monotonic() + DB_POOL_DRAIN_TIMEOUT
+    acquired = 0
+    for _ in range(DB_POOL_MAX):
+        if not _db_pool_slots.acquire(timeout=max(0, deadline - time.monotonic())):
+            log_event('db_pool_closing', level=logging.WARNING, in_use=DB_POOL_MAX - acquired)
+            break
+        acquired += 1
+    _db_pool.closeall()
+    _db_pool = None
+    for _ in range(acquired):
+        _db_pool_slots.release()
+
+atexit.register(close_db_pool)
+atexit.register(flush_metrics, force=True)
+
+# --- Schema Migrations ---
+# Applied in order by `flask --app app migrate`. Each entry runs once, in its own
+# transaction, and is recorded in schema_migrations. Only ever append to this list.
+SCHEMA_MIGRATIONS = [
+    ('0001_songs_spotify_artist_id', """
+        ALTER TABLE songs ADD COLUMN IF NOT EXISTS spotify_artist_id VARCHAR(100)
+    """),
+    ('0002_user_created_at_indexes', """
+        CREATE INDEX IF NOT EXISTS idx_movies_user_created ON movies (user_id, created_at DESC);
+        CREATE INDEX IF NOT EXISTS idx_songs_user_created ON songs (user_id, created_at DESC);
+        CREATE INDEX IF NOT EXISTS idx_bookmarks_user_created ON bookmarks (user_id, created_at DESC);
+        CREATE INDEX IF NOT EXISTS idx_books_user_created ON books (user_id, created_at DESC);
+    """),
+    # Keyset pagination orders by (created_at, id); widen the 0002 indexes to cover the tiebreaker.
+    ('0003_user_created_id_indexes', """
+        CREATE INDEX IF NOT EXISTS idx_movies_user_created_id ON movies (user_id, created_at DESC, id DESC);
+        CREATE INDEX IF NOT EXISTS idx_songs_user_created_id ON songs (user_id, created_at DESC, id DESC);
+        CREATE INDEX IF NOT EXISTS idx_bookmarks_user_created_id ON bookmarks (user_id, created_at DESC, id DESC);
+        CREATE INDEX IF NOT EXISTS idx_books_user_created_id ON books (user_id, created_at DESC, id DESC);
+        DROP INDEX IF EXISTS idx_movies_user_created;
+        DROP INDEX IF EXISTS idx_songs_user_created;
+        DROP INDEX IF EXISTS idx_bookmarks_user_created;
+        DROP INDEX IF EXISTS idx_books_user_created;
+    """),
+    ('0004_enrichment_jobs', """
+        ALTER TABLE movies ADD COLUMN IF NOT EXISTS enrichment_status VARCHAR(20);
+        ALTER TABLE songs ADD COLUMN IF NOT EXISTS enrichment_status VARCHAR(20);
+        CREATE TABLE IF NOT EXISTS enrichment_jobs (
+            id BIGSERIAL PRIMARY KEY,
+            section VARCHAR(20) NOT NULL,
+            item_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+            query TEXT NOT NULL,
+            status VARCHAR(20) NOT NULL DEFAULT 'queued',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            max_attempts INTEGER NOT NULL DEFAULT 5,
+            last_error TEXT,
+            run_after TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP
+        );
+        CREATE INDEX IF NOT EXISTS idx_enrichment_jobs_ready ON enrichment_jobs (run_after, id) WHERE status = 'queued';
+        CREATE INDEX IF NOT EXISTS idx_enrichment_jobs_running ON enrichment_jobs (updated_at) WHERE status = 'running';
+        CREATE INDEX IF NOT EXISTS idx_enrichment_jobs_item ON enrichment_jobs (section, item_id);
+    """),
+    # title_key is normalize_cache_key(title), computed in Python so both sides always agree.
+    ('0005_recommendation_queue', """
+        CREATE TABLE IF NOT EXISTS recommendation_exclusions (
+            user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+            category VARCHAR(20) NOT NULL,
+            title_key TEXT NOT NULL,
+            title TEXT NOT NULL,
+            created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (user_id, category, title_key)
+        );
+        CREATE TABLE IF NOT EXISTS recommendation_queue (
+            id BIGSERIAL PRIMARY KEY,
+            user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+            category VARCHAR(20) NOT NULL,
+            title_key TEXT NOT NULL,
+            based_on TEXT NOT NULL,
+            rank INTEGER NOT NULL,
+            payload JSONB NOT NULL,
+            served_at TIMESTAMP WITH TIME ZONE,
+            created_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE (user_id, category, title_key)
+        );
+        CREATE INDEX IF NOT EXISTS idx_recommendation_queue_next ON recommendation_queue (user_id, category, rank) WHERE served_at IS NULL;
+        CREATE TABLE IF NOT EXISTS recommendation_refreshes (
+            user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+            category VARCHAR(20) NOT NULL,
+            status VARCHAR(20) NOT NULL DEFAULT 'queued',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            last_error TEXT,
+            requested_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            run_after TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (user_id, category)
+        );
+        CREATE INDEX IF NOT EXISTS idx_recommendation_refreshes_ready ON recommendation_refreshes (run_after) WHERE status = 'queued';
+        CREATE INDEX IF NOT EXISTS idx_recommendation_refreshes_running ON recommendation_refreshes (updated_at) WHERE status = 'running';
+    """),
+    # Title search. btree_gin lets user_id lead each GIN index, so one user's
+    # matches are found without touching anybody else's rows. Queries must use
+    # the same expressions: to_tsvector('simple', title) and lower(title).
+    ('0006_title_search_indexes', """
+        CREATE EXTENSION IF NOT EXISTS pg_trgm;
+        CREATE EXTENSION IF NOT EXISTS btree_gin;
+        CREATE INDEX IF NOT EXISTS idx_movies_user_title_fts ON movies USING gin (user_id, to_tsvector('simple', title));
+        CREATE INDEX IF NOT EXISTS idx_movies_user_title_trgm ON movies USING gin (user_id, lower(title) gin_trgm_ops);
+        CREATE INDEX IF NOT EXISTS idx_songs_user_title_fts ON songs USING gin (user_id, to_tsvector('simple', title));
+        CREATE INDEX IF NOT EXISTS idx_songs_user_title_trgm ON songs USING gin (user_id, lower(title) gin_trgm_ops);
+        CREATE INDEX IF NOT EXISTS idx_bookmarks_user_title_fts ON bookmarks USING gin (user_id, to_tsvector('simple', title));
+        CREATE INDEX IF NOT EXISTS idx_bookmarks_user_title_trgm ON bookmarks USING gin (user_id, lower(title) gin_trgm_ops);
+        CREATE INDEX IF NOT EXISTS idx_books_user_title_fts ON books USING gin (user_id, to_tsvector('simple', title));
+        CREATE INDEX IF NOT EXISTS idx_books_user_title_trgm ON books USING gin (user_id, lower(title) gin_trgm_ops);
+    """),
+    # Server-side sessions (SESSION_BACKEND=postgres). id is a SHA-256 of the
+    # cookie's session id, so a leaked table does not yield usable cookies.
+    ('0007_user_sessions', """
+        CREATE TABLE IF NOT EXISTS user_sessions (
+            id CHAR(64) PRIMARY KEY,
+            user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+            data TEXT NOT NULL,
+            expires_at TIMESTAMP WITH TIME ZONE NOT NULL,
+            updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+        );
+        CREATE INDEX IF NOT EXISTS idx_user_sessions_user ON user_sessions (user_id);
+        CREATE INDEX IF NOT EXISTS idx_user_sessions_expires ON user_sessions (expires_at);
+    """),
+    # Bumped with every change to a user's items; list views derive their ETags from it.
+    ('0008_user_items_version', """
+        ALTER TABLE users ADD COLUMN IF NOT EXISTS items_version BIGINT NOT NULL DEFAULT 0;
+    """),
+    # TMDB poster path; '' once a backfill found that the title has none.
+    ('0009_movies_poster_path', """
+        ALTER TABLE movies ADD COLUMN IF NOT EXISTS poster_path VARCHAR(255);
+        CREATE INDEX IF NOT EXISTS idx_movies_poster_backfill ON movies (id) WHERE tmdb_id IS NOT NULL AND poster_path IS NULL;
+    """),
+    # Tombstones for undo-able deletes. They live for seconds, so reads just
+    # filter them out and only the purge job gets an index, over tombstoned rows only.
+    ('0010_item_soft_delete', """
+        ALTER TABLE movies ADD COLUMN IF NOT EXISTS deleted_at TIMESTAMP WITH TIME ZONE;
+        ALTER TABLE songs ADD COLUMN IF NOT EXISTS deleted_at TIMESTAMP WITH TIME ZONE;
+        ALTER TABLE bookmarks ADD COLUMN IF NOT EXISTS deleted_at TIMESTAMP WITH TIME ZONE;
+        ALTER TABLE books ADD COLUMN IF NOT EXISTS deleted_at TIMESTAMP WITH TIME ZONE;
+        CREATE INDEX IF NOT EXISTS idx_movies_deleted_at ON movies (deleted_at) WHERE deleted_at IS NOT NULL;
+        CREATE INDEX IF NOT EXISTS idx_songs_deleted_at ON songs (deleted_at) WHERE deleted_at IS NOT NULL;
+        CREATE INDEX IF NOT EXISTS idx_bookmarks_deleted_at ON bookmarks (deleted_at) WHERE deleted_at IS NOT NULL;
+        CREATE INDEX IF NOT EXISTS idx_books_deleted_at ON books (deleted_at) WHERE deleted_at IS NOT NULL;
+    """),
+]
+
+def apply_migrations():
+    with get_db_connection() as conn:
+        if not conn:
+            raise RuntimeError("Database connection failed; migrations not applied.")
+        cursor = conn.cursor()
+        try:
+            cursor.execute("CREATE TABLE IF NOT EXISTS schema_migrations (name VARCHAR(255) PRIMARY KEY, applied_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP)")
+            conn.commit()
+            cursor.execute("SELECT name FROM schema_migrations")
+            applied = {row[0] for row in cursor.fetchall()}
+            for name, sql in SCHEMA_MIGRATIONS:
+                if name in applied:
+                    continue
+                cursor.execute(sql)
+                cursor.execute("INSERT INTO schema_migrations (name) VALUES (%s)", (name,))
+                conn.commit()
+                print(f"Applied migration {name}")
+        except psycopg2.Error:
+            conn.rollback()
+            raise
+        finally:
+            cursor.close()
+
+@app.cli.command('migrate')
+def migrate_command():
+    """Apply pending schema migrations."""
+    apply_migrations()
+
+# --- Server-Side Sessions ---
+# The cookie carries only a signed random session id; data lives in
+# SESSION_BACKEND, fronted by a short-lived in-process cache so most requests
+# resolve their session without a round trip. Stores key rows by a hash of the
+# id and return None (after logging) when they cannot answer.
+def _session_key(sid):
+    return hashlib.sha256(sid.encode()).hexdigest()
+
+class PostgresSessionStore:
+    def load(self, key):
+        """(data, expires_at) for a live session, or None."""
+        with get_db_connection() as conn:
+            if not conn:
+                return None
+            cursor = conn.cursor()
+            try:
+                cursor.execute("SELECT data, EXTRACT(EPOCH FROM expires_at) FROM user_sessions WHERE id = %s AND expires_at > NOW()", (key,))
+                row = cursor.fetchone()
+                conn.commit()
+                return (row[0], float(row[1])) if row else None
+            except psycopg2.Error as e:
+                conn.rollback()
+                log_event('session_store_error', level=logging.WARNING, operation='load', error=str(e))
+                return None
+            finally:
+                cursor.close()
+
+    def _write(self, operation, sql, params):
+        with get_db_connection() as conn:
+            if not conn:
+                return
+            cursor = conn.cursor()
+            try:
+                cursor.execute(sql, params)
+                # Prune on roughly 1% of writes, as the SQLite tiers do.
+                if operation == 'save' and random.random() < 0.01:
+                    cursor.execute("DELETE FROM user_sessions WHERE expires_at <= NOW()")
+                conn.commit()
+            except psycopg2.Error as e:
+                conn.rollback()
+                log_event('session_store_error', level=logging.WARNING, operation=operation, error=str(e))
+            finally:
+                cursor.close()
+
+    def save(self, key, data, user_id, expires_at):
+        self._write(
+            'save',
+            """
+            INSERT INTO user_sessions (id, user_id, data, expires_at) VALUES (%s, %s, %s, %s)
+            ON CONFLICT (id) DO UPDATE SET user_id = EXCLUDED.user_id, data = EXCLUDED.data, expires_at = EXCLUDED.expires_at, updated_at = NOW()
+            """,
+            (key, user_id, data, datetime.fromtimestamp(expires_at, timezone.utc)),
+        )
+
+    def delete(self, key):
+        self._write('delete', "DELETE FROM user_sessions WHERE id = %s", (key,))
+
+    def delete_for_user(self, user_id, keep=None):
+        self._write('revoke', "DELETE FROM user_sessions WHERE user_id = %s AND id IS DISTINCT FROM %s", (user_id, keep))
+
+class SQLiteSessionStore:
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=1)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS sessions (id TEXT PRIMARY KEY, user_id INTEGER, data TEXT NOT NULL, expires_at REAL NOT NULL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS sessions_user_id ON sessions (user_id)")
+            self._local.conn, self._local.pid = conn, os.getpid()
+        return conn
+
+    def load(self, key):
+        try:
+            row = self._conn().execute("SELECT data, expires_at FROM sessions WHERE id = ? AND expires_at > ?", (key, time.time())).fetchone()
+            return (row[0], row[1]) if row else None
+        except sqlite3.Error as e:
+            log_event('session_store_error', level=logging.WARNING, operation='load', error=str(e))
+            return None
+
+    def _write(self, operation, sql, params):
+        try:
+            conn = self._conn()
+            with conn:
+                conn.execute(sql, params)
+                if operation == 'save' and random.random() < 0.01:
+                    conn.execute("DELETE FROM sessions WHERE expires_at <= ?", (time.time(),))
+        except sqlite3.Error as e:
+            log_event('session_store_error', level=logging.WARNING, operation=operation, error=str(e))
+
+    def save(self, key, data, user_id, expires_at):
+        self._write('save', "INSERT OR REPLACE INTO sessions (id, user_id, data, expires_at) VALUES (?, ?, ?, ?)", (key, user_id, data, expires_at))
+
+    def delete(self, key):
+        self._write('delete', "DELETE FROM sessions WHERE id = ?", (key,))
+
+    def delete_for_user(self, user_id, keep=None):
+        self._write('revoke', "DELETE FROM sessions WHERE user_id = ? AND id IS NOT ?", (user_id, keep))
+
+class ServerSideSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid=None, expires_at=0.0):
+        def on_update(self):
+            self.modified = True
+            self.accessed = True
+        super().__init__(initial, on_update)
+        self.sid = sid or secrets.token_urlsafe(32)
+        self.new = sid is None
+        self.expires_at = expires_at
+        self.previous_sid = None
+        self.modified = False
+        self.accessed = False
+
+    def __getitem__(self, key):
+        self.accessed = True
+        return super().__getitem__(key)
+
+    def get(self, key, default=None):
+        self.accessed = True
+        return super().get(key, default)
+
+    def setdefault(self, key, default=None):
+        self.accessed = True
+        return super().setdefault(key, default)
+
+    def regenerate(self):
+        """Move the data to a fresh id (on login, logout, password change) so an old id cannot be replayed."""
+        if not self.new:
+            self.previous_sid = self.previous_sid or self.sid
+        self.sid = secrets.token_urlsafe(32)
+        self.new = True
+        self.modified = True
+
+class ServerSideSessionInterface(SessionInterface):
+    serializer = TaggedJSONSerializer()
+
+    def __init__(self, store):
+        self.store = store
+        self._front = TTLCache(SESSION_CACHE_MAX_ENTRIES)
+
+    def _signer(self, app):
+        return Signer(app.secret_key, salt='laterlist-session')
+
+    def _load(self, sid):
+        key = _session_key(sid)
+        record = self._front.get(key)
+        if record is None:
+            record = self.store.load(key)
+            if record is None:
+                return None
+            self._front.set_until(key, record, min(record[1], time.time() + SESSION_CACHE_TTL))
+        return record
+
+    def forget(self, sid):
+        key = _session_key(sid)
+        self._front.delete(key)
+        self.store.delete(key)
+
+    def revoke_user(self, user_id, keep_sid=None):
+        """Delete every stored session of user_id except keep_sid. Other workers drop theirs within SESSION_CACHE_TTL."""
+        self.store.delete_for_user(user_id, _session_key(keep_sid) if keep_sid else None)
+
+    def open_session(self, app, request):
+        cookie = request.cookies.get(self.get_cookie_name(app))
+        if cookie:
+            try:
+                sid = self._signer(app).unsign(cookie).decode()
+            except BadSignature:
+                sid = None
+            # Unsigned or tampered cookies never reach the store.
+            record = self._load(sid) if sid else None
+            if record:
+                return ServerSideSession(self.serializer.loads(record[0]), sid=sid, expires_at=record[1])
+        return ServerSideSession()
+
+    def save_session(self, app, session, response):
+        name, domain, path = self.get_cookie_name(app), self.get_cookie_domain(app), self.get_cookie_path(app)
+        if session.previous_sid:
+            self.forget(session.previous_sid)
+        if not session:
+            if not session.new:
+                self.forget(session.sid)
+            if session.modified:
+                response.delete_cookie(name, domain=domain, path=path, secure=self.get_cookie_secure(app), samesite=self.get_cookie_samesite(app), httponly=self.get_cookie_httponly(app))
+            return
+        if session.accessed:
+            response.vary.add('Cookie')
+        now = time.time()
+        lifetime = app.permanent_session_lifetime.total_seconds()
+        if not session.modified and session.expires_at - now > lifetime - SESSION_REFRESH_AFTER:
+            return
+        expires_at = now + lifetime
+        data = self.serializer.dumps(dict(session))
+        key = _session_key(session.sid)
+        self.store.save(key, data, session.get('user_id'), expires_at)
+        self._front.set_until(key, (data, expires_at), min(expires_at, now + SESSION_CACHE_TTL))
+        response.set_cookie(
+            name, self._signer(app).sign(session.sid).decode(), expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app), domain=domain, path=path,
+            secure=self.get_cookie_secure(app), samesite=self.get_cookie_samesite(app),
+        )
+
+if SESSION_BACKEND in ('postgres', 'sqlite'):
+    app.session_interface = ServerSideSessionInterface(PostgresSessionStore() if SESSION_BACKEND == 'postgres' else SQLiteSessionStore(SESSION_SQLITE_PATH))
+
+def rotate_session():
+    """Give the current session a new id; a no-op for cookie sessions."""
+    if isinstance(session._get_current_object(), ServerSideSession):
+        session.regenerate()
+
+def revoke_user_sessions(user_id, keep_current=True):
+    if isinstance(app.session_interface, ServerSideSessionInterface):
+        app.session_interface.revoke_user(user_id, session.sid if keep_current else None)
+
+# --- User Profiles ---
+# id, username and role per user, read through the response cache so auth and
+# role checks on the hot path skip the database. {} marks a deleted user.
+def load_user_profile(user_id):
+    with get_db_connection() as conn:
+        if not conn:
+            return None
+        cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        try:
+            cursor.execute("SELECT id, username, is_admin FROM users WHERE id = %s", (user_id,))
+            row = cursor.fetchone()
+            conn.commit()
+            return user_profile(row) if row else {}
+        except psycopg2.Error:
+            conn.rollback()
+            return None
+        finally:
+            cursor.close()
+
+def user_profile(row):
+    return {'id': row['id'], 'username': row['username'], 'is_admin': bool(row['is_admin']) or row['username'] in ADMIN_USERNAMES}
+
+def get_user_profile(user_id):
+    return cached_call('user_profile', user_id, USER_PROFILE_CACHE_TTL, lambda: load_user_profile(user_id))
+
+def invalidate_user_profile(user_id):
+    invalidate_cached('user_profile', user_id)
+
+@app.before_request
+def _load_current_user():
+    g.current_user = None
+    user_id = session.get('user_id')
+    if user_id is None:
+        return
+    profile = get_user_profile(user_id)
+    if profile == {}:
+        # The account is gone; drop its session.
+        session.clear()
+        return
+    # If the profile cannot be read right now, fall back to what the session says, without admin rights.
+    g.current_user = profile or {'id': user_id, 'username': session.get('username'), 'is_admin': False}
+
+def current_user_is_admin():
+    return bool(g.get('current_user') and g.current_user['is_admin'])
+
+@app.context_processor
+def _inject_current_user():
+    return {'current_user': g.get('current_user'), 'is_admin': current_user_is_admin()}
+
+# --- HTTP Caching and Compression ---
+# The dashboard and listing APIs carry strong ETags built from the user's
+# items_version, so revalidation costs one primary-key read on users instead
+# of a scan of the item tables. Templates and code are folded in as well, so a
+# deploy invalidates every tag.
+def _render_version():
+    with open(__file__, 'rb') as f:
+        digest = hashlib.sha256(f.read())
+    template_dir = os.path.join(app.root_path, app.template_folder)
+    for name in sorted(os.listdir(template_dir)):
+        with open(os.path.join(template_dir, name), 'rb') as f:
+            digest.update(name.encode() + f.read())
+    return digest.hexdigest()[:16]
+
+_RENDER_VERSION = _render_version()
+
+def bump_items_version(cursor, user_id):
+    """Invalidate the user's list ETags; call in the transaction that changes their items."""
+    cursor.execute("UPDATE users SET items_version = items_version + 1 WHERE id = %s", (user_id,))
+
+def get_items_version(cursor, user_id):
+    try:
+        cursor.execute("SELECT items_version FROM users WHERE id = %s", (user_id,))
+        row = cursor.fetchone()
+    except psycopg2.Error:
+        cursor.connection.rollback()
+        return None
+    return row['items_version'] if row else None
+
+def _matching_etag(etag):
+    # Compressed bodies are tagged per encoding (see _compress_response); any of them is current.
+    for candidate in (etag, f"{etag}-gzip", f"{etag}-br"):
+        if request.if_none_match.contains(candidate):
+            return candidate
+    return None
+
+def conditional_items_response(user_id, build, *vary_on):
+    """304 when the client's copy of this view of user_id's items is current, else build(cursor) tagged with a strong ETag.
+
+    items_version is read on the same pooled connection that build(cursor) then
+    queries, so a revalidation costs one statement and a full render one more
+    than build's own. cursor is None if the database is unreachable. Views that
+    flash a message are never tagged, so the message is not cached away.
+    """
+    with get_db_connection() as conn:
+        cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) if conn else None
+        try:
+            version = get_items_version(cursor, user_id) if cursor and '_flashes' not in session else None
+            etag = None
+            if version is not None:
+                etag = hashlib.sha256(f"{user_id}:{version}:{_RENDER_VERSION}:{request.full_path}:{':'.join(map(str, vary_on))}".encode()).hexdigest()[:32]
+                matched = _matching_etag(etag)
+                if matched:
+                    response = Response(status=304)
+                    response.set_etag(matched)
+                    response.headers['Cache-Control'] = 'private, no-cache'
+                    return response
+            response = make_response(build(cursor))
+        finally:
+            if cursor:
+                cursor.close()
+    if etag and response.status_code == 200 and '_flashes' not in session:
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+@app.after_request
+def _compress_response(response):
+    if (
+        response.status_code != 200 or response.direct_passthrough or response.is_streamed
+        or 'Content-Encoding' in response.headers or response.mimetype not in COMPRESSIBLE_MIMETYPES
+    ):
+        return response
+    data = response.get_data()
+    if len(data) < COMPRESS_MIN_SIZE:
+        return response
+    response.vary.add('Accept-Encoding')
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        encoding, body = 'br', brotli.compress(data, quality=COMPRESS_BROTLI_QUALITY)
+    elif accepted['gzip']:
+        encoding, body = 'gzip', gzip.compress(data, compresslevel=COMPRESS_GZIP_LEVEL)
+    else:
+        return response
+    response.set_data(body)
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag:
+        response.set_etag(f"{etag}-{encoding}", weak)
+    return response
+
+# Static URLs carry a content hash (?v=...), so matching requests can be cached for good.
+_static_hashes = {}
+
+def static_file_hash(filename):
+    path = os.path.join(app.static_folder, filename)
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return None
+    cached = _static_hashes.get(filename)
+    if cached is None or cached[0] != mtime:
+        with open(path, 'rb') as f:
+            cached = _static_hashes[filename] = (mtime, hashlib.sha256(f.read()).hexdigest()[:12])
+    return cached[1]
+
+@app.url_defaults
+def _static_cache_buster(endpoint, values):
+    if endpoint == 'static' and 'filename' in values and 'v' not in values:
+        content_hash = static_file_hash(values['filename'])
+        if content_hash:
+            values['v'] = content_hash
+
+@app.after_request
+def _static_cache_headers(response):
+    if request.endpoint == 'static' and response.status_code in (200, 304):
+        filename = (request.view_args or {}).get('filename')
+        if filename and request.args.get('v') == static_file_hash(filename):
+            response.headers['Cache-Control'] = f"public, max-age={STATIC_MAX_AGE}, immutable"
+    return response
+
+# --- Image Proxy ---
+# /img/<width>/<token> fetches an album-art or poster image once, stores a
+# WebP thumbnail under IMAGE_CACHE_DIR and serves it as immutable. Tokens are
+# signed source URLs, so the endpoint cannot be used as an open proxy. Files
+# are named by a hash of (source URL, width); the CDN URLs never change
+# content, so that name addresses the content. Least recently served files
+# are pruned on a background thread once the directory passes IMAGE_CACHE_MAX_BYTES.
+_image_cache_written = 0
+_image_cache_lock = threading.Lock()
+_image_prune_running = False
+
+def _image_signer():
+    return Signer(app.secret_key, salt='laterlist-image')
+
+def image_proxy_url(source_url, width=IMAGE_SIZES[0]):
+    """Proxied thumbnail URL for an allowed CDN image; None for anything else."""
+    if not source_url or urlparse(source_url).hostname not in IMAGE_PROXY_HOSTS:
+        return None
+    token = _image_signer().sign(base64.urlsafe_b64encode(source_url.encode()).rstrip(b'=')).decode()
+    return url_for('image_proxy', width=width, token=token)
+
+def item_image_url(section, details, width=IMAGE_SIZES[0]):
+    if section == 'songs':
+        return image_proxy_url(details.get('album_art_url'), width)
+    if section == 'movies' and details.get('poster_path'):
+        # TMDB serves fixed widths; take the smallest that covers the thumbnail.
+        return image_proxy_url(f"{TMDB_IMAGE_BASE}/w{185 if width <= 160 else 342}{details['poster_path']}", width)
+    return None
+
+app.jinja_env.globals['item_image_url'] = item_image_url
+
+def _image_cache_path(source_url, width):
+    key = hashlib.sha256(f"{width}:{source_url}".encode()).hexdigest()
+    return os.path.join(IMAGE_CACHE_DIR, key[:2], key)
+
+def _find_cached_image(base_path):
+    for extension, mimetype in (('.webp', 'image/webp'), ('.jpg', 'image/jpeg'), ('.png', 'image/png')):
+        if os.path.exists(base_path + extension):
+            return base_path + extension, mimetype
+    return None
+
+def _render_thumbnail(data, content_type, width):
+    """(bytes, extension) for a WebP thumbnail `width` pixels wide, or the original when it cannot be resized."""
+    if Image is not None:
+        try:
+            image = Image.open(io.BytesIO(data))
+            image.thumbnail((width, width * 2))
+            if image.mode not in ('RGB', 'RGBA'):
+                image = image.convert('RGBA' if 'transparency' in image.info else 'RGB')
+            output = io.BytesIO()
+            image.save(output, 'WEBP', quality=IMAGE_WEBP_QUALITY, method=4)
+            return output.getvalue(), '.webp'
+        except (OSError, ValueError, KeyError, Image.DecompressionBombError) as e:
+            log_event('image_resize_failed', level=logging.WARNING, error=str(e))
+    return data, '.png' if content_type == 'image/png' else '.jpg'
+
+def _store_cached_image(base_path, body, extension):
+    global _image_cache_written
+    os.makedirs(os.path.dirname(base_path), exist_ok=True)
+    temp_path = f"{base_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(temp_path, 'wb') as f:
+        f.write(body)
+    os.replace(temp_path, base_path + extension)
+    with _image_cache_lock:
+        _image_cache_written += len(body)
+        # Rescan the directory after every ~5% of the cap written by this process.
+        prune = _image_cache_written >= IMAGE_CACHE_MAX_BYTES // 20 and not _image_prune_running
+        if prune:
+            _image_cache_written = 0
+    if prune:
+        _background_executor.submit(_prune_image_cache_in_background)
+
+def _prune_image_cache_in_background():
+    global _image_prune_running
+    with _image_cache_lock:
+        if _image_prune_running:
+            return
+        _image_prune_running = True
+    try:
+        prune_image_cache()
+    except Exception as e:
+        log_event('image_cache_prune_failed', level=logging.WARNING, error=str(e))
+    finally:
+        with _image_cache_lock:
+            _image_prune_running = False
+
+def prune_image_cache():
+    """Delete the least recently served files until the cache is under 90% of IMAGE_CACHE_MAX_BYTES."""
+    files, total = [], 0
+    for root, _, names in os.walk(IMAGE_CACHE_DIR):
+        for name in names:
+            path = os.path.join(root, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+    if total <= IMAGE_CACHE_MAX_BYTES:
+        return
+    for _, size, path in sorted(files):
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total -= size
+        if total <= IMAGE_CACHE_MAX_BYTES * 0.9:
+            break
+
+def _download_image(source_url):
+    """(body, content type) of a source image no larger than IMAGE_MAX_SOURCE_BYTES, or None.
+
+    Redirects are not followed, since they could leave IMAGE_PROXY_HOSTS. The body
+    is streamed and abandoned as soon as it passes the cap.
+    """
+    resp = upstream_request('images', 'GET', source_url, stream=True, allow_redirects=False)
+    if resp is None:
+        return None
+    with resp:
+        if resp.status_code != 200:
+            return None
+        declared = resp.headers.get('Content-Length', '')
+        if declared.isdigit() and int(declared) > IMAGE_MAX_SOURCE_BYTES:
+            return None
+        chunks, size = [], 0
+        try:
+            for chunk in resp.iter_content(64 * 1024):
+                size += len(chunk)
+                if size > IMAGE_MAX_SOURCE_BYTES:
+                    return None
+                chunks.append(chunk)
+        except requests.RequestException as e:
+            log_event('image_download_failed', level=logging.WARNING, error=e.__class__.__name__)
+            return None
+        return b''.join(chunks), resp.headers.get('Content-Type', '').split(';')[0]
+
+def fetch_cached_image(source_url, width):
+    """(path, mimetype) of the cached thumbnail, fetching it on a miss. None if the source is unavailable."""
+    base_path = _image_cache_path(source_url, width)
+    cached = _find_cached_image(base_path)
+    if cached:
+        return cached
+
+    def load():
+        cached = _find_cached_image(base_path)
+        if cached:
+            return cached
+        downloaded = _download_image(source_url)
+        if downloaded is None:
+            return None
+        body, extension = _render_thumbnail(*downloaded, width)
+        _store_cached_image(base_path, body, extension)
+        return _find_cached_image(base_path)
 
-# --- API Clients ---
-groq_client = None
-if GROQ_API_KEY:
+    return coalesced_call(f"image:{base_path}", load)
+
+@app.route('/img/<int:width>/<token>')
+def image_proxy(width, token):
+    if width not in IMAGE_SIZES:
+        return "Unsupported size", 404
     try:
-        groq_client = Groq(api_key=GROQ_API_KEY)
-        print("Groq client initialized successfully.")
-    except Exception as e:
-        print(f"Could not initialize Groq client: {e}")
+        encoded = _image_signer().unsign(token)
+        source_url = base64.urlsafe_b64decode(encoded + b'=' * (-len(encoded) % 4)).decode()
+    except (BadSignature, ValueError):
+        return "Not found", 404
+    if urlparse(source_url).hostname not in IMAGE_PROXY_HOSTS:
+        return "Not found", 404
+    try:
+        cached = fetch_cached_image(source_url, width)
+    except OSError as e:
+        log_event('image_cache_error', level=logging.WARNING, error=str(e))
+        cached = None
+    if cached is None:
+        # Let the browser try the CDN itself rather than show a broken image.
+        return redirect(source_url, code=302)
+    path, mimetype = cached
+    try:
+        os.utime(path)  # recency for LRU pruning
+    except OSError:
+        pass
+    response = send_file(path, mimetype=mimetype, conditional=True, etag=False)
+    response.headers['Cache-Control'] = f"public, max-age={STATIC_MAX_AGE}, immutable"
+    return response
 
-def get_db_connection():
+# --- Spotify Token Cache ---
+# Client-credentials tokens live for an hour; reuse them and refresh shortly
+# before expiry. The lock makes refreshes single-flight within a worker, and the
+# optional SPOTIFY_TOKEN_CACHE_FILE shares one token across gunicorn workers.
+_spotify_token = {'access_token': None, 'expires_at': 0.0}
+_spotify_token_lock = threading.Lock()
+
+def _spotify_token_is_fresh(token_data, margin=SPOTIFY_TOKEN_REFRESH_MARGIN):
+    return bool(token_data.get('access_token')) and time.time() < token_data.get('expires_at', 0) - margin
+
+def _read_shared_spotify_token():
+    if not SPOTIFY_TOKEN_CACHE_FILE:
+        return None
     try:
-        conn = psycopg2.connect(os.getenv('DATABASE_URL'))
-        return conn
-    except psycopg2.OperationalError as e:
-        print(f"Error connecting to PostgreSQL: {e}")
+        with open(SPOTIFY_TOKEN_CACHE_FILE) as f:
+            token_data = json.load(f)
+        return token_data if _spotify_token_is_fresh(token_data) else None
+    except (OSError, ValueError):
         return None
 
-def get_spotify_token():
-    if not SPOTIFY_CLIENT_ID or not SPOTIFY_CLIENT_SECRET:
-        print("Spotify credentials are not configured.")
-        return None
-    auth_url = 'https://accounts.spotify.com/api/token'
-    response = requests.post(auth_url, {
+def _write_shared_spotify_token(token_data):
+    if not SPOTIFY_TOKEN_CACHE_FILE:
+        return
+    tmp_path = f"{SPOTIFY_TOKEN_CACHE_FILE}.{os.getpid()}.tmp"
+    try:
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w') as f:
+            json.dump(token_data, f)
+        os.replace(tmp_path, SPOTIFY_TOKEN_CACHE_FILE)
+    except OSError as e:
+        log_event('spotify_token_cache_write_failed', level=logging.WARNING, error=str(e))
+
+@contextmanager
+def _shared_spotify_token_lock():
+    """Cross-process lock so only one worker refreshes the shared token at a time."""
+    if not SPOTIFY_TOKEN_CACHE_FILE or fcntl is None:
+        yield
+        return
+    try:
+        lock_file = open(f"{SPOTIFY_TOKEN_CACHE_FILE}.lock", 'a')
+    except OSError:
+        yield
+        return
+    try:
+        # Poll rather than block, so under gevent the wait yields to other requests.
+        while True:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                time.sleep(0.05)
+        yield
+    finally:
+        fcntl.flock(lock_file, fcntl.LOCK_UN)
+        lock_file.close()
+
+def _request_spotify_token():
+    auth_url = f"{SPOTIFY_ACCOUNTS_BASE}/api/token"
+    response = upstream_request('spotify_accounts', 'POST', auth_url, session=token_http_session, data={
         'grant_type': 'client_credentials',
         'client_id': SPOTIFY_CLIENT_ID,
         'client_secret': SPOTIFY_CLIENT_SECRET,
     })
-    if response.status_code != 200:
-        print(f"Failed to get Spotify token: {response.text}")
+    if response is None or response.status_code != 200:
+        log_event('spotify_token_failed', level=logging.ERROR, response=response.text if response is not None else None)
+        return None
+    payload = response.json()
+    if not payload.get('access_token'):
+        return None
+    return {'access_token': payload['access_token'], 'expires_at': time.time() + int(payload.get('expires_in', 3600))}
+
+def get_spotify_token():
+    if not SPOTIFY_CLIENT_ID or not SPOTIFY_CLIENT_SECRET:
+        log_event('spotify_not_configured', level=logging.WARNING)
+        return None
+    global _spotify_token
+    if _spotify_token_is_fresh(_spotify_token):
+        return _spotify_token['access_token']
+    with _spotify_token_lock:
+        if _spotify_token_is_fresh(_spotify_token):
+            return _spotify_token['access_token']
+        with _shared_spotify_token_lock():
+            token_data = _read_shared_spotify_token() or _request_spotify_token()
+            if token_data:
+                _write_shared_spotify_token(token_data)
+        if token_data:
+            _spotify_token = token_data
+            return token_data['access_token']
+        # Refresh failed; keep using the old token until it actually expires.
+        if _spotify_token_is_fresh(_spotify_token, margin=0):
+            return _spotify_token['access_token']
         return None
-    return response.json().get('access_token')
 
 def extract_spotify_track_id(input_text):
     """Extract Spotify track ID from a URL/URI/raw ID string."""
@@ -86,42 +2156,329 @@ def build_spotify_markets_to_try():
     return markets_to_try
 
 def fetch_spotify_track_by_id(token, track_id, market=None):
+    """Track JSON for an ID, cached per (track_id, market). None if unavailable."""
+    def load():
+        headers = {"Authorization": f"Bearer {token}"}
+        url = f"{SPOTIFY_API_BASE}/v1/tracks/{track_id}"
+        params = {'market': market} if market else None
+        resp = upstream_request('spotify', 'GET', url, headers=headers, params=params)
+        if resp is None or resp.status_code != 200:
+            return None
+        return resp.json()
+    return cached_call('spotify_track', f"{track_id}:{market or '-'}", SPOTIFY_TRACK_CACHE_TTL, load)
+
+def spotify_primary_artist_id(track_json):
+    artists = (track_json or {}).get('artists') or []
+    return artists[0].get('id') if artists else None
+
+def _search_spotify_track_in_market(token, q, market=None):
     headers = {"Authorization": f"Bearer {token}"}
-    url = f"https://api.spotify.com/v1/tracks/{track_id}"
+    params = {'q': q, 'type': 'track', 'limit': 5}
     if market:
-        url += f"?market={market}"
-    resp = requests.get(url, headers=headers)
-    if resp.status_code != 200:
+        params['market'] = market
+    resp = upstream_request('spotify', 'GET', f"{SPOTIFY_API_BASE}/v1/search", headers=headers, params=params)
+    if resp is None or resp.status_code != 200:
         return None
-    return resp.json()
+    items = (resp.json() or {}).get('tracks', {}).get('items', [])
+    return items[0] if items else None
 
 def search_spotify_track(token, query):
-    """Try searching across primary and fallback markets; return the best first match JSON or None."""
-    headers = {"Authorization": f"Bearer {token}"}
-    markets_to_try = build_spotify_markets_to_try()
+    """Search primary and fallback markets concurrently; return the best first match JSON or None."""
     queries = [query, f'track:"{query}"'] if query else []
-    for market in markets_to_try:
-        for q in queries:
-            url = (
-                f"https://api.spotify.com/v1/search?q={requests.utils.quote(q)}&type=track&limit=5&market={market}"
-            )
-            resp = requests.get(url, headers=headers)
-            if resp.status_code != 200:
-                continue
-            items = (resp.json() or {}).get('tracks', {}).get('items', [])
-            if items:
-                return items[0]
-    # As a last resort, try without market parameter
-    for q in queries:
-        url = f"https://api.spotify.com/v1/search?q={requests.utils.quote(q)}&type=track&limit=5"
-        resp = requests.get(url, headers=headers)
-        if resp.status_code != 200:
+    markets = build_spotify_markets_to_try()
+    # Preference order: each market with both query variants, then no market as a last resort.
+    attempts = [(q, market) for market in markets for q in queries] + [(q, None) for q in queries]
+    return cached_call(
+        'spotify_search', f"{normalize_cache_key(query)}:{','.join(markets)}", SPOTIFY_SEARCH_CACHE_TTL,
+        lambda: first_acceptable_result([lambda q=q, market=market: _search_spotify_track_in_market(token, q, market) for q, market in attempts]),
+    )
+
+def fetch_spotify_track_any_market(token, track_id):
+    """Fetch a track by ID, trying every market (then none) concurrently in preference order."""
+    markets = build_spotify_markets_to_try() + [None]
+    return first_acceptable_result([lambda market=market: fetch_spotify_track_by_id(token, track_id, market=market) for market in markets])
+
+def fetch_spotify_recommendations(token, spotify_id, market):
+    """One market's /v1/recommendations call, summarized as {'market', 'status', 'tracks', 'error'}.
+
+    Successful results are cached per (spotify_id, market); failures are returned but not cached.
+    """
+    failure = {}
+    def load():
+        result = _fetch_spotify_recommendations(token, spotify_id, market)
+        if result['status'] == 200:
+            return result
+        failure['result'] = result
+        return None
+    return cached_call('spotify_recs', f"{spotify_id}:{market}", SPOTIFY_RECS_CACHE_TTL, load) or failure['result']
+
+def _fetch_spotify_recommendations(token, spotify_id, market):
+    headers = {"Authorization": f"Bearer {token}"}
+    rec_url = f"{SPOTIFY_API_BASE}/v1/recommendations"
+    resp = upstream_request('spotify', 'GET', rec_url, headers=headers, params={'seed_tracks': spotify_id, 'limit': 5, 'market': market})
+    if resp is None:
+        return {'market': market, 'status': 504, 'tracks': [], 'error': 'Spotify did not respond.'}
+    if resp.status_code != 200:
+        return {'market': market, 'status': resp.status_code, 'tracks': [], 'error': resp.text}
+    try:
+        tracks = resp.json().get('tracks') or []
+    except Exception as e:
+        return {'market': market, 'status': 500, 'tracks': [], 'error': f"Invalid JSON from Spotify: {e}"}
+    return {'market': market, 'status': 200, 'tracks': tracks, 'error': None}
+
+def fetch_spotify_artist_top_tracks(token, artist_id, market):
+    """An artist's top tracks in a market, cached per (artist_id, market). Empty list if unavailable."""
+    def load():
+        headers = {"Authorization": f"Bearer {token}"}
+        top_tracks_url = f"{SPOTIFY_API_BASE}/v1/artists/{artist_id}/top-tracks"
+        resp = upstream_request('spotify', 'GET', top_tracks_url, headers=headers, params={'market': market})
+        if resp is None or resp.status_code != 200:
+            return None
+        return resp.json().get('tracks', [])
+    return cached_call('spotify_top_tracks', f"{artist_id}:{market}", SPOTIFY_RECS_CACHE_TTL, load) or []
+
+def spotify_tracks_to_recs(tracks, based_on_title, reason=None, skip_title=None):
+    rec_list = []
+    for track in tracks or []:
+        track_title = f"{track.get('name')} by {track.get('artists', [{}])[0].get('name', 'Unknown')}"
+        if track_title == skip_title:
             continue
-        items = (resp.json() or {}).get('tracks', {}).get('items', [])
-        if items:
-            return items[0]
+        link = track.get('external_urls', {}).get('spotify')
+        if link:
+            rec_list.append({'title': track_title, 'link': link, 'reason': reason or f"Because you liked {based_on_title}"})
+    return rec_list
+
+def tmdb_search_multi(query):
+    """TMDB /search/multi results for a title, cached by normalized query. None if TMDB is unavailable."""
+    def load():
+        resp = upstream_request('tmdb', 'GET', f"{TMDB_API_BASE}/3/search/multi", params={'api_key': TMDB_API_KEY, 'query': query})
+        if resp is None or resp.status_code != 200:
+            return None
+        return resp.json().get('results', [])
+    return cached_call('tmdb_search', normalize_cache_key(query), TMDB_SEARCH_CACHE_TTL, load)
+
+def tmdb_recommendations(media_type, tmdb_id):
+    """TMDB recommendations for a title, cached per (media_type, tmdb_id). None if TMDB is unavailable."""
+    def load():
+        resp = upstream_request('tmdb', 'GET', f"{TMDB_API_BASE}/3/{media_type}/{tmdb_id}/recommendations", params={'api_key': TMDB_API_KEY})
+        if resp is None or resp.status_code != 200:
+            return None
+        return resp.json().get('results', [])
+    return cached_call('tmdb_recs', f"{media_type}:{tmdb_id}", TMDB_RECS_CACHE_TTL, load)
+
+class UpstreamUnavailable(Exception):
+    """An upstream API could not be reached or refused us; retrying later may succeed."""
+    def __init__(self, message, status_code=502):
+        super().__init__(message)
+        self.status_code = status_code
+
+def lookup_movie(title):
+    """Best TMDB movie/TV match as item column values, or None if nothing matches."""
+    search_results = tmdb_search_multi(title)
+    if search_results is None:
+        raise UpstreamUnavailable('Movie search is unavailable right now.')
+    return movie_details(search_results)
+
+def movie_details(search_results):
+    """Item column values for the first movie/TV entry in TMDB search results, or None."""
+    best_match = next((item for item in search_results if item.get('media_type') in ['movie', 'tv']), None)
+    if not best_match:
+        return None
+    tmdb_id, media_type = best_match.get('id'), best_match.get('media_type')
+    return {
+        'title': best_match.get('title') or best_match.get('name'),
+        'link': f"https://www.themoviedb.org/{media_type}/{tmdb_id}",
+        'tmdb_id': tmdb_id,
+        'media_type': media_type,
+        'poster_path': best_match.get('poster_path') or '',
+    }
+
+def lookup_song(title):
+    """Spotify track for a link/URI/ID or free-text query as item column values, or None if nothing matches."""
+    token = get_spotify_token()
+    if not token:
+        raise UpstreamUnavailable('Spotify auth failed.', status_code=500)
+
+    # 1) If input is a link/URI/ID, try direct fetch with market fallbacks
+    track_json = None
+    track_id = extract_spotify_track_id(title)
+    if track_id:
+        track_json = fetch_spotify_track_any_market(token, track_id)
+
+    # 2) Otherwise, do robust search across markets
+    if not track_json:
+        track_json = search_spotify_track(token, title)
+
+    if not track_json:
+        return None
+    return song_details(track_json)
+
+def song_details(track_json):
+    """Item column values for a Spotify track JSON."""
+    song_name = track_json.get('name')
+    artist_name = (track_json.get('artists') or [{}])[0].get('name', 'Unknown Artist')
+    return {
+        'title': f"{song_name} by {artist_name}",
+        'link': (track_json.get('external_urls') or {}).get('spotify'),
+        'spotify_id': track_json.get('id'),
+        'album_art_url': (track_json.get('album') or {}).get('images', [{}])[0].get('url'),
+        'spotify_artist_id': spotify_primary_artist_id(track_json),
+    }
+
+def lookup_item_by_id(section, data):
+    """Details for an autocomplete pick (exact tmdb_id/media_type or spotify_id), skipping search.
+
+    Returns None when the request carries no usable ID; raises ValueError for malformed ones.
+    """
+    if section == 'movies' and data.get('tmdb_id'):
+        tmdb_id, media_type = int(data['tmdb_id']), data.get('media_type')
+        if media_type not in ('movie', 'tv'):
+            raise ValueError('media_type must be movie or tv.')
+        poster_path = data.get('poster_path')
+        if poster_path and not re.fullmatch(r'/[A-Za-z0-9_-]+\.(jpg|jpeg|png)', str(poster_path)):
+            raise ValueError('Invalid poster_path.')
+        details = {
+            'title': data.get('title'),
+            'link': f"https://www.themoviedb.org/{media_type}/{tmdb_id}",
+            'tmdb_id': tmdb_id,
+            'media_type': media_type,
+        }
+        if poster_path:
+            details['poster_path'] = poster_path
+        return details
+    if section == 'songs' and data.get('spotify_id'):
+        track_id = extract_spotify_track_id(str(data['spotify_id']))
+        if not track_id:
+            raise ValueError('Invalid spotify_id.')
+        token = get_spotify_token()
+        if not token:
+            raise UpstreamUnavailable('Spotify auth failed.', status_code=500)
+        # Usually a cache hit: autocomplete stores every track it returns.
+        track_json = fetch_spotify_track_any_market(token, track_id)
+        if not track_json:
+            raise UpstreamUnavailable('Could not load that track from Spotify.')
+        return song_details(track_json)
     return None
 
+def tmdb_autocomplete(query):
+    """Movie/TV candidates for a typed prefix. None if TMDB is unavailable."""
+    results = tmdb_search_multi(query)
+    if results is None:
+        return None
+    candidates = []
+    for item in results:
+        if item.get('media_type') not in ('movie', 'tv'):
+            continue
+        poster_path = item.get('poster_path')
+        candidates.append({
+            'title': item.get('title') or item.get('name'),
+            'year': (item.get('release_date') or item.get('first_air_date') or '')[:4] or None,
+            'tmdb_id': item.get('id'),
+            'media_type': item.get('media_type'),
+            'poster_path': poster_path,
+            'image_url': f"{TMDB_IMAGE_BASE}/w92{poster_path}" if poster_path else None,
+        })
+    return candidates[:AUTOCOMPLETE_LIMIT]
+
+def spotify_autocomplete(token, query):
+    """Track candidates for a typed prefix in the primary market. None if Spotify is unavailable."""
+    market = (build_spotify_markets_to_try() or [None])[0]
+
+    def load():
+        params = {'q': query, 'type': 'track', 'limit': AUTOCOMPLETE_LIMIT}
+        if market:
+            params['market'] = market
+        resp = upstream_request('spotify', 'GET', f"{SPOTIFY_API_BASE}/v1/search", headers={"Authorization": f"Bearer {token}"}, params=params)
+        if resp is None or resp.status_code != 200:
+            return None
+        tracks = (resp.json() or {}).get('tracks', {}).get('items', [])
+        for track in tracks:
+            cache_set('spotify_track', f"{track.get('id')}:-", track, SPOTIFY_TRACK_CACHE_TTL)
+        return [
+            {
+                'title': song_details(track)['title'],
+                'spotify_id': track.get('id'),
+                'image_url': ((track.get('album') or {}).get('images') or [{}])[-1].get('url'),
+            }
+            for track in tracks
+        ]
+    return cached_call('spotify_autocomplete', f"{normalize_cache_key(query)}:{market or '-'}", AUTOCOMPLETE_CACHE_TTL, load)
+
+def lookup_item_details(section, title):
+    """Column values for a new item in any section; None if an upstream lookup found no match."""
+    if section == 'movies':
+        return lookup_movie(title)
+    if section == 'songs':
+        return lookup_song(title)
+    return {'title': title, 'link': get_ai_generated_link(title, section)}
+
+def cached_item_details(section, title):
+    """(True, details or None) if lookup_item_details(section, title) can be answered without an upstream call, else (False, None)."""
+    if section == 'movies':
+        search_results = cache_get('tmdb_search', normalize_cache_key(title))
+        return (True, movie_details(search_results)) if search_results is not None else (False, None)
+    if section == 'songs':
+        if extract_spotify_track_id(title):
+            return False, None
+        # Same key search_spotify_track caches under.
+        track_json = cache_get('spotify_search', f"{normalize_cache_key(title)}:{','.join(build_spotify_markets_to_try())}")
+        return (True, song_details(track_json)) if track_json is not None else (False, None)
+    return True, lookup_item_details(section, title)
+
+def pending_item_details(section, title):
+    """Column values for an item saved as typed while the enrichment worker looks it up."""
+    return {'title': title, 'link': get_ai_generated_link(title, section), 'enrichment_status': 'pending'}
+
+def insert_item(cursor, user_id, section, details):
+    """Insert an item from lookup details (trusted column names) and return its id."""
+    columns = ['user_id'] + list(details)
+    cursor.execute(
+        f"INSERT INTO {section} ({', '.join(columns)}) VALUES ({', '.join(['%s'] * len(columns))}) RETURNING id",
+        [user_id] + list(details.values()),
+    )
+    item_id = cursor.fetchone()['id']
+    mark_recommendations_stale(cursor, user_id, section)
+    bump_items_version(cursor, user_id)
+    return item_id
+
+def mark_recommendations_stale(cursor, user_id, category, delay=RECS_REFRESH_DEBOUNCE, only_if_idle=False):
+    """Queue a rebuild of the user's recommendation queue, in the caller's transaction.
+
+    Repeated calls within `delay` seconds coalesce into one refresh. A refresh
+    already running is flagged to go round again once it finishes.
+    """
+    if category not in RECOMMENDATION_CATEGORIES:
+        return
+    cursor.execute(
+        f"""
+        INSERT INTO recommendation_refreshes (user_id, category, run_after) VALUES (%s, %s, CURRENT_TIMESTAMP + make_interval(secs => %s))
+        ON CONFLICT (user_id, category) DO UPDATE SET
+            status = CASE WHEN recommendation_refreshes.status = 'running' THEN 'running' ELSE 'queued' END,
+            attempts = 0, requested_at = CURRENT_TIMESTAMP, run_after = EXCLUDED.run_after, updated_at = CURRENT_TIMESTAMP
+        {"WHERE recommendation_refreshes.status NOT IN ('queued', 'running')" if only_if_idle else ""}
+        """,
+        (user_id, category, delay),
+    )
+
+def item_payload(section, item_id, details):
+    """The JSON shape the dashboard renders for an item."""
+    item = {'id': item_id, 'title': details['title'], 'link': details['link'], 'section': section}
+    if section == 'songs':
+        item['album_art_url'] = details.get('album_art_url')
+    item['image_url'] = item_image_url(section, details)
+    if details.get('enrichment_status'):
+        item['enrichment_status'] = details['enrichment_status']
+    return item
+
+MAX_LINK_LENGTH = 2048  # items.link is VARCHAR(2048)
+
+def is_http_url(value):
+    """True for an absolute http(s) URL that fits items.link; links render as hrefs, so nothing else is stored."""
+    if not isinstance(value, str) or not value or len(value) > MAX_LINK_LENGTH:
+        return False
+    parts = urlparse(value)
+    return parts.scheme in ('http', 'https') and bool(parts.netloc)
+
 def get_ai_generated_link(title, category):
     encoded_title = requests.utils.quote(title)
     if category == 'books':
@@ -132,33 +2489,195 @@ def get_ai_generated_link(title, category):
 def landing():
     return render_template("landing.html")
 
+def _item_columns(section):
+    return (
+        f"'{section}' AS section, id, title, link, {'album_art_url' if section == 'songs' else 'NULL::varchar'} AS album_art_url, "
+        f"{'poster_path' if section == 'movies' else 'NULL::varchar'} AS poster_path, "
+        f"{'enrichment_status' if section in ENRICHED_SECTIONS else 'NULL::varchar'} AS enrichment_status, created_at"
+    )
+
+def encode_page_cursor(row):
+    return base64.urlsafe_b64encode(f"{row['created_at'].isoformat()}|{row['id']}".encode()).decode()
+
+def decode_page_cursor(page_cursor):
+    """Return (created_at, id) from an encoded cursor, or raise ValueError."""
+    created_at, item_id = base64.urlsafe_b64decode(page_cursor.encode()).decode().rsplit('|', 1)
+    return datetime.fromisoformat(created_at), int(item_id)
+
+def fetch_dashboard_items(cursor, user_id, limit=HOME_PAGE_SIZE):
+    """Load the first page of every section in one round trip.
+
+    Returns ({section: [rows newest first]}, {section: next_cursor or None}).
+    Each branch of the UNION ALL is served by that table's (user_id, created_at DESC, id DESC) index.
+    """
+    branches = [
+        f"(SELECT {_item_columns(section)} FROM {section} WHERE user_id = %(user_id)s AND deleted_at IS NULL ORDER BY created_at DESC, id DESC LIMIT %(limit)s)"
+        for section in VALID_SECTIONS
+    ]
+    cursor.execute(" UNION ALL ".join(branches) + " ORDER BY created_at DESC, id DESC", {'user_id': user_id, 'limit': limit + 1})
+    user_data = {section: [] for section in VALID_SECTIONS}
+    for row in cursor.fetchall():
+        user_data[row['section']].append(row)
+    next_cursors = {}
+    for section, rows in user_data.items():
+        next_cursors[section] = encode_page_cursor(rows[limit - 1]) if len(rows) > limit else None
+        del rows[limit:]
+    return user_data, next_cursors
+
+def fetch_section_page(cursor, user_id, section, after=None, limit=HOME_PAGE_SIZE):
+    """One keyset page of a section, newest first. Returns (rows, next_cursor or None)."""
+    query = f"SELECT {_item_columns(section)} FROM {section} WHERE user_id = %s AND deleted_at IS NULL"
+    params = [user_id]
+    if after:
+        query += " AND (created_at, id) < (%s, %s)"
+        params.extend(after)
+    cursor.execute(query + " ORDER BY created_at DESC, id DESC LIMIT %s", params + [limit + 1])
+    rows = cursor.fetchall()
+    next_cursor = encode_page_cursor(rows[limit - 1]) if len(rows) > limit else None
+    return rows[:limit], next_cursor
+
+def build_prefix_tsquery(text):
+    """'star wa' -> 'star:* & wa:*', so every typed word matches as a prefix. '' if nothing searchable."""
+    return ' & '.join(f"{word}:*" for word in re.findall(r'\w+', text.lower()))
+
+def search_items(cursor, user_id, text, sections, offset=0, limit=SEARCH_PAGE_SIZE):
+    """Ranked title matches across sections. Returns (rows best first, has_more).
+
+    Word-prefix matches come from the tsvector index. From SEARCH_MIN_FUZZY_LENGTH
+    characters on, substring and trigram-similarity matches are added, so typos
+    and mid-word fragments still find the item.
+    """
+    text = text.strip().lower()
+    tsquery = build_prefix_tsquery(text)
+    fuzzy = len(text) >= SEARCH_MIN_FUZZY_LENGTH
+    conditions, score = [], []
+    if tsquery:
+        conditions.append("to_tsvector('simple', title) @@ to_tsquery('simple', %(tsquery)s)")
+        score.append("ts_rank(to_tsvector('simple', title), to_tsquery('simple', %(tsquery)s))")
+    if fuzzy:
+        conditions.extend(["lower(title) LIKE %(pattern)s", "lower(title) %% %(text)s"])
+        score.append("similarity(lower(title), %(text)s)")
+    if not conditions:
+        return [], False
+    branches = [
+        f"(SELECT {_item_columns(section)}, {' + '.join(score)} AS score FROM {section} WHERE user_id = %(user_id)s AND deleted_at IS NULL AND ({' OR '.join(conditions)}))"
+        for section in sections
+    ]
+    cursor.execute(f"SET LOCAL statement_timeout = {SEARCH_STATEMENT_TIMEOUT_MS}")
+    cursor.execute(
+        " UNION ALL ".join(branches) + " ORDER BY score DESC, created_at DESC, id DESC LIMIT %(limit)s OFFSET %(offset)s",
+        {
+            'user_id': user_id, 'tsquery': tsquery, 'text': text,
+            'pattern': '%' + text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%',
+            'limit': limit + 1, 'offset': offset,
+        },
+    )
+    rows = cursor.fetchall()
+    return rows[:limit], len(rows) > limit
+
 @app.route('/home')
 def index():
+    """Dashboard. Query budget: one pooled connection and two SQL statements per render.
+
+    The items_version read behind the ETag comes first, then fetch_dashboard_items.
+    A 304 revalidation stops after the first.
+    """
     if 'user_id' not in session:
         return redirect(url_for('login'))
     
     user_id = session['user_id']
-    user_data = {}
-    conn = get_db_connection()
-    if not conn:
-        flash("Database connection error.", "error")
-        return render_template('index.html', data={}, username=session.get('username'))
-    
+
+    def build(cursor):
+        user_data, next_cursors = {}, {}
+        if cursor is None:
+            flash("Database connection error.", "error")
+        else:
+            try:
+                user_data, next_cursors = fetch_dashboard_items(cursor, user_id)
+            except psycopg2.Error as e:
+                flash(f"Error fetching data: {e}", "error")
+        return render_template('index.html', data=user_data, next_cursors=next_cursors, username=session.get('username'))
+
+    # The page also shows the username and, for admins, the Admin link.
+    return conditional_items_response(user_id, build, session.get('username'), current_user_is_admin())
+
+@app.route('/api/items/<section>')
+def api_list_items(section):
+    """Keyset-paginated listing: ?cursor=<next_cursor from the previous page>&limit=<1..100>."""
+    if 'user_id' not in session: return jsonify({'status': 'error', 'message': 'Auth required.'}), 401
+    if section not in VALID_SECTIONS: return jsonify({'status': 'error', 'message': 'Invalid section.'}), 400
+    limit = max(1, min(request.args.get('limit', HOME_PAGE_SIZE, type=int), MAX_PAGE_SIZE))
+    after = None
+    if request.args.get('cursor'):
+        try:
+            after = decode_page_cursor(request.args['cursor'])
+        except (ValueError, UnicodeDecodeError):
+            return jsonify({'status': 'error', 'message': 'Invalid cursor.'}), 400
+
+    def build(cursor):
+        if cursor is None: return jsonify({'status': 'error', 'message': 'DB connection failed.'}), 500
+        try:
+            rows, next_cursor = fetch_section_page(cursor, session['user_id'], section, after=after, limit=limit)
+        except psycopg2.Error as e:
+            return jsonify({'status': 'error', 'message': f'DB error: {e}'}), 500
+        items = [item_payload(section, row['id'], row) for row in rows]
+        return jsonify({'status': 'success', 'items': items, 'next_cursor': next_cursor})
+
+    return conditional_items_response(session['user_id'], build)
+
+@app.route('/api/search')
+def api_search_items():
+    """Search-as-you-type over the user's titles: ?q=...&sections=movies,songs&cursor=...&limit=..."""
+    if 'user_id' not in session: return jsonify({'status': 'error', 'message': 'Authentication required.'}), 401
+    text = request.args.get('q', '').strip()
+    if not text: return jsonify({'status': 'error', 'message': 'A search query is required.'}), 400
+    requested = [section.strip() for section in request.args.get('sections', '').split(',') if section.strip()]
+    if any(section not in VALID_SECTIONS for section in requested):
+        return jsonify({'status': 'error', 'message': 'Invalid section.'}), 400
+    sections = requested or VALID_SECTIONS
     try:
-        cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-        for section in VALID_SECTIONS:
-            if section == 'songs':
-                cursor.execute(f"SELECT id, title, link, album_art_url FROM {section} WHERE user_id = %s ORDER BY created_at DESC", (user_id,))
-            else:
-                 cursor.execute(f"SELECT id, title, link FROM {section} WHERE user_id = %s ORDER BY created_at DESC", (user_id,))
-            user_data[section] = cursor.fetchall()
-    except psycopg2.Error as e:
-        flash(f"Error fetching data: {e}", "error")
-    finally:
-        if conn:
-            cursor.close()
-            conn.close()
-    return render_template('index.html', data=user_data, username=session.get('username'))
+        limit = max(1, min(int(request.args.get('limit', SEARCH_PAGE_SIZE)), MAX_PAGE_SIZE))
+        offset = int(base64.urlsafe_b64decode(request.args['cursor'].encode()).decode()) if request.args.get('cursor') else 0
+    except ValueError:
+        return jsonify({'status': 'error', 'message': 'Invalid pagination parameters.'}), 400
+    if not 0 <= offset <= SEARCH_MAX_OFFSET:
+        return jsonify({'status': 'error', 'message': 'Invalid pagination parameters.'}), 400
+
+    def build(cursor):
+        if cursor is None: return jsonify({'status': 'error', 'message': 'Database connection failed.'}), 500
+        try:
+            rows, has_more = search_items(cursor, session['user_id'], text, sections, offset=offset, limit=limit)
+        except psycopg2.extensions.QueryCanceledError:
+            return jsonify({'status': 'error', 'message': 'Search took too long; try a longer query.'}), 503
+        except psycopg2.Error as e:
+            return jsonify({'status': 'error', 'message': f'DB error: {e}'}), 500
+        items = [{**item_payload(row['section'], row['id'], row), 'score': round(row['score'], 4)} for row in rows]
+        next_offset = offset + len(rows)
+        next_cursor = base64.urlsafe_b64encode(str(next_offset).encode()).decode() if has_more and next_offset <= SEARCH_MAX_OFFSET else None
+        return jsonify({'status': 'success', 'items': items, 'next_cursor': next_cursor})
+
+    return conditional_items_response(session['user_id'], build)
+
+_autocomplete_limiter = KeyedTokenBuckets(AUTOCOMPLETE_REQUESTS_PER_SECOND, AUTOCOMPLETE_BURST)
+
+@app.route('/api/autocomplete/<section>')
+def api_autocomplete(section):
+    """Typeahead candidates (?q=) for movies or songs, each carrying the exact ID to add it by."""
+    if 'user_id' not in session: return jsonify({'status': 'error', 'message': 'Authentication required.'}), 401
+    if section not in AUTOCOMPLETE_SECTIONS: return jsonify({'status': 'error', 'message': 'Autocomplete is only available for movies and songs.'}), 400
+    query = normalize_cache_key(request.args.get('q', ''))
+    if len(query) < AUTOCOMPLETE_MIN_LENGTH:
+        return jsonify({'status': 'success', 'candidates': []})
+    if not _autocomplete_limiter.try_acquire(session['user_id']):
+        return jsonify({'status': 'error', 'message': 'Too many requests; slow down.'}), 429
+    if section == 'movies':
+        candidates = cached_call('tmdb_autocomplete', query, AUTOCOMPLETE_CACHE_TTL, lambda: tmdb_autocomplete(query))
+    else:
+        token = get_spotify_token()
+        candidates = spotify_autocomplete(token, query) if token else None
+    if candidates is None:
+        return jsonify({'status': 'error', 'message': 'Suggestions are unavailable right now.'}), 502
+    return jsonify({'status': 'success', 'candidates': candidates})
 
 @app.route('/api/add_item', methods=['POST'])
 def api_add_item():
@@ -166,246 +2685,813 @@ def api_add_item():
     data = request.get_json()
     section, title = data.get('section'), data.get('title')
     if not all([section, title]) or section not in VALID_SECTIONS: return jsonify({'status': 'error', 'message': 'Title and a valid Category are required.'}), 400
-    conn = get_db_connection()
-    if not conn: return jsonify({'status': 'error', 'message': 'Database connection failed.'}), 500
+
+    # Upstream lookups happen before a pooled connection is borrowed.
     try:
-        cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-        if section == 'movies':
-            search_url = f"https://api.themoviedb.org/3/search/multi?api_key={TMDB_API_KEY}&query={requests.utils.quote(title)}"
-            search_res = requests.get(search_url).json()
-            best_match = next((item for item in search_res.get('results', []) if item.get('media_type') in ['movie', 'tv']), None)
-            if not best_match: return jsonify({'status': 'error', 'message': f"Could not find '{title}'."}), 404
-            tmdb_id, media_type = best_match.get('id'), best_match.get('media_type')
-            item_title = best_match.get('title') or best_match.get('name')
-            link = f"https://www.themoviedb.org/{media_type}/{tmdb_id}"
-            query = "INSERT INTO movies (user_id, title, link, tmdb_id, media_type) VALUES (%s, %s, %s, %s, %s) RETURNING id"
-            cursor.execute(query, (session['user_id'], item_title, link, tmdb_id, media_type))
-            item = {'id': cursor.fetchone()['id'], 'title': item_title, 'link': link, 'section': section}
+        details = lookup_item_by_id(section, data)
+        if details is None:
+            if ASYNC_ENRICHMENT and section in ENRICHED_SECTIONS:
+                return add_pending_item(session['user_id'], section, title)
+            details = lookup_item_details(section, title)
+    except (ValueError, TypeError) as e:
+        return jsonify({'status': 'error', 'message': str(e) or 'Invalid item ID.'}), 400
+    except UpstreamUnavailable as e:
+        return jsonify({'status': 'error', 'message': str(e)}), e.status_code
+    if not details:
+        message = f"Could not find '{title}' on Spotify." if section == 'songs' else f"Could not find '{title}'."
+        return jsonify({'status': 'error', 'message': message}), 404
+
+    with get_db_connection() as conn:
+        if not conn: return jsonify({'status': 'error', 'message': 'Database connection failed.'}), 500
+        try:
+            cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+            item_id = insert_item(cursor, session['user_id'], section, details)
             conn.commit()
-            return jsonify({'status': 'success', 'message': f"Added '{item_title}'.", 'item': item})
-
-        elif section == 'songs':
-            token = get_spotify_token()
-            if not token:
-                return jsonify({'status': 'error', 'message': 'Spotify auth failed.'}), 500
-
-            headers = {"Authorization": f"Bearer {token}"}
-
-            # 1) If input is a link/URI/ID, try direct fetch with market fallbacks
-            track_json = None
-            track_id = extract_spotify_track_id(title)
-            if track_id:
-                for market in build_spotify_markets_to_try() + [None]:
-                    track_json = fetch_spotify_track_by_id(token, track_id, market=market)
-                    if track_json:
-                        break
-
-            # 2) Otherwise, do robust search across markets
-            if not track_json:
-                track_json = search_spotify_track(token, title)
-
-            if not track_json:
-                return jsonify({'status': 'error', 'message': f"Could not find '{title}' on Spotify."}), 404
-
-            spotify_id = track_json.get('id')
-            song_name = track_json.get('name')
-            artist_name = (track_json.get('artists') or [{}])[0].get('name', 'Unknown Artist')
-            album_art_url = (track_json.get('album') or {}).get('images', [{}])[0].get('url')
-            link = (track_json.get('external_urls') or {}).get('spotify')
-            item_title = f"{song_name} by {artist_name}"
-
-            query = "INSERT INTO songs (user_id, title, link, spotify_id, album_art_url) VALUES (%s, %s, %s, %s, %s) RETURNING id"
-            cursor.execute(query, (session['user_id'], item_title, link, spotify_id, album_art_url))
-            item = {'id': cursor.fetchone()['id'], 'title': item_title, 'link': link, 'section': section, 'album_art_url': album_art_url}
+        except psycopg2.Error as e:
+            conn.rollback()
+            return jsonify({'status': 'error', 'message': f'Database error: {e}'}), 500
+        finally:
+            cursor.close()
+    return jsonify({'status': 'success', 'message': f"Added '{details['title']}'.", 'item': item_payload(section, item_id, details)})
+
+def add_pending_item(user_id, section, title):
+    """Insert the item as typed, queue its enrichment job and answer 202 straight away."""
+    details = pending_item_details(section, title)
+    with get_db_connection() as conn:
+        if not conn: return jsonify({'status': 'error', 'message': 'Database connection failed.'}), 500
+        try:
+            cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+            item_id = insert_item(cursor, user_id, section, details)
+            cursor.execute(
+                "INSERT INTO enrichment_jobs (section, item_id, user_id, query, max_attempts) VALUES (%s, %s, %s, %s, %s)",
+                (section, item_id, user_id, title, ENRICHMENT_MAX_ATTEMPTS),
+            )
             conn.commit()
-            return jsonify({'status': 'success', 'message': f"Added '{item_title}'.", 'item': item})
+        except psycopg2.Error as e:
+            conn.rollback()
+            return jsonify({'status': 'error', 'message': f'Database error: {e}'}), 500
+        finally:
+            cursor.close()
+    return jsonify({'status': 'success', 'message': f"Added '{title}'. Looking it up...", 'item': item_payload(section, item_id, details)}), 202
+
+# --- Bulk Import ---
+# Lookups get their own executor: they fan out onto _fanout_executor internally,
+# and sharing one pool could deadlock with every worker waiting on its own subtasks.
+_import_executor = ThreadPoolExecutor(max_workers=IMPORT_LOOKUP_CONCURRENCY, thread_name_prefix='import')
+_import_rate_limiter = TokenBucket(IMPORT_LOOKUPS_PER_SECOND, max(1, IMPORT_LOOKUPS_PER_SECOND))
+
+class _BookmarkHTMLParser(HTMLParser):
+    """Incremental parser for Netscape-format browser bookmark exports."""
+    def __init__(self):
+        super().__init__()
+        self.bookmarks = []
+        self._href = None
+        self._text = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'a':
+            self._href = dict(attrs).get('href')
+            self._text = []
+
+    def handle_data(self, data):
+        if self._href is not None:
+            self._text.append(data)
+
+    def handle_endtag(self, tag):
+        if tag == 'a' and self._href is not None:
+            title = ''.join(self._text).strip() or self._href
+            self.bookmarks.append({'section': 'bookmarks', 'title': title, 'link': self._href})
+            self._href = None
+
+def _parse_bookmarks_html(stream):
+    parser = _BookmarkHTMLParser()
+    while True:
+        chunk = stream.read(64 * 1024)
+        if not chunk:
+            break
+        parser.feed(chunk)
+        yield from parser.bookmarks
+        parser.bookmarks.clear()
+    parser.close()
+    yield from parser.bookmarks
+
+def _parse_csv(stream, default_section):
+    reader = csv.DictReader(stream)
+    fields = {name.strip().lower(): name for name in reader.fieldnames or []}
+    for row in reader:
+        # Spotify playlist exports (e.g. Exportify) carry a track URI we can look up exactly.
+        if 'track uri' in fields or 'track name' in fields:
+            uri = (row.get(fields.get('track uri', '')) or '').strip()
+            name = (row.get(fields.get('track name', '')) or '').strip()
+            artist = (row.get(fields.get('artist name(s)', '')) or '').split(',')[0].strip()
+            yield {'section': 'songs', 'title': uri or f"{name} {artist}".strip()}
+            continue
+        section = (row.get(fields.get('section', '')) or default_section or '').strip().lower()
+        title = (row.get(fields.get('title', '')) or '').strip()
+        link = (row.get(fields.get('link', '')) or row.get(fields.get('url', '')) or '').strip()
+        yield {'section': section, 'title': title, 'link': link or None}
+
+def _parse_lines(stream, default_section):
+    for line in stream:
+        yield {'section': default_section, 'title': line.strip()}
+
+def iter_import_rows(upload, import_format, default_section):
+    """Stream-parse an uploaded import file into {'section', 'title', 'link'?} rows."""
+    filename = (upload.filename or '').lower()
+    if not import_format:
+        import_format = 'bookmarks_html' if filename.endswith(('.html', '.htm')) else 'csv' if filename.endswith('.csv') else 'text'
+    stream = io.TextIOWrapper(upload.stream, encoding='utf-8', errors='replace', newline='')
+    if import_format == 'bookmarks_html':
+        return _parse_bookmarks_html(stream)
+    if import_format == 'csv':
+        return _parse_csv(stream, default_section)
+    return _parse_lines(stream, default_section)
+
+def _import_lookup(row, deadline):
+    """Lookup for one import row; returns (details, error).
+
+    Cache hits are free. Misses are queued as pending items under
+    ASYNC_ENRICHMENT, or else wait for a rate-limiter token until `deadline`.
+    """
+    if row['section'] == 'bookmarks' and row.get('link'):
+        # _import_row_problem has already checked the link with is_http_url.
+        return {'title': row['title'], 'link': row['link']}, None
+    cached, details = cached_item_details(row['section'], row['title'])
+    if cached:
+        return details, None
+    if ASYNC_ENRICHMENT:
+        return pending_item_details(row['section'], row['title']), None
+    remaining = deadline - time.monotonic()
+    if remaining <= 0 or not _import_rate_limiter.acquire(timeout=min(FANOUT_DEADLINE, remaining)):
+        return None, 'Import time limit reached; import this row again.'
+    try:
+        return lookup_item_details(row['section'], row['title']), None
+    except UpstreamUnavailable as e:
+        return None, str(e)
+
+MAX_TITLE_LENGTH = 255  # items.title is VARCHAR(255)
 
-        else: # books, bookmarks
-            link = get_ai_generated_link(title, section)
-            query = f"INSERT INTO {section} (user_id, title, link) VALUES (%s, %s, %s) RETURNING id"
-            cursor.execute(query, (session['user_id'], title, link))
-            item = {'id': cursor.fetchone()['id'], 'title': title, 'link': link, 'section': section}
+def _import_row_problem(row):
+    """Normalize one import row in place; return why it cannot be imported, or None.
+
+    Checked per row because the insert is one execute_values per section: a
+    single bad value would otherwise fail the whole import.
+    """
+    title, section, link = row.get('title'), row.get('section'), row.get('link')
+    if not isinstance(title, str) or not title.strip() or not isinstance(section, str) or section not in VALID_SECTIONS:
+        return 'Title and a valid section are required.'
+    row['title'] = title.strip()
+    if len(row['title']) > MAX_TITLE_LENGTH:
+        return f'Titles can be at most {MAX_TITLE_LENGTH} characters.'
+    if section != 'bookmarks' or link in (None, ''):
+        row['link'] = None  # other sections get their link from the lookup
+    elif not is_http_url(link):
+        return f'Links must be http(s) URLs of at most {MAX_LINK_LENGTH} characters.'
+    return None
+
+def _identity_key(section, details):
+    if section == 'movies' and details.get('tmdb_id'):
+        return f"tmdb:{details['media_type']}:{details['tmdb_id']}"
+    if section == 'songs' and details.get('spotify_id'):
+        return f"spotify:{details['spotify_id']}"
+    return f"title:{normalize_cache_key(details['title'])}"
+
+def _existing_identity_keys(cursor, user_id, section, candidates):
+    """Identity keys among candidates that the user already has in this section."""
+    titles = [normalize_cache_key(details['title']) for details in candidates]
+    cursor.execute(f"SELECT title FROM {section} WHERE user_id = %s AND deleted_at IS NULL AND {NORMALIZED_TITLE_SQL} = ANY(%s)", (user_id, titles))
+    existing = {f"title:{normalize_cache_key(row['title'])}" for row in cursor.fetchall()}
+    if section == 'movies':
+        ids = [details['tmdb_id'] for details in candidates if details.get('tmdb_id')]
+        cursor.execute("SELECT tmdb_id, media_type FROM movies WHERE user_id = %s AND deleted_at IS NULL AND tmdb_id = ANY(%s)", (user_id, ids))
+        existing.update(f"tmdb:{row['media_type']}:{row['tmdb_id']}" for row in cursor.fetchall())
+    elif section == 'songs':
+        ids = [details['spotify_id'] for details in candidates if details.get('spotify_id')]
+        cursor.execute("SELECT spotify_id FROM songs WHERE user_id = %s AND deleted_at IS NULL AND spotify_id = ANY(%s)", (user_id, ids))
+        existing.update(f"spotify:{row['spotify_id']}" for row in cursor.fetchall())
+    return existing
+
+@app.route('/api/import', methods=['POST'])
+def api_bulk_import():
+    """Import many items at once.
+
+    Accepts JSON {"items": [{"section", "title", "link"?}, ...]} or a multipart
+    upload ("file", plus optional "section" and "format": text, csv or
+    bookmarks_html). Lookups run concurrently under a rate limit (see
+    _import_lookup), then every new row is inserted in one transaction, and
+    pending rows are queued for enrichment. Returns a result for each input row.
+    """
+    if 'user_id' not in session: return jsonify({'status': 'error', 'message': 'Auth required.'}), 401
+    user_id = session['user_id']
+    if 'file' in request.files:
+        default_section = request.form.get('section')
+        if default_section and default_section not in VALID_SECTIONS:
+            return jsonify({'status': 'error', 'message': 'Invalid section.'}), 400
+        rows = iter_import_rows(request.files['file'], request.form.get('format'), default_section)
+    else:
+        data = request.get_json(silent=True)
+        items = data.get('items', []) if isinstance(data, dict) else None
+        if not isinstance(items, list):
+            return jsonify({'status': 'error', 'message': 'Expected {"items": [...]}.'}), 400
+        rows = (
+            {'section': item.get('section'), 'title': item.get('title'), 'link': item.get('link')}
+            if isinstance(item, dict) else {'error': 'Each item must be an object.'}
+            for item in items
+        )
+
+    results, pending, seen_titles, truncated = [], [], set(), False
+    for row_number, row in enumerate(rows, start=1):
+        if row_number > IMPORT_MAX_ROWS:
+            truncated = True
+            break
+        result = {'row': row_number, 'section': row.get('section'), 'title': row.get('title')}
+        results.append(result)
+        if row.get('error'):
+            result.update(status='error', message=row['error'])
+            continue
+        problem = _import_row_problem(row)
+        if problem:
+            result.update(status='invalid', message=problem)
+            continue
+        result['title'] = row['title']
+        key = (row['section'], normalize_cache_key(row['title']))
+        if key in seen_titles:
+            result.update(status='duplicate', message='Duplicate within this import.')
+            continue
+        seen_titles.add(key)
+        pending.append((result, row))
+    if not results:
+        return jsonify({'status': 'error', 'message': 'Nothing to import.'}), 400
+
+    deadline = time.monotonic() + IMPORT_SYNC_DEADLINE
+    lookups = [future.result() for future in [submit_in_context(_import_executor, _import_lookup, row, deadline) for _, row in pending]]
+    to_insert = {section: [] for section in VALID_SECTIONS}
+    seen_identities = set()
+    for (result, row), (details, error) in zip(pending, lookups):
+        if error:
+            result.update(status='error', message=error)
+        elif not details:
+            result.update(status='not_found', message=f"Could not find '{row['title']}'.")
+        elif len(details['title'] or '') > MAX_TITLE_LENGTH or len(details.get('link') or '') > MAX_LINK_LENGTH:
+            result.update(status='invalid', message='The matched title or link is too long to store.')
+        elif (row['section'], _identity_key(row['section'], details)) in seen_identities:
+            result.update(status='duplicate', message='Duplicate within this import.')
+        else:
+            seen_identities.add((row['section'], _identity_key(row['section'], details)))
+            to_insert[row['section']].append((result, details))
+
+    with get_db_connection() as conn:
+        if not conn: return jsonify({'status': 'error', 'message': 'DB connection failed.'}), 500
+        try:
+            cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+            for section, entries in to_insert.items():
+                if not entries:
+                    continue
+                existing = _existing_identity_keys(cursor, user_id, section, [details for _, details in entries])
+                new_entries = []
+                for result, details in entries:
+                    if _identity_key(section, details) in existing:
+                        result.update(status='duplicate', title=details['title'], message='Already in your list.')
+                    else:
+                        new_entries.append((result, details))
+                if not new_entries:
+                    continue
+                # Looked-up and pending rows carry different columns; the rest stay NULL.
+                columns = ['user_id'] + list(dict.fromkeys(column for _, details in new_entries for column in details))
+                ids = psycopg2.extras.execute_values(
+                    cursor,
+                    f"INSERT INTO {section} ({', '.join(columns)}) VALUES %s RETURNING id",
+                    [[user_id] + [details.get(column) for column in columns[1:]] for _, details in new_entries],
+                    fetch=True,
+                )
+                jobs = []
+                for (result, details), row in zip(new_entries, ids):
+                    queued = details.get('enrichment_status') == 'pending'
+                    result.update(status='queued' if queued else 'imported', id=row['id'], title=details['title'], item=item_payload(section, row['id'], details))
+                    if queued:
+                        jobs.append((section, row['id'], user_id, details['title'], ENRICHMENT_MAX_ATTEMPTS))
+                if jobs:
+                    psycopg2.extras.execute_values(cursor, "INSERT INTO enrichment_jobs (section, item_id, user_id, query, max_attempts) VALUES %s", jobs)
+                mark_recommendations_stale(cursor, user_id, section)
+                bump_items_version(cursor, user_id)
             conn.commit()
-            return jsonify({'status': 'success', 'message': f"Added '{title}'.", 'item': item})
+        except psycopg2.Error as e:
+            conn.rollback()
+            log_event('bulk_import_failed', level=logging.ERROR, user_id=user_id, error=str(e))
+            return jsonify({'status': 'error', 'message': 'Could not save the import; nothing was added.'}), 500
+        finally:
+            cursor.close()
 
-    except psycopg2.Error as e:
-        conn.rollback()
-        return jsonify({'status': 'error', 'message': f'Database error: {e}'}), 500
-    finally:
-        if conn:
+    summary = {}
+    for result in results:
+        summary[result['status']] = summary.get(result['status'], 0) + 1
+    return jsonify({'status': 'success', 'summary': summary, 'truncated': truncated, 'results': results})
+
+@app.route('/api/items/<section>/<int:item_id>/enrichment')
+def api_enrichment_status(section, item_id):
+    """Poll target for pending items: enrichment_status is 'pending', 'failed' or 'done'."""
+    if 'user_id' not in session: return jsonify({'status': 'error', 'message': 'Auth required.'}), 401
+    if section not in VALID_SECTIONS: return jsonify({'status': 'error', 'message': 'Invalid section.'}), 400
+    with get_db_connection() as conn:
+        if not conn: return jsonify({'status': 'error', 'message': 'DB connection failed.'}), 500
+        try:
+            cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+            cursor.execute(
+                f"""SELECT {_item_columns(section)},
+                       (SELECT last_error FROM enrichment_jobs j WHERE j.section = %s AND j.item_id = i.id ORDER BY j.id DESC LIMIT 1) AS last_error
+                    FROM {section} AS i WHERE id = %s AND user_id = %s AND deleted_at IS NULL""",
+                (section, item_id, session['user_id']),
+            )
+            row = cursor.fetchone()
+        except psycopg2.Error as e:
+            return jsonify({'status': 'error', 'message': f'DB error: {e}'}), 500
+        finally:
+            cursor.close()
+    if not row: return jsonify({'status': 'error', 'message': 'Item not found.'}), 404
+    return jsonify({
+        'status': 'success',
+        'enrichment_status': row['enrichment_status'] or 'done',
+        'last_error': row['last_error'] if row['enrichment_status'] == 'failed' else None,
+        'item': item_payload(section, row['id'], row),
+    })
+
+def _group_item_refs(items):
+    """{section: [ids]} from a JSON list of {'section', 'id'}; raises ValueError if malformed."""
+    if not isinstance(items, list) or not items:
+        raise ValueError('Provide a non-empty "items" list.')
+    if len(items) > DELETE_BATCH_MAX:
+        raise ValueError(f'At most {DELETE_BATCH_MAX} items per request.')
+    grouped = {}
+    for item in items:
+        try:
+            section, item_id = item['section'], int(item['id'])
+        except (KeyError, TypeError, ValueError):
+            section = None
+        if section not in VALID_SECTIONS:
+            raise ValueError('Each item needs a valid "section" and "id".')
+        grouped.setdefault(section, set()).add(item_id)
+    return {section: sorted(ids) for section, ids in grouped.items()}
+
+def set_items_deleted(cursor, user_id, grouped, deleted):
+    """Tombstone (deleted=True) or restore the user's items, one statement per section, in the caller's transaction.
+
+    Restores only reach items deleted within DELETE_UNDO_WINDOW. Returns
+    (changed, unchanged) as lists of {'section', 'id'}.
+    """
+    changed, unchanged = [], []
+    for section, ids in grouped.items():
+        if deleted:
+            cursor.execute(
+                f"UPDATE {section} SET deleted_at = CURRENT_TIMESTAMP WHERE user_id = %s AND id = ANY(%s) AND deleted_at IS NULL RETURNING id",
+                (user_id, ids),
+            )
+        else:
+            cursor.execute(
+                f"""UPDATE {section} SET deleted_at = NULL WHERE user_id = %s AND id = ANY(%s)
+                    AND deleted_at > CURRENT_TIMESTAMP - make_interval(secs => %s) RETURNING id""",
+                (user_id, ids, DELETE_UNDO_WINDOW),
+            )
+        hit = {row[0] for row in cursor.fetchall()}
+        changed.extend({'section': section, 'id': item_id} for item_id in ids if item_id in hit)
+        unchanged.extend({'section': section, 'id': item_id} for item_id in ids if item_id not in hit)
+        if hit:
+            mark_recommendations_stale(cursor, user_id, section)
+    if changed:
+        bump_items_version(cursor, user_id)
+    return changed, unchanged
+
+def change_items_deleted(user_id, grouped, deleted):
+    """set_items_deleted in its own transaction; None if the database is unreachable."""
+    with get_db_connection() as conn:
+        if not conn:
+            return None
+        cursor = conn.cursor()
+        try:
+            outcome = set_items_deleted(cursor, user_id, grouped, deleted)
+            conn.commit()
+            return outcome
+        except psycopg2.Error:
+            conn.rollback()
+            raise
+        finally:
             cursor.close()
-            conn.close()
 
 @app.route('/api/delete_item/<section>/<int:item_id>', methods=['POST'])
 def api_delete_item(section, item_id):
     if 'user_id' not in session: return jsonify({'status': 'error', 'message': 'Auth required.'}), 401
     if section not in VALID_SECTIONS: return jsonify({'status': 'error', 'message': 'Invalid section.'}), 400
-    conn = get_db_connection()
-    if not conn: return jsonify({'status': 'error', 'message': 'DB connection failed.'}), 500
     try:
-        cursor = conn.cursor()
-        cursor.execute(f"DELETE FROM {section} WHERE id = %s AND user_id = %s", (item_id, session['user_id']))
-        conn.commit()
-        if cursor.rowcount == 0: return jsonify({'status': 'error', 'message': 'Item not found.'}), 404
+        outcome = change_items_deleted(session['user_id'], {section: [item_id]}, deleted=True)
     except psycopg2.Error as e:
         return jsonify({'status': 'error', 'message': f'DB error: {e}'}), 500
-    finally:
-        if conn:
+    if outcome is None: return jsonify({'status': 'error', 'message': 'DB connection failed.'}), 500
+    if not outcome[0]: return jsonify({'status': 'error', 'message': 'Item not found.'}), 404
+    return jsonify({'status': 'success', 'message': 'Item deleted.', 'undo_window': DELETE_UNDO_WINDOW})
+
+@app.route('/api/items/delete', methods=['POST'])
+def api_delete_items():
+    """Delete many items in one transaction: {"items": [{"section": "movies", "id": 1}, ...]}."""
+    if 'user_id' not in session: return jsonify({'status': 'error', 'message': 'Auth required.'}), 401
+    try:
+        grouped = _group_item_refs((request.get_json(silent=True) or {}).get('items'))
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    try:
+        outcome = change_items_deleted(session['user_id'], grouped, deleted=True)
+    except psycopg2.Error as e:
+        return jsonify({'status': 'error', 'message': f'DB error: {e}'}), 500
+    if outcome is None: return jsonify({'status': 'error', 'message': 'DB connection failed.'}), 500
+    deleted, missing = outcome
+    message = f"Deleted {len(deleted)} item{'s' if len(deleted) != 1 else ''}."
+    return jsonify({'status': 'success', 'message': message, 'deleted': deleted, 'not_found': missing, 'undo_window': DELETE_UNDO_WINDOW})
+
+@app.route('/api/items/restore', methods=['POST'])
+def api_restore_items():
+    """Undo deletes made in the last DELETE_UNDO_WINDOW seconds: {"items": [{"section": "movies", "id": 1}, ...]}."""
+    if 'user_id' not in session: return jsonify({'status': 'error', 'message': 'Auth required.'}), 401
+    try:
+        grouped = _group_item_refs((request.get_json(silent=True) or {}).get('items'))
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    try:
+        outcome = change_items_deleted(session['user_id'], grouped, deleted=False)
+    except psycopg2.Error as e:
+        return jsonify({'status': 'error', 'message': f'DB error: {e}'}), 500
+    if outcome is None: return jsonify({'status': 'error', 'message': 'DB connection failed.'}), 500
+    restored, missing = outcome
+    if not restored: return jsonify({'status': 'error', 'message': 'Too late to undo.'}), 410
+    return jsonify({'status': 'success', 'message': 'Restored.', 'restored': restored, 'not_found': missing})
+
+def pop_recommendations(cursor, user_id, category, limit=RECS_PER_REQUEST):
+    """Mark the next `limit` unseen, non-excluded queue entries served and return them.
+
+    Returns (rows best first, unseen entries left in the queue before this pop).
+    """
+    cursor.execute(
+        """
+        WITH next AS (
+            SELECT q.id FROM recommendation_queue q
+            WHERE q.user_id = %(user_id)s AND q.category = %(category)s AND q.served_at IS NULL
+              AND NOT EXISTS (
+                  SELECT 1 FROM recommendation_exclusions x
+                  WHERE x.user_id = q.user_id AND x.category = q.category AND x.title_key = q.title_key
+              )
+            ORDER BY q.rank
+            LIMIT %(limit)s
+            FOR UPDATE SKIP LOCKED
+        ), popped AS (
+            UPDATE recommendation_queue q SET served_at = CURRENT_TIMESTAMP
+            FROM next WHERE q.id = next.id
+            RETURNING q.rank, q.based_on, q.payload
+        )
+        SELECT popped.*, (
+            SELECT count(*) FROM recommendation_queue
+            WHERE user_id = %(user_id)s AND category = %(category)s AND served_at IS NULL
+        ) AS queued
+        FROM popped ORDER BY rank
+        """,
+        {'user_id': user_id, 'category': category, 'limit': limit},
+    )
+    rows = cursor.fetchall()
+    remaining = rows[0]['queued'] - len(rows) if rows else 0
+    return rows, remaining
+
+def load_recommendation_exclusions(cursor, user_id, category):
+    """{title_key: title} for everything that must not be recommended: exclusions plus already-served titles."""
+    cursor.execute(
+        """
+        SELECT title_key, title FROM recommendation_exclusions WHERE user_id = %(user_id)s AND category = %(category)s
+        UNION ALL
+        SELECT title_key, payload->>'title' FROM recommendation_queue WHERE user_id = %(user_id)s AND category = %(category)s AND served_at IS NOT NULL
+        """,
+        {'user_id': user_id, 'category': category},
+    )
+    return {row['title_key']: row['title'] for row in cursor.fetchall()}
+
+def record_served_recommendations(cursor, user_id, category, rec_list, based_on_title):
+    """Remember live recommendations as served so neither path repeats them."""
+    rows, seen = [], set()
+    for rank, rec in enumerate(rec_list):
+        title_key = normalize_cache_key(rec['title'])
+        if title_key not in seen:
+            seen.add(title_key)
+            rows.append((user_id, category, title_key, based_on_title, rank, psycopg2.extras.Json(rec)))
+    if not rows:
+        return
+    psycopg2.extras.execute_values(
+        cursor,
+        """
+        INSERT INTO recommendation_queue (user_id, category, title_key, based_on, rank, payload, served_at) VALUES %s
+        ON CONFLICT (user_id, category, title_key) DO UPDATE SET served_at = COALESCE(recommendation_queue.served_at, CURRENT_TIMESTAMP)
+        """,
+        rows,
+        template="(%s, %s, %s, %s, %s, %s, CURRENT_TIMESTAMP)",
+    )
+
+def tmdb_results_to_recs(results, media_type, based_on_title):
+    return [
+        {'title': item.get('title') or item.get('name'), 'link': f"https://www.themoviedb.org/{item.get('media_type', media_type)}/{item.get('id')}", 'reason': f"Because you liked {based_on_title}"}
+        for item in results or [] if item.get('title') or item.get('name')
+    ]
+
+def llm_books_to_recs(rec_data, known_keys=frozenset()):
+    """Recommendation dicts for LLM book picks, dropping any whose title is in known_keys (see book_title_keys)."""
+    return [
+        {'title': f"{item.get('title', 'Unknown')} by {item.get('author', 'Unknown')}", 'link': get_ai_generated_link(f"{item.get('title', '')} {item.get('author', '')}", 'books'), 'reason': item.get('reason', '')}
+        for item in rec_data or []
+        if not book_title_keys([item.get('title', ''), f"{item.get('title', 'Unknown')} by {item.get('author', 'Unknown')}"]) & known_keys
+    ]
+
+def _split_book_title(title):
+    """'Dune by Frank Herbert' -> ('Dune', 'Frank Herbert'); author is None when absent."""
+    head, sep, author = str(title).rpartition(' by ')
+    return (head, author) if sep and head and author else (title, None)
+
+def book_title_keys(titles):
+    """Hashed set of normalized keys matching each title with or without its ' by Author' suffix."""
+    keys = set()
+    for title in titles:
+        keys.add(normalize_cache_key(title))
+        keys.add(normalize_cache_key(_split_book_title(title)[0]))
+    keys.discard('')
+    return keys
+
+def select_book_profile(titles, rng=random):
+    """Bounded, recency-weighted sample of a reading list (titles newest first) for an LLM prompt.
+
+    Weights halve every BOOK_PROFILE_HALF_LIFE positions, at most
+    BOOK_PROFILE_PER_AUTHOR titles per author are kept so one series does not
+    dominate, and the result is cut to BOOK_PROMPT_MAX_TOKENS (about 4
+    characters a token).
+    """
+    # Weighted sampling without replacement (Efraimidis-Spirakis): keep the largest u ** (1 / w).
+    keyed = sorted(
+        ((rng.random() ** (2 ** (position / BOOK_PROFILE_HALF_LIFE)), title) for position, title in enumerate(titles)),
+        reverse=True,
+    )
+    profile, per_author, budget = [], {}, BOOK_PROMPT_MAX_TOKENS * 4
+    for _, title in keyed:
+        author = normalize_cache_key(_split_book_title(title)[1] or '')
+        if author and per_author.get(author, 0) >= BOOK_PROFILE_PER_AUTHOR:
+            continue
+        budget -= len(title) + 2
+        if budget < 0 or len(profile) >= BOOK_PROFILE_MAX_TITLES:
+            break
+        profile.append(title)
+        if author:
+            per_author[author] = per_author.get(author, 0) + 1
+    return profile
+
+def build_book_prompt(titles, excluded_titles, count):
+    """(prompt, cache key) asking for `count` books from a bounded profile of `titles` (newest first).
+
+    The sample is seeded from the list itself, so an unchanged list maps to
+    the same prompt and keeps hitting the LLM cache.
+    """
+    seed = hashlib.sha256('|'.join(sorted(normalize_prompt(title) for title in titles)).encode()).hexdigest()
+    profile = select_book_profile(titles, random.Random(seed))
+    avoid = list(excluded_titles)[-BOOK_PROMPT_MAX_EXCLUDED:]
+    prompt = f"A user likes these books: {', '.join(profile)}."
+    if avoid:
+        prompt += f" Do not recommend any of these: {', '.join(avoid)}."
+    prompt += f" Recommend {count} new books."
+    cache_key = '|'.join(sorted(normalize_prompt(title) for title in profile)) + '||' + '|'.join(sorted(normalize_prompt(title) for title in avoid)) + f"||{count}"
+    return prompt, cache_key
+
+@app.route('/api/recommend/exclusions')
+def api_recommendation_exclusions():
+    """Titles the user has excluded from recommendations, by category."""
+    if 'user_id' not in session: return jsonify({'status': 'error', 'message': 'Auth required.'}), 401
+    with get_db_connection() as conn:
+        if not conn: return jsonify({'status': 'error', 'message': 'DB connection failed.'}), 500
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT category, title FROM recommendation_exclusions WHERE user_id = %s", (session['user_id'],))
+            rows = cursor.fetchall()
+        except psycopg2.Error as e:
+            return jsonify({'status': 'error', 'message': f'DB error: {e}'}), 500
+        finally:
+            cursor.close()
+    exclusions = {category: [] for category in RECOMMENDATION_CATEGORIES}
+    for category, title in rows:
+        exclusions.setdefault(category, []).append(title)
+    return jsonify({'status': 'success', 'exclusions': exclusions})
+
+@app.route('/api/recommend/<category>/exclusions', methods=['POST'])
+def api_set_recommendation_exclusion(category):
+    """Add ({"title": ..., "excluded": true}) or remove a title from the user's exclusion set."""
+    if 'user_id' not in session: return jsonify({'status': 'error', 'message': 'Auth required.'}), 401
+    if category not in RECOMMENDATION_CATEGORIES: return jsonify({'status': 'error', 'message': 'Invalid category.'}), 400
+    data = request.get_json(silent=True) or {}
+    title = (data.get('title') or '').strip()
+    if not title: return jsonify({'status': 'error', 'message': 'A title is required.'}), 400
+    with get_db_connection() as conn:
+        if not conn: return jsonify({'status': 'error', 'message': 'DB connection failed.'}), 500
+        try:
+            cursor = conn.cursor()
+            if data.get('excluded', True):
+                cursor.execute(
+                    "INSERT INTO recommendation_exclusions (user_id, category, title_key, title) VALUES (%s, %s, %s, %s) ON CONFLICT DO NOTHING",
+                    (session['user_id'], category, normalize_cache_key(title), title),
+                )
+            else:
+                cursor.execute(
+                    "DELETE FROM recommendation_exclusions WHERE user_id = %s AND category = %s AND title_key = %s",
+                    (session['user_id'], category, normalize_cache_key(title)),
+                )
+            mark_recommendations_stale(cursor, session['user_id'], category)
+            conn.commit()
+        except psycopg2.Error as e:
+            conn.rollback()
+            return jsonify({'status': 'error', 'message': f'DB error: {e}'}), 500
+        finally:
             cursor.close()
-            conn.close()
-    return jsonify({'status': 'success', 'message': 'Item deleted.'})
+    return jsonify({'status': 'success'})
+
+RECOMMENDATION_SEED_QUERIES = {
+    'movies': "SELECT title, tmdb_id, media_type FROM movies WHERE user_id = %s AND deleted_at IS NULL AND tmdb_id IS NOT NULL",
+    'songs': "SELECT id, spotify_id, spotify_artist_id, title FROM songs WHERE user_id = %s AND deleted_at IS NULL AND spotify_id IS NOT NULL",
+    'books': "SELECT title FROM books WHERE user_id = %s AND deleted_at IS NULL ORDER BY created_at DESC, id DESC",
+}
 
 @app.route('/api/recommend/<category>', methods=['POST'])
 def api_get_recommendation(category):
     if 'user_id' not in session: return jsonify({'status': 'error', 'message': 'Auth required.'}), 401
     if category not in ['movies', 'songs', 'books']: return jsonify({'status': 'error', 'message': 'Invalid category.'}), 400
-    
-    data = request.get_json()
-    all_excluded_titles = list(set(data.get('disliked_items', []) + data.get('excluded_from_recs', [])))
-    conn = get_db_connection()
-    if not conn: return jsonify({'status': 'error', 'message': 'DB connection failed.'}), 500
+    user_id = session['user_id']
 
-    try:
-        cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-        if category == 'movies':
-            cursor.execute("SELECT title, tmdb_id, media_type FROM movies WHERE user_id = %s AND tmdb_id IS NOT NULL", (session['user_id'],))
-            all_items = cursor.fetchall()
-            eligible_items = [item for item in all_items if item['title'] not in all_excluded_titles]
-            if not eligible_items: return jsonify({'status': 'error', 'message': "All items are excluded."}), 400
-            base_item = random.choice(eligible_items)
-            based_on_title, tmdb_id, media_type = base_item['title'], base_item['tmdb_id'], base_item['media_type']
-            rec_url = f"https://api.themoviedb.org/3/{media_type}/{tmdb_id}/recommendations?api_key={TMDB_API_KEY}"
-            rec_res = requests.get(rec_url).json()
-            if not rec_res.get('results'): return jsonify({'status': 'error', 'message': f'No recommendations for "{based_on_title}".'}), 404
-            final_recs = [rec for rec in rec_res['results'] if (rec.get('title') or rec.get('name')) not in all_excluded_titles]
-            rec_list = [{'title': item.get('title') or item.get('name'), 'link': f"https://www.themoviedb.org/{item.get('media_type', media_type)}/{item.get('id')}", 'reason': f"Because you liked {based_on_title}"} for item in final_recs[:5]]
-            return jsonify({'status': 'success', 'recommendations': {'results': rec_list, 'based_on': based_on_title, 'section': category}})
-
-        elif category == 'songs':
-            cursor.execute("SELECT spotify_id, title FROM songs WHERE user_id = %s AND spotify_id IS NOT NULL", (session['user_id'],))
+    # Everything the request needs from the database is read up front, so no
+    # pooled connection is held across the upstream calls below.
+    with get_db_connection() as conn:
+        if not conn: return jsonify({'status': 'error', 'message': 'DB connection failed.'}), 500
+        try:
+            cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+            # Steady state: one indexed read that pops the next unseen recommendations.
+            popped, remaining = pop_recommendations(cursor, user_id, category)
+            if remaining < RECS_PER_REQUEST:
+                mark_recommendations_stale(cursor, user_id, category, delay=0, only_if_idle=True)
+            conn.commit()
+            if popped:
+                rec_list = [row['payload'] for row in popped]
+                return jsonify({'status': 'success', 'recommendations': {'results': rec_list, 'based_on': popped[0]['based_on'], 'section': category}})
+
+            # Queue empty (new user, or the worker has not caught up): compute live.
+            excluded = load_recommendation_exclusions(cursor, user_id, category)
+            cursor.execute(RECOMMENDATION_SEED_QUERIES[category], (user_id,))
             all_items = cursor.fetchall()
-            if not all_items:
-                return jsonify({'status': 'error', 'message': "Add some songs to get a recommendation!"}), 400
-            eligible_items = [item for item in all_items if item['title'] not in all_excluded_titles]
-            if not eligible_items:
-                return jsonify({'status': 'error', 'message': "All songs are excluded."}), 400
-            base_item = random.choice(eligible_items)
-            spotify_id, based_on_title = base_item['spotify_id'], base_item['title']
-
-    # Validate spotify_id exists and is not empty
-            if not spotify_id:
-                return jsonify({'status': 'error', 'message': f'No valid Spotify ID for "{based_on_title}".'}), 400
-
-            token = get_spotify_token()
-            if not token:
-                return jsonify({'status': 'error', 'message': 'Spotify auth failed.'}), 500
-
-    # Use the correct Spotify recommendations API URL with multi-market fallback
-            headers = {"Authorization": f"Bearer {token}"}
-            tried_markets = []
-            markets_to_try = []
-            if SPOTIFY_MARKET and SPOTIFY_MARKET.strip():
-                markets_to_try.append(SPOTIFY_MARKET.strip().upper())
-            for m in SPOTIFY_FALLBACK_MARKETS:
-                if m not in markets_to_try:
-                    markets_to_try.append(m)
-
-            last_error_status = None
-            last_error_text = None
-            for market in markets_to_try:
-                rec_url = f"https://api.spotify.com/v1/recommendations?seed_tracks={spotify_id}&limit=5&market={market}"
-                print(f"Requesting recommendations for spotify_id: {spotify_id} in market {market}")
-                print(f"Request URL: {rec_url}")
-                resp = requests.get(rec_url, headers=headers)
-                tried_markets.append(market)
-
-                print(f"Spotify recommendations response ({market}): {resp.status_code}")
-                if resp.status_code == 400:
-                    return jsonify({'status': 'error', 'message': f'Invalid Spotify track ID for "{based_on_title}". Try re-adding the song.'}), 400
-                if resp.status_code != 200:
-                    last_error_status = resp.status_code
-                    last_error_text = resp.text
-                    continue
+        except psycopg2.Error as e:
+            return jsonify({'status': 'error', 'message': f'DB error: {e}'}), 500
+        finally:
+            cursor.close()
+    all_excluded_titles = list(excluded.values())
 
+    def respond(rec_list, based_on_title):
+        with get_db_connection() as conn:
+            if conn:
+                cursor = conn.cursor()
                 try:
-                    rec_res = resp.json()
-                except Exception as e:
-                    last_error_status = 500
-                    last_error_text = f"Invalid JSON from Spotify: {e}"
-                    continue
+                    record_served_recommendations(cursor, user_id, category, rec_list, based_on_title)
+                    conn.commit()
+                except psycopg2.Error as e:
+                    log_event('record_served_recommendations_failed', level=logging.WARNING, error=str(e))
+                finally:
+                    cursor.close()
+        return jsonify({'status': 'success', 'recommendations': {'results': rec_list, 'based_on': based_on_title, 'section': category}})
 
-                tracks = rec_res.get('tracks') or []
-                if not tracks:
-                    continue
+    if category == 'movies':
+        eligible_items = [item for item in all_items if normalize_cache_key(item['title']) not in excluded]
+        if not eligible_items: return jsonify({'status': 'error', 'message': "All items are excluded."}), 400
+        base_item = random.choice(eligible_items)
+        based_on_title, tmdb_id, media_type = base_item['title'], base_item['tmdb_id'], base_item['media_type']
+        rec_results = tmdb_recommendations(media_type, tmdb_id)
+        if rec_results is None:
+            return jsonify({'status': 'error', 'message': 'Movie recommendations are unavailable right now.'}), 502
+        if not rec_results: return jsonify({'status': 'error', 'message': f'No recommendations for "{based_on_title}".'}), 404
+        rec_list = [rec for rec in tmdb_results_to_recs(rec_results, media_type, based_on_title) if normalize_cache_key(rec['title']) not in excluded]
+        return respond(rec_list[:RECS_PER_REQUEST], based_on_title)
 
-                rec_list = []
-                for track in tracks:
-                    track_title = f"{track.get('name')} by {track.get('artists', [{}])[0].get('name', 'Unknown')}"
-                    link = track.get('external_urls', {}).get('spotify')
-                    if link:
-                        rec_list.append({'title': track_title, 'link': link, 'reason': f"Because you liked {based_on_title}"})
+    elif category == 'songs':
+        if not all_items:
+            return jsonify({'status': 'error', 'message': "Add some songs to get a recommendation!"}), 400
+        eligible_items = [item for item in all_items if normalize_cache_key(item['title']) not in excluded]
+        if not eligible_items:
+            return jsonify({'status': 'error', 'message': "All songs are excluded."}), 400
+        base_item = random.choice(eligible_items)
+        spotify_id, based_on_title = base_item['spotify_id'], base_item['title']
 
-                if rec_list:
-                    return jsonify({'status': 'success', 'recommendations': {'results': rec_list, 'based_on': based_on_title, 'section': category}})
+        # Validate spotify_id exists and is not empty
+        if not spotify_id:
+            return jsonify({'status': 'error', 'message': f'No valid Spotify ID for "{based_on_title}".'}), 400
 
-            # Fallback: try artist top-tracks if recommendations are unavailable
-            try:
-                track_detail_url = f"https://api.spotify.com/v1/tracks/{spotify_id}"
-                track_resp = requests.get(track_detail_url, headers=headers)
-                if track_resp.status_code == 200:
-                    track_data = track_resp.json()
-                    artists = track_data.get('artists') or []
-                    primary_artist_id = artists[0].get('id') if artists else None
-                    if primary_artist_id:
-                        for market in markets_to_try:
-                            top_tracks_url = f"https://api.spotify.com/v1/artists/{primary_artist_id}/top-tracks?market={market}"
-                            print(f"Fallback: artist top-tracks URL: {top_tracks_url}")
-                            top_resp = requests.get(top_tracks_url, headers=headers)
-                            if top_resp.status_code != 200:
-                                continue
-                            top_json = top_resp.json()
-                            top_list = []
-                            for t in top_json.get('tracks', []):
-                                title = f"{t.get('name')} by {t.get('artists', [{}])[0].get('name', 'Unknown')}"
-                                if title == based_on_title:
-                                    continue
-                                link = t.get('external_urls', {}).get('spotify')
-                                if link:
-                                    top_list.append({'title': title, 'link': link, 'reason': f"Similar to {based_on_title} (artist top tracks)"})
-                            if top_list:
-                                return jsonify({'status': 'success', 'recommendations': {'results': top_list[:5], 'based_on': based_on_title, 'section': category}})
-            except Exception as _:
-                pass
-
-            error_msg = f"No recommendations available for \"{based_on_title}\" in markets: {', '.join(tried_markets)}."
-            if last_error_status and last_error_status not in (404,):
-                error_msg += f" Last error {last_error_status}: {str(last_error_text)[:200]}"
-            return jsonify({'status': 'error', 'message': error_msg}), 404
-
-        else: # books
-            cursor.execute(f"SELECT title FROM {category} WHERE user_id = %s", (session['user_id'],))
-            items = cursor.fetchall()
-            if not items: return jsonify({'status': 'error', 'message': f"Add some {category} to get a recommendation!"}), 400
-            if not groq_client: return jsonify({'status': 'error', 'message': "AI engine not configured."}), 500
-            item_titles = [item['title'] for item in items]
-            eligible_items = [title for title in item_titles if title not in all_excluded_titles]
-            if not eligible_items: return jsonify({'status': 'error', 'message': f"All {category} are excluded."}), 400
-            based_on_item = random.choice(eligible_items)
-            system_prompt = "You are a recommendation assistant. Respond with a single JSON object: {'recommendations': [...]}. Each item must have 'title', 'author', and 'reason' keys."
-            prompt = f"A user likes these books: {', '.join(eligible_items)}. Do not recommend any of these: {', '.join(all_excluded_titles)}. Recommend 3 new books."
-            try:
-                chat_completion = groq_client.chat.completions.create(messages=[{"role": "system", "content": system_prompt}, {"role": "user", "content": prompt}], model="gemma2-9b-it", temperature=0.7, response_format={"type": "json_object"})
-                rec_data = json.loads(chat_completion.choices[0].message.content).get('recommendations', [])
-                rec_list = [{'title': f"{item.get('title', 'Unknown')} by {item.get('author', 'Unknown')}", 'link': get_ai_generated_link(f"{item.get('title', '')} {item.get('author', '')}", 'books'), 'reason': item.get('reason', '')} for item in rec_data]
-                return jsonify({'status': 'success', 'recommendations': {'results': rec_list, 'based_on': based_on_item, 'section': category}})
-            except Exception as e:
-                return jsonify({'status': 'error', 'message': f'AI error: {e}'}), 500
-    finally:
-        if conn:
-            cursor.close()
-            conn.close()
+        token = get_spotify_token()
+        if not token:
+            return jsonify({'status': 'error', 'message': 'Spotify auth failed.'}), 500
+
+        # Query every market concurrently; the first market (in preference order) with usable tracks wins.
+        markets_to_try = build_spotify_markets_to_try()
+        deadline_at = time.monotonic() + FANOUT_DEADLINE
+        attempts = {}
+
+        def recommend_in_market(market):
+            attempts[market] = fetch_spotify_recommendations(token, spotify_id, market)
+            return attempts[market]
+
+        result = first_acceptable_result(
+            [lambda market=market: recommend_in_market(market) for market in markets_to_try],
+            accept=lambda r: r['status'] == 400 or bool(spotify_tracks_to_recs(r.get('tracks'), based_on_title)),
+            deadline=FANOUT_DEADLINE,
+        )
+        if result and result['status'] == 400:
+            return jsonify({'status': 'error', 'message': f'Invalid Spotify track ID for "{based_on_title}". Try re-adding the song.'}), 400
+        if result:
+            rec_list = [rec for rec in spotify_tracks_to_recs(result['tracks'], based_on_title) if normalize_cache_key(rec['title']) not in excluded]
+            if rec_list:
+                return respond(rec_list[:RECS_PER_REQUEST], based_on_title)
+
+        # Fallback: try artist top-tracks if recommendations are unavailable
+        try:
+            primary_artist_id = base_item['spotify_artist_id']
+            if not primary_artist_id:
+                # Rows added before the artist id was stored: look it up once and backfill.
+                primary_artist_id = spotify_primary_artist_id(fetch_spotify_track_by_id(token, spotify_id))
+                if primary_artist_id:
+                    with get_db_connection() as conn:
+                        if conn:
+                            cursor = conn.cursor()
+                            try:
+                                cursor.execute("UPDATE songs SET spotify_artist_id = %s WHERE id = %s", (primary_artist_id, base_item['id']))
+                                conn.commit()
+                            finally:
+                                cursor.close()
+            if primary_artist_id and time.monotonic() < deadline_at:
+                top_list = first_acceptable_result(
+                    [lambda market=market: spotify_tracks_to_recs(fetch_spotify_artist_top_tracks(token, primary_artist_id, market), based_on_title, reason=f"Similar to {based_on_title} (artist top tracks)", skip_title=based_on_title) for market in markets_to_try],
+                    accept=bool,
+                    deadline=max(0, deadline_at - time.monotonic()),
+                )
+                top_list = [rec for rec in top_list or [] if normalize_cache_key(rec['title']) not in excluded]
+                if top_list:
+                    return respond(top_list[:RECS_PER_REQUEST], based_on_title)
+        except Exception as _:
+            pass
+
+        tried_markets = [market for market in markets_to_try if market in attempts]
+        failed = [attempts[market] for market in tried_markets if attempts[market]['status'] != 200]
+        error_msg = f"No recommendations available for \"{based_on_title}\" in markets: {', '.join(tried_markets)}."
+        if failed and failed[-1]['status'] not in (404,):
+            error_msg += f" Last error {failed[-1]['status']}: {str(failed[-1]['error'])[:200]}"
+        return jsonify({'status': 'error', 'message': error_msg}), 404
+
+    else: # books
+        if not all_items: return jsonify({'status': 'error', 'message': f"Add some {category} to get a recommendation!"}), 400
+        if not groq_client: return jsonify({'status': 'error', 'message': "AI engine not configured."}), 500
+        item_titles = [item['title'] for item in all_items]
+        eligible_items = [title for title in item_titles if normalize_cache_key(title) not in excluded]
+        if not eligible_items: return jsonify({'status': 'error', 'message': f"All {category} are excluded."}), 400
+        based_on_item = random.choice(eligible_items)
+        system_prompt = "You are a recommendation assistant. Respond with a single JSON object: {'recommendations': [...]}. Each item must have 'title', 'author', and 'reason' keys."
+        # Ask for a couple of spares: the prompt only names a sample of the list, so some picks may be filtered out.
+        prompt, book_set_key = build_book_prompt(eligible_items, all_excluded_titles, 5)
+
+        def create():
+            chat_completion = groq_chat_completion(messages=[{"role": "system", "content": system_prompt}, {"role": "user", "content": prompt}], model=GROQ_MODEL, temperature=0.7, response_format={"type": "json_object"})
+            return json.loads(chat_completion.choices[0].message.content).get('recommendations', [])
+
+        known_keys = book_title_keys(item_titles) | book_title_keys(all_excluded_titles)
+        try:
+            rec_data = llm_cached_completion('llm_books', book_set_key, create)
+            rec_list = llm_books_to_recs(rec_data, known_keys)[:3]
+        except Exception as e:
+            return jsonify({'status': 'error', 'message': f'AI error: {e}'}), 500
+        return respond(rec_list, based_on_item)
 
 # --- All other routes (generate_ideas, auth, admin) unchanged ---
+IDEA_CREATIVE_PHRASES = [
+    "Give me some fresh and unique ideas.",
+    "Surprise me with your suggestions.",
+    "Suggest something unexpected.",
+    "I'm looking for hidden gems.",
+    "What would you recommend for this mood?"
+]
+
+def build_idea_messages(user_prompt):
+    random_phrase = random.choice(IDEA_CREATIVE_PHRASES)
+    full_prompt = f"You are a media suggestion assistant. Based on the user's mood or request, suggest 3 media items (movie, book, or song). {random_phrase} Respond with a single, raw JSON object with a single key 'suggestions' which contains an array of 3 items. Each item must have 'title', 'category', and 'reason' keys. User request: \"{user_prompt}\""
+    return [
+        {"role": "system", "content": "You are a media suggestion assistant. You only respond with a single JSON object containing 'suggestions' array."},
+        {"role": "user", "content": full_prompt}
+    ]
+
+def create_ideas(user_prompt):
+    chat_completion = groq_chat_completion(
+        messages=build_idea_messages(user_prompt),
+        model=GROQ_MODEL,
+        temperature=0.7,
+        response_format={"type": "json_object"},
+    )
+    response_text = chat_completion.choices[0].message.content.strip()
+    return json.loads(response_text).get('suggestions', [])
+
 @app.route('/generate_ideas', methods=['POST'])
 def generate_ideas():
     if not groq_client:
@@ -415,120 +3501,316 @@ def generate_ideas():
     if not user_prompt:
         return jsonify({'error': 'No prompt provided.'}), 400
 
-    creative_phrases = [
-        "Give me some fresh and unique ideas.",
-        "Surprise me with your suggestions.",
-        "Suggest something unexpected.",
-        "I'm looking for hidden gems.",
-        "What would you recommend for this mood?"
-    ]
-    random_phrase = random.choice(creative_phrases)
-
-    full_prompt = f"You are a media suggestion assistant. Based on the user's mood or request, suggest 3 media items (movie, book, or song). {random_phrase} Respond with a single, raw JSON object with a single key 'suggestions' which contains an array of 3 items. Each item must have 'title', 'category', and 'reason' keys. User request: \"{user_prompt}\""
-
     try:
-        chat_completion = groq_client.chat.completions.create(
-            messages=[
-                {"role": "system", "content": "You are a media suggestion assistant. You only respond with a single JSON object containing 'suggestions' array."},
-                {"role": "user", "content": full_prompt}
-            ],
-            model="gemma2-9b-it",
-            temperature=0.7, 
-            response_format={"type": "json_object"},
-        )
-        
-        response_text = chat_completion.choices[0].message.content.strip()
-        return jsonify(json.loads(response_text).get('suggestions', []))
+        return jsonify(llm_cached_completion('llm_ideas', normalize_prompt(user_prompt), lambda: create_ideas(user_prompt)))
     except Exception as e:
-        print(f"Error during Groq idea generation: {e}")
+        log_event('groq_ideas_failed', level=logging.ERROR, error=str(e))
         return jsonify({'error': 'Could not get suggestions from the AI.'}), 500
 
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.route('/generate_ideas/stream')
+def generate_ideas_stream():
+    """Server-sent events variant of /generate_ideas (?prompt=...).
+
+    Emits one `suggestion` event per item as soon as it has been parsed out of
+    the token stream, then `done`; failures arrive as an `error` event.
+    """
+    if not groq_client:
+        return jsonify({'error': 'AI suggestion engine is not configured.'}), 500
+    user_prompt = request.args.get('prompt', '').strip()
+    if not user_prompt:
+        return jsonify({'error': 'No prompt provided.'}), 400
+    cache_key = normalize_prompt(user_prompt)
+
+    def generate():
+        cached = llm_cached_variant('llm_ideas', cache_key, lambda: create_ideas(user_prompt))
+        if cached is not None:
+            for item in cached:
+                yield _sse('suggestion', item)
+            yield _sse('done', {'cached': True})
+            return
+        suggestions = []
+        try:
+            for item in stream_groq_array_items(build_idea_messages(user_prompt)):
+                suggestions.append(item)
+                yield _sse('suggestion', item)
+        except Exception as e:
+            log_event('groq_ideas_failed', level=logging.ERROR, streamed=True, error=str(e))
+            yield _sse('error', {'error': 'Could not get suggestions from the AI.'})
+            return
+        if suggestions:
+            llm_store_variant('llm_ideas', cache_key, suggestions)
+        yield _sse('done', {'cached': False})
+
+    return Response(generate(), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 # --- Admin, login, register, change_password, logout, health routes remain unchanged ---
+def admin_items_query(section, username=None, before_id=None, limit=None):
+    """Admin listing for one section, newest first, keyset-paginated on id."""
+    query = f"""
+        SELECT '{section}' AS section, i.id, i.title, i.link, i.user_id, u.username, i.created_at
+        FROM {section} AS i
+        JOIN users AS u ON i.user_id = u.id
+    """
+    conditions, params = ["i.deleted_at IS NULL"], []
+    if username:
+        conditions.append("u.username = %s")
+        params.append(username)
+    if before_id:
+        conditions.append("i.id < %s")
+        params.append(before_id)
+    query += " WHERE " + " AND ".join(conditions)
+    query += " ORDER BY i.id DESC"
+    if limit:
+        query += " LIMIT %s"
+        params.append(limit)
+    return query, params
+
 @app.route('/admin')  
 def admin_view():
-    if 'user_id' not in session or session.get('username') != 'DuniyaKaPapa':
+    if not current_user_is_admin():
         flash("You do not have permission to access this page.", "error")
         return redirect(url_for('index'))
-        
-    conn = get_db_connection()
-    if not conn:
-        flash("Database connection error.", "error")
-        return render_template('admin.html', data={})
-        
-    all_data = {}
-    try:
-        cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-        for section in VALID_SECTIONS:
-            query = f"""
-                SELECT i.id, i.title, i.link, u.username 
-                FROM {section} AS i 
-                JOIN users AS u ON i.user_id = u.id 
-                ORDER BY u.username, i.id DESC
-            """
-            cursor.execute(query)
-            all_data[section] = cursor.fetchall()
-    except psycopg2.Error as e:
-        flash(f"Error fetching admin data: {e}", "error")
-    finally:
-        cursor.close()
-        conn.close()
+
+    section = request.args.get('section') if request.args.get('section') in VALID_SECTIONS else None
+    username = request.args.get('username', '').strip() or None
+    before_id = request.args.get('before', type=int) if section else None
+    filters = {'section': section, 'username': username}
+
+    with get_db_connection() as conn:
+        if not conn:
+            flash("Database connection error.", "error")
+            return render_template('admin.html', data={}, next_cursors={}, filters=filters)
+
+        all_data, next_cursors = {}, {}
+        try:
+            cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+            for current in ([section] if section else VALID_SECTIONS):
+                query, params = admin_items_query(current, username=username, before_id=before_id, limit=ADMIN_PAGE_SIZE + 1)
+                cursor.execute(query, params)
+                rows = cursor.fetchall()
+                next_cursors[current] = rows[ADMIN_PAGE_SIZE - 1]['id'] if len(rows) > ADMIN_PAGE_SIZE else None
+                all_data[current] = rows[:ADMIN_PAGE_SIZE]
+        except psycopg2.Error as e:
+            flash(f"Error fetching admin data: {e}", "error")
+        finally:
+            cursor.close()
             
-    return render_template('admin.html', data=all_data)
+    return render_template('admin.html', data=all_data, next_cursors=next_cursors, filters=filters)
+
+@app.route('/admin/export')
+def admin_export():
+    """Stream every matching item as CSV or NDJSON (?format=csv|ndjson&section=&username=).
+
+    Rows come from a server-side cursor in EXPORT_FETCH_SIZE batches, so the
+    worker never holds the full table in memory.
+    """
+    if not current_user_is_admin():
+        flash("You do not have permission to perform this action.", "error")
+        return redirect(url_for('index'))
+    export_format = 'ndjson' if request.args.get('format') == 'ndjson' else 'csv'
+    section = request.args.get('section')
+    sections = [section] if section in VALID_SECTIONS else VALID_SECTIONS
+    username = request.args.get('username', '').strip() or None
+    fields = ['section', 'id', 'title', 'link', 'user_id', 'username', 'created_at']
+
+    def generate():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        if export_format == 'csv':
+            writer.writerow(fields)
+        with get_db_connection() as conn:
+            if not conn:
+                yield buffer.getvalue()
+                return
+            for current in sections:
+                query, params = admin_items_query(current, username=username)
+                with conn.cursor(name=f"admin_export_{current}", cursor_factory=psycopg2.extras.RealDictCursor) as cursor:
+                    cursor.itersize = EXPORT_FETCH_SIZE
+                    cursor.execute(query, params)
+                    for row_number, row in enumerate(cursor, start=1):
+                        row['created_at'] = row['created_at'].isoformat() if row['created_at'] else None
+                        if export_format == 'csv':
+                            writer.writerow([row[field] for field in fields])
+                        else:
+                            buffer.write(json.dumps({field: row[field] for field in fields}) + "\n")
+                        if row_number % EXPORT_FETCH_SIZE == 0:
+                            yield buffer.getvalue()
+                            buffer.seek(0)
+                            buffer.truncate()
+            conn.rollback()
+        yield buffer.getvalue()
+
+    mimetype = 'application/x-ndjson' if export_format == 'ndjson' else 'text/csv'
+    filename = f"laterlist-{section if section in VALID_SECTIONS else 'all'}.{export_format}"
+    return Response(stream_with_context(generate()), mimetype=mimetype, headers={'Content-Disposition': f'attachment; filename="{filename}"'})
 
 @app.route('/admin/delete/<section>/<int:item_id>', methods=['POST'])
 def admin_delete_item(section, item_id):
-    if 'user_id' not in session or session.get('username') != 'DuniyaKaPapa':
+    if not current_user_is_admin():
         flash("You do not have permission to perform this action.", "error")
         return redirect(url_for('admin_view'))
-        
-    conn = get_db_connection()
-    if not conn:
-        flash("Database connection error.", "error")
+    if section not in VALID_SECTIONS:
+        flash("Invalid section.", "error")
         return redirect(url_for('admin_view'))
         
-    try:
-        cursor = conn.cursor()
-        cursor.execute(f"DELETE FROM {section} WHERE id = %s", (item_id,))
-        conn.commit()
-        if cursor.rowcount > 0:
-            flash("Item deleted successfully.", "success")
-        else:
-            flash("Item not found.", "warning")
-    except psycopg2.Error as e:
-        flash(f"Error deleting item: {e}", "error")
-    finally:
-        cursor.close()
-        conn.close()
+    with get_db_connection() as conn:
+        if not conn:
+            flash("Database connection error.", "error")
+            return redirect(url_for('admin_view'))
+
+        try:
+            cursor = conn.cursor()
+            # Same soft delete as the owner's own: the purge job removes the row once the undo window passes.
+            cursor.execute(f"SELECT user_id FROM {section} WHERE id = %s AND deleted_at IS NULL", (item_id,))
+            owner = cursor.fetchone()
+            deleted = owner and set_items_deleted(cursor, owner[0], {section: [item_id]}, deleted=True)[0]
+            conn.commit()
+            if deleted:
+                flash("Item deleted successfully.", "success")
+            else:
+                flash("Item not found.", "warning")
+        except psycopg2.Error as e:
+            flash(f"Error deleting item: {e}", "error")
+        finally:
+            cursor.close()
             
     return redirect(url_for('admin_view'))
 
+# --- Password Hashing ---
+# scrypt/pbkdf2 hashes are deliberately CPU-heavy, so they run in a small
+# process pool instead of on request threads. At most PASSWORD_HASH_MAX_PENDING
+# hashes wait per worker; past that callers get PasswordHashingBusy right away
+# rather than queueing behind a credential-stuffing burst.
+class PasswordHashingBusy(Exception):
+    pass
+
+_hash_pool = None
+_hash_pool_pid = None
+_hash_pool_lock = threading.Lock()
+_hash_slots = threading.BoundedSemaphore(max(1, PASSWORD_HASH_MAX_PENDING))
+# werkzeug fills in defaults (e.g. pbkdf2 iterations), so the tag it writes can
+# differ from PASSWORD_HASH_METHOD. Learn it once from a throwaway hash, so a fresh
+# worker does not treat up-to-date hashes as stale.
+_hash_method_tag = generate_password_hash('', PASSWORD_HASH_METHOD).split('$', 1)[0]
+
+def _get_hash_pool():
+    """Per-process pool of spawned children.
+
+    Spawned children re-import the parent's __main__: only gunicorn's entry
+    point under gunicorn, but all of this module under `python app.py`.
+    """
+    global _hash_pool, _hash_pool_pid
+    if _hash_pool is None or _hash_pool_pid != os.getpid():
+        with _hash_pool_lock:
+            if _hash_pool is None or _hash_pool_pid != os.getpid():
+                _hash_pool = ProcessPoolExecutor(PASSWORD_HASH_WORKERS, mp_context=multiprocessing.get_context('spawn'))
+                _hash_pool_pid = os.getpid()
+    return _hash_pool
+
+def run_password_hash(fn, *args):
+    """Run a werkzeug hash function in the pool, bounded by PASSWORD_HASH_MAX_PENDING."""
+    if PASSWORD_HASH_WORKERS <= 0:
+        return fn(*args)
+    if not _hash_slots.acquire(blocking=False):
+        raise PasswordHashingBusy()
+    try:
+        if ASYNC_SERVING:
+            # multiprocessing does not mix with gevent's patched threading; hashlib's
+            # scrypt/pbkdf2 release the GIL, so gevent's native thread pool keeps the hub free.
+            import gevent
+            try:
+                return gevent.get_hub().threadpool.spawn(fn, *args).get(timeout=PASSWORD_HASH_TIMEOUT)
+            except gevent.Timeout:
+                raise PasswordHashingBusy()
+        return _get_hash_pool().submit(fn, *args).result(timeout=PASSWORD_HASH_TIMEOUT)
+    except FutureTimeoutError:
+        raise PasswordHashingBusy()
+    except BrokenProcessPool:
+        global _hash_pool
+        with _hash_pool_lock:
+            _hash_pool = None
+        raise PasswordHashingBusy()
+    finally:
+        _hash_slots.release()
+
+def hash_password(password):
+    return run_password_hash(generate_password_hash, password, PASSWORD_HASH_METHOD)
+
+def verify_password(stored_hash, password):
+    """Return (matches, upgraded_hash); upgraded_hash is set when stored_hash used older parameters."""
+    if not run_password_hash(check_password_hash, stored_hash, password):
+        return False, None
+    if stored_hash.split('$', 1)[0] in (PASSWORD_HASH_METHOD, _hash_method_tag):
+        return True, None
+    try:
+        return True, hash_password(password)
+    except PasswordHashingBusy:
+        return True, None
+
+def _password_hashing_busy(template, **context):
+    flash("We're handling a lot of sign-ins right now. Please try again in a moment.", "error")
+    return render_template(template, **context), 503
+
+# Checked before any DB or hashing work, per client address and per target account.
+_login_ip_limiter = KeyedTokenBuckets(
+    LOGIN_ATTEMPTS_PER_MINUTE_PER_IP / 60, LOGIN_BURST_PER_IP,
+    shared=shared_cache if LOGIN_LIMIT_SHARED else None, namespace='login_ip',
+)
+_login_user_limiter = KeyedTokenBuckets(
+    LOGIN_ATTEMPTS_PER_MINUTE_PER_USER / 60, LOGIN_BURST_PER_USER,
+    shared=shared_cache if LOGIN_LIMIT_SHARED else None, namespace='login_user',
+)
+
+def login_attempt_allowed(username=None):
+    if not _login_ip_limiter.try_acquire(request.remote_addr or 'unknown'):
+        return False
+    return username is None or _login_user_limiter.try_acquire(normalize_cache_key(username))
+
+def _too_many_attempts(template, **context):
+    flash("Too many attempts. Please wait a minute and try again.", "error")
+    return render_template(template, **context), 429
+
 @app.route('/login', methods=['GET', 'POST'])
 def login():
     if 'user_id' in session:
         return redirect(url_for('index'))
     if request.method == 'POST':
         username, password = request.form['username'], request.form['password']
-        conn = get_db_connection()
-        if not conn:
-            flash("Database connection error.", "error")
-            return render_template('login.html')
-        
-        try:
-            cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-            cursor.execute("SELECT * FROM users WHERE username = %s", (username,))
-            user = cursor.fetchone()
-            
-            if user and check_password_hash(user['password'], password):
-                session['user_id'], session['username'] = user['id'], user['username']
-                flash('Logged in successfully!', 'success')
-                return redirect(url_for('index'))
-            else:
-                flash('Incorrect username or password, please try again.', 'error')
-        except psycopg2.Error as e:
-            flash(f"An error occurred: {e}", "error")
-        finally:
-            cursor.close()
-            conn.close()
+        if not login_attempt_allowed(username):
+            return _too_many_attempts('login.html')
+        with get_db_connection() as conn:
+            if not conn:
+                flash("Database connection error.", "error")
+                return render_template('login.html')
+
+            try:
+                cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+                cursor.execute("SELECT id, username, password, is_admin FROM users WHERE username = %s", (username,))
+                user = cursor.fetchone()
+                # Release the row snapshot before hashing; nothing below needs it held open.
+                conn.commit()
+
+                matches, upgraded_hash = verify_password(user['password'], password) if user else (False, None)
+                if matches:
+                    if upgraded_hash:
+                        cursor.execute("UPDATE users SET password = %s WHERE id = %s AND password = %s", (upgraded_hash, user['id'], user['password']))
+                        conn.commit()
+                    rotate_session()
+                    session['user_id'], session['username'] = user['id'], user['username']
+                    cache_set('user_profile', user['id'], user_profile(user), USER_PROFILE_CACHE_TTL)
+                    flash('Logged in successfully!', 'success')
+                    return redirect(url_for('index'))
+                else:
+                    flash('Incorrect username or password, please try again.', 'error')
+            except PasswordHashingBusy:
+                return _password_hashing_busy('login.html')
+            except psycopg2.Error as e:
+                flash(f"An error occurred: {e}", "error")
+            finally:
+                cursor.close()
 
     return render_template('login.html')
 
@@ -541,35 +3823,39 @@ def register():
         if not username or not password:
             flash("Username and password are required.", "warning")
             return render_template('register.html', username=username)
-            
-        conn = get_db_connection()
-        if not conn:
-            flash("Database connection error.", "error")
-            return render_template('register.html', username=username)
+        if not login_attempt_allowed():
+            return _too_many_attempts('register.html', username=username)
 
-        try:
-            cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-            cursor.execute("SELECT id FROM users WHERE username = %s", (username,))
-            if cursor.fetchone():
-                flash("Username already exists. Please choose another.", "warning")
+        with get_db_connection() as conn:
+            if not conn:
+                flash("Database connection error.", "error")
                 return render_template('register.html', username=username)
-            
-            hashed_password = generate_password_hash(password)
-            cursor.execute(
-                "INSERT INTO users (username, password) VALUES (%s, %s) RETURNING id",
-                (username, hashed_password)
-            )
-            new_user = cursor.fetchone()
-            conn.commit()
-            
-            session['user_id'], session['username'] = new_user['id'], username
-            flash("Registration successful! Welcome.", "success")
-            return redirect(url_for('index'))
-        except psycopg2.Error as e:
-            flash(f"An error occurred during registration: {e}", "error")
-        finally:
-            cursor.close()
-            conn.close()
+
+            try:
+                cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+                cursor.execute("SELECT id FROM users WHERE username = %s", (username,))
+                if cursor.fetchone():
+                    flash("Username already exists. Please choose another.", "warning")
+                    return render_template('register.html', username=username)
+
+                hashed_password = hash_password(password)
+                cursor.execute(
+                    "INSERT INTO users (username, password) VALUES (%s, %s) RETURNING id",
+                    (username, hashed_password)
+                )
+                new_user = cursor.fetchone()
+                conn.commit()
+
+                rotate_session()
+                session['user_id'], session['username'] = new_user['id'], username
+                flash("Registration successful! Welcome.", "success")
+                return redirect(url_for('index'))
+            except PasswordHashingBusy:
+                return _password_hashing_busy('register.html', username=username)
+            except psycopg2.Error as e:
+                flash(f"An error occurred during registration: {e}", "error")
+            finally:
+                cursor.close()
 
     return render_template('register.html')
 
@@ -592,37 +3878,48 @@ def change_password():
             return redirect(url_for('change_password'))
 
         user_id = session['user_id']
-        conn = get_db_connection()
-        if not conn:
-            flash('Database connection error.', 'error')
-            return redirect(url_for('change_password'))
+        if not login_attempt_allowed(session.get('username')):
+            return _too_many_attempts('change_password.html')
+        with get_db_connection() as conn:
+            if not conn:
+                flash('Database connection error.', 'error')
+                return redirect(url_for('change_password'))
 
-        try:
-            cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
-            cursor.execute("SELECT password FROM users WHERE id = %s", (user_id,))
-            user = cursor.fetchone()
+            try:
+                cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+                cursor.execute("SELECT password FROM users WHERE id = %s", (user_id,))
+                user = cursor.fetchone()
 
-            if not user or not check_password_hash(user['password'], current_password):
-                flash('Incorrect current password.', 'error')
-                return redirect(url_for('change_password'))
+                if not user or not verify_password(user['password'], current_password)[0]:
+                    flash('Incorrect current password.', 'error')
+                    return redirect(url_for('change_password'))
 
-            hashed_password = generate_password_hash(new_password)
-            cursor.execute("UPDATE users SET password = %s WHERE id = %s", (hashed_password, user_id))
-            conn.commit()
-            flash('Your password has been updated successfully.', 'success')
-            return redirect(url_for('index'))
+                hashed_password = hash_password(new_password)
+                cursor.execute("UPDATE users SET password = %s WHERE id = %s", (hashed_password, user_id))
+                conn.commit()
+                # Sign out every other device, and move this one to a fresh session id.
+                invalidate_user_profile(user_id)
+                revoke_user_sessions(user_id)
+                rotate_session()
+                flash('Your password has been updated successfully.', 'success')
+                return redirect(url_for('index'))
 
-        except psycopg2.Error as e:
-            flash(f'An error occurred: {e}', 'error')
-        finally:
-            cursor.close()
-            conn.close()
+            except PasswordHashingBusy:
+                return _password_hashing_busy('change_password.html')
+            except psycopg2.Error as e:
+                flash(f'An error occurred: {e}', 'error')
+            finally:
+                cursor.close()
 
     return render_template('change_password.html')
 
 @app.route('/logout')
 def logout():
+    user_id = session.get('user_id')
     session.clear()
+    rotate_session()
+    if user_id is not None:
+        invalidate_user_profile(user_id)
     flash("You have been logged out.", "success")
     return redirect(url_for('landing'))
 
@@ -630,6 +3927,467 @@ def logout():
 def health_check():
     return "OK", 200
 
+def has_metrics_token():
+    return bool(METRICS_TOKEN) and secrets.compare_digest(request.headers.get('Authorization', ''), f"Bearer {METRICS_TOKEN}")
+
+@app.route('/health/db')
+def db_pool_health():
+    if not (current_user_is_admin() or has_metrics_token()): return jsonify({'status': 'error', 'message': 'Unauthorized.'}), 401
+    return jsonify(get_db_pool_stats())
+
+@app.route('/health/upstreams')
+def upstream_health():
+    if not (current_user_is_admin() or has_metrics_token()): return jsonify({'status': 'error', 'message': 'Unauthorized.'}), 401
+    return jsonify(get_upstream_stats())
+
+@app.route('/health/cache')
+def cache_health():
+    if not (current_user_is_admin() or has_metrics_token()): return jsonify({'status': 'error', 'message': 'Unauthorized.'}), 401
+    return jsonify(get_cache_stats())
+
+@app.route('/metrics')
+def metrics():
+    """Prometheus text exposition, summed over the host's workers when SHARED_CACHE_PATH is set."""
+    if METRICS_TOKEN and not has_metrics_token():
+        return "Unauthorized", 401
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+# --- Enrichment Worker ---
+def _dead_letter_abandoned_enrichment_jobs(cursor):
+    """Dead-letter expired leases that have used up their attempts, so a job that kills its worker every time stops coming back."""
+    cursor.execute(
+        """
+        UPDATE enrichment_jobs SET status = 'dead', last_error = COALESCE(last_error, 'Worker died while processing this job.'), updated_at = CURRENT_TIMESTAMP
+        WHERE id IN (
+            SELECT id FROM enrichment_jobs
+            WHERE status = 'running' AND attempts >= max_attempts AND updated_at < CURRENT_TIMESTAMP - make_interval(secs => %s)
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING id, section, item_id, user_id
+        """,
+        (ENRICHMENT_LEASE_SECONDS,),
+    )
+    for job in cursor.fetchall():
+        if job['section'] in ENRICHED_SECTIONS:
+            cursor.execute(f"UPDATE {job['section']} SET enrichment_status = 'failed' WHERE id = %s AND user_id = %s", (job['item_id'], job['user_id']))
+            bump_items_version(cursor, job['user_id'])
+        log_event('enrichment_job_failed', level=logging.WARNING, job_id=job['id'], dead_lettered=True, error='lease expired after max attempts')
+
+def claim_enrichment_job():
+    """Lease the next runnable job (or one whose worker died mid-lease) with SKIP LOCKED."""
+    with get_db_connection() as conn:
+        if not conn:
+            return None
+        cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        try:
+            _dead_letter_abandoned_enrichment_jobs(cursor)
+            cursor.execute(
+                """
+                UPDATE enrichment_jobs SET status = 'running', attempts = attempts + 1, updated_at = CURRENT_TIMESTAMP
+                WHERE id = (
+                    SELECT id FROM enrichment_jobs
+                    WHERE (status = 'queued' AND run_after <= CURRENT_TIMESTAMP)
+                       OR (status = 'running' AND attempts < max_attempts AND updated_at < CURRENT_TIMESTAMP - make_interval(secs => %s))
+                    ORDER BY run_after, id
+                    FOR UPDATE SKIP LOCKED
+                    LIMIT 1
+                )
+                RETURNING *
+                """,
+                (ENRICHMENT_LEASE_SECONDS,),
+            )
+            job = cursor.fetchone()
+            conn.commit()
+            return job
+        finally:
+            cursor.close()
+
+def finish_enrichment_job(job, details):
+    with get_db_connection() as conn:
+        if not conn:
+            raise UpstreamUnavailable('Database connection failed.')
+        cursor = conn.cursor()
+        try:
+            assignments = ', '.join(f"{column} = %s" for column in details)
+            cursor.execute(
+                f"UPDATE {job['section']} SET {assignments}, enrichment_status = NULL WHERE id = %s AND user_id = %s",
+                list(details.values()) + [job['item_id'], job['user_id']],
+            )
+            cursor.execute("UPDATE enrichment_jobs SET status = 'done', last_error = NULL, updated_at = CURRENT_TIMESTAMP WHERE id = %s", (job['id'],))
+            mark_recommendations_stale(cursor, job['user_id'], job['section'])
+            bump_items_version(cursor, job['user_id'])
+            conn.commit()
+        finally:
+            cursor.close()
+
+def fail_enrichment_job(job, error, retry=True):
+    """Requeue with exponential backoff, or dead-letter once retries are exhausted."""
+    dead = not retry or job['attempts'] >= job['max_attempts']
+    with get_db_connection() as conn:
+        if not conn:
+            return
+        cursor = conn.cursor()
+        try:
+            if dead:
+                cursor.execute("UPDATE enrichment_jobs SET status = 'dead', last_error = %s, updated_at = CURRENT_TIMESTAMP WHERE id = %s", (error, job['id']))
+                cursor.execute(f"UPDATE {job['section']} SET enrichment_status = 'failed' WHERE id = %s AND user_id = %s", (job['item_id'], job['user_id']))
+                bump_items_version(cursor, job['user_id'])
+            else:
+                delay = ENRICHMENT_RETRY_BASE * 2 ** (job['attempts'] - 1)
+                cursor.execute(
+                    "UPDATE enrichment_jobs SET status = 'queued', last_error = %s, run_after = CURRENT_TIMESTAMP + make_interval(secs => %s), updated_at = CURRENT_TIMESTAMP WHERE id = %s",
+                    (error, delay, job['id']),
+                )
+            conn.commit()
+        finally:
+            cursor.close()
+    log_event('enrichment_job_failed', level=logging.WARNING, job_id=job['id'], dead_lettered=dead, error=str(error))
+
+def process_enrichment_job(job):
+    if job['section'] not in ENRICHED_SECTIONS:
+        return fail_enrichment_job(job, f"Unsupported section {job['section']}.", retry=False)
+    try:
+        details = lookup_item_details(job['section'], job['query'])
+    except UpstreamUnavailable as e:
+        return fail_enrichment_job(job, str(e))
+    except Exception as e:
+        return fail_enrichment_job(job, f"Unexpected error: {e}")
+    if not details:
+        return fail_enrichment_job(job, f"Could not find '{job['query']}'.", retry=False)
+    try:
+        finish_enrichment_job(job, details)
+    except (psycopg2.Error, UpstreamUnavailable) as e:
+        fail_enrichment_job(job, f"Could not save enrichment: {e}")
+
+def run_enrichment_worker(once=False):
+    print("Enrichment worker started.")
+    while True:
+        job = claim_enrichment_job()
+        if job is None:
+            if once:
+                return
+            time.sleep(ENRICHMENT_POLL_INTERVAL)
+            continue
+        process_enrichment_job(job)
+
+@app.cli.command('enrichment-worker')
+@click.option('--once', is_flag=True, help='Exit when the queue is empty instead of polling.')
+def enrichment_worker_command(once):
+    """Run the background enrichment worker."""
+    run_enrichment_worker(once=once)
+
+# --- Deleted Item Purge ---
+def purge_deleted_items(batch_size=PURGE_BATCH_SIZE):
+    """Remove tombstones older than the undo window, batch_size rows per transaction. Returns rows removed.
+
+    Small batches keep lock times and WAL bursts short; SKIP LOCKED lets
+    several purgers (or a purger and a late undo) run side by side.
+    """
+    removed = 0
+    for section in VALID_SECTIONS:
+        while True:
+            with get_db_connection() as conn:
+                if not conn:
+                    raise RuntimeError("Database connection failed.")
+                cursor = conn.cursor()
+                try:
+                    cursor.execute(
+                        f"""
+                        DELETE FROM {section} WHERE id IN (
+                            SELECT id FROM {section}
+                            WHERE deleted_at < CURRENT_TIMESTAMP - make_interval(secs => %s)
+                            ORDER BY deleted_at
+                            LIMIT %s
+                            FOR UPDATE SKIP LOCKED
+                        )
+                        RETURNING id
+                        """,
+                        (DELETE_UNDO_WINDOW, batch_size),
+                    )
+                    rows = cursor.fetchall()
+                    conn.commit()
+                except psycopg2.Error:
+                    conn.rollback()
+                    raise
+                finally:
+                    cursor.close()
+            removed += len(rows)
+            if len(rows) < batch_size:
+                break
+    return removed
+
+def run_purge_worker(once=False):
+    print("Purge worker started.")
+    while True:
+        removed = purge_deleted_items()
+        if removed:
+            log_event('deleted_items_purged', removed=removed)
+        if once:
+            return
+        time.sleep(PURGE_POLL_INTERVAL)
+
+@app.cli.command('purge-deleted')
+@click.option('--once', is_flag=True, help='Purge what is due and exit instead of polling.')
+def purge_deleted_command(once):
+    """Permanently remove deleted items once their undo window has passed."""
+    run_purge_worker(once=once)
+
+# --- Recommendation Worker ---
+def claim_recommendation_refresh():
+    """Lease the next due queue rebuild (or one whose worker died mid-lease) with SKIP LOCKED."""
+    with get_db_connection() as conn:
+        if not conn:
+            return None
+        cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        try:
+            cursor.execute(
+                """
+                UPDATE recommendation_refreshes r SET status = 'running', attempts = attempts + 1, updated_at = CURRENT_TIMESTAMP
+                FROM (
+                    SELECT user_id, category FROM recommendation_refreshes
+                    WHERE (status = 'queued' AND run_after <= CURRENT_TIMESTAMP)
+                       OR (status = 'running' AND updated_at < CURRENT_TIMESTAMP - make_interval(secs => %s))
+                    ORDER BY run_after
+                    FOR UPDATE SKIP LOCKED
+                    LIMIT 1
+                ) next
+                WHERE r.user_id = next.user_id AND r.category = next.category
+                RETURNING r.*
+                """,
+                (ENRICHMENT_LEASE_SECONDS,),
+            )
+            refresh = cursor.fetchone()
+            conn.commit()
+            return refresh
+        finally:
+            cursor.close()
+
+def load_recommendation_seeds(user_id, category):
+    """(seed items, {title_key: title} to keep out of the queue) for a user's category."""
+    with get_db_connection() as conn:
+        if not conn:
+            raise UpstreamUnavailable('Database connection failed.')
+        cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        try:
+            cursor.execute(RECOMMENDATION_SEED_QUERIES[category], (user_id,))
+            items = cursor.fetchall()
+            excluded = load_recommendation_exclusions(cursor, user_id, category)
+        finally:
+            cursor.close()
+    seeds = [item for item in items if normalize_cache_key(item['title']) not in excluded]
+    # Never recommend something the user already has.
+    excluded.update((normalize_cache_key(item['title']), item['title']) for item in items)
+    return seeds, excluded
+
+def _movie_candidates(seed):
+    results = tmdb_recommendations(seed['media_type'], seed['tmdb_id'])
+    if results is None:
+        raise UpstreamUnavailable('Movie recommendations are unavailable right now.')
+    return tmdb_results_to_recs(results, seed['media_type'], seed['title'])
+
+def _song_candidates(token, seed):
+    markets = build_spotify_markets_to_try()
+    result = first_acceptable_result(
+        [lambda market=market: fetch_spotify_recommendations(token, seed['spotify_id'], market) for market in markets],
+        accept=lambda r: bool(spotify_tracks_to_recs(r.get('tracks'), seed['title'])),
+    )
+    if result:
+        return spotify_tracks_to_recs(result['tracks'], seed['title'])
+    artist_id = seed['spotify_artist_id'] or spotify_primary_artist_id(fetch_spotify_track_by_id(token, seed['spotify_id']))
+    if not artist_id:
+        return []
+    return first_acceptable_result(
+        [lambda market=market: spotify_tracks_to_recs(fetch_spotify_artist_top_tracks(token, artist_id, market), seed['title'], reason=f"Similar to {seed['title']} (artist top tracks)", skip_title=seed['title']) for market in markets],
+        accept=bool,
+    ) or []
+
+def _book_candidates(seeds, excluded):
+    if not groq_client:
+        raise UpstreamUnavailable('AI engine not configured.')
+    titles = [seed['title'] for seed in seeds]
+    system_prompt = "You are a recommendation assistant. Respond with a single JSON object: {'recommendations': [...]}. Each item must have 'title', 'author', and 'reason' keys."
+    # excluded also holds every title on the list; the prompt names only a few true exclusions and the filter covers the rest.
+    owned_keys = book_title_keys(titles)
+    prompt, _ = build_book_prompt(titles, [title for key, title in excluded.items() if key not in owned_keys], RECS_QUEUE_SIZE // 2)
+    chat_completion = groq_chat_completion(messages=[{"role": "system", "content": system_prompt}, {"role": "user", "content": prompt}], model=GROQ_MODEL, temperature=0.7, response_format={"type": "json_object"})
+    return llm_books_to_recs(json.loads(chat_completion.choices[0].message.content).get('recommendations', []), book_title_keys(excluded.values()))
+
+def build_recommendation_candidates(category, seeds, excluded):
+    """Ranked, de-duplicated recommendations for a sample of seeds, each tagged with its 'based_on' seed.
+
+    Titles suggested by several seeds rank first; the rest interleave seed by
+    seed so consecutive pops are not all based on the same item.
+    """
+    sample = random.sample(seeds, min(len(seeds), RECS_SEEDS_PER_REFRESH))
+    if category == 'movies':
+        per_seed = [(seed['title'], _movie_candidates(seed)) for seed in sample]
+    elif category == 'songs':
+        token = get_spotify_token()
+        if not token:
+            raise UpstreamUnavailable('Spotify auth failed.')
+        per_seed = [(seed['title'], _song_candidates(token, seed)) for seed in sample]
+    else:
+        # One LLM call covers every book; label the batch with a sampled seed as the live path does.
+        per_seed = [(random.choice(sample)['title'], _book_candidates(seeds, excluded))]
+
+    votes, best = {}, {}
+    for seed_index, (based_on_title, recs) in enumerate(per_seed):
+        for position, rec in enumerate(recs):
+            title_key = normalize_cache_key(rec['title'])
+            if title_key in excluded:
+                continue
+            votes[title_key] = votes.get(title_key, 0) + 1
+            if title_key not in best:
+                best[title_key] = ((position, seed_index), based_on_title, rec)
+    ranked = sorted(best, key=lambda title_key: (-votes[title_key], best[title_key][0]))
+    return [(title_key, best[title_key][1], best[title_key][2]) for title_key in ranked[:RECS_QUEUE_SIZE]]
+
+def store_recommendation_queue(refresh, candidates):
+    """Swap in the new unserved entries. Served rows stay so their titles are never queued again."""
+    with get_db_connection() as conn:
+        if not conn:
+            raise UpstreamUnavailable('Database connection failed.')
+        cursor = conn.cursor()
+        try:
+            cursor.execute("DELETE FROM recommendation_queue WHERE user_id = %s AND category = %s AND served_at IS NULL", (refresh['user_id'], refresh['category']))
+            if candidates:
+                psycopg2.extras.execute_values(
+                    cursor,
+                    "INSERT INTO recommendation_queue (user_id, category, title_key, based_on, rank, payload) VALUES %s ON CONFLICT (user_id, category, title_key) DO NOTHING",
+                    [(refresh['user_id'], refresh['category'], title_key, based_on_title, rank, psycopg2.extras.Json(rec)) for rank, (title_key, based_on_title, rec) in enumerate(candidates)],
+                )
+            # A change that arrived mid-refresh bumped requested_at; go round again for it.
+            cursor.execute(
+                """
+                UPDATE recommendation_refreshes
+                SET status = CASE WHEN requested_at = %s THEN 'done' ELSE 'queued' END, last_error = NULL, updated_at = CURRENT_TIMESTAMP
+                WHERE user_id = %s AND category = %s
+                """,
+                (refresh['requested_at'], refresh['user_id'], refresh['category']),
+            )
+            conn.commit()
+        finally:
+            cursor.close()
+
+def fail_recommendation_refresh(refresh, error):
+    """Retry with exponential backoff; give up after RECS_REFRESH_MAX_ATTEMPTS until the next change."""
+    dead = refresh['attempts'] >= RECS_REFRESH_MAX_ATTEMPTS
+    with get_db_connection() as conn:
+        if not conn:
+            return
+        cursor = conn.cursor()
+        try:
+            cursor.execute(
+                """
+                UPDATE recommendation_refreshes
+                SET status = %s, last_error = %s, run_after = CURRENT_TIMESTAMP + make_interval(secs => %s), updated_at = CURRENT_TIMESTAMP
+                WHERE user_id = %s AND category = %s
+                """,
+                ('failed' if dead else 'queued', error, ENRICHMENT_RETRY_BASE * 2 ** (refresh['attempts'] - 1), refresh['user_id'], refresh['category']),
+            )
+            conn.commit()
+        finally:
+            cursor.close()
+    log_event('recommendation_refresh_failed', level=logging.WARNING, user_id=refresh['user_id'], category=refresh['category'], dead=dead, error=str(error))
+
+def process_recommendation_refresh(refresh):
+    try:
+        seeds, excluded = load_recommendation_seeds(refresh['user_id'], refresh['category'])
+        candidates = build_recommendation_candidates(refresh['category'], seeds, excluded) if seeds else []
+        store_recommendation_queue(refresh, candidates)
+    except Exception as e:
+        fail_recommendation_refresh(refresh, str(e) or e.__class__.__name__)
+
+def run_recommendation_worker(once=False):
+    print("Recommendation worker started.")
+    while True:
+        refresh = claim_recommendation_refresh()
+        if refresh is None:
+            if once:
+                return
+            time.sleep(ENRICHMENT_POLL_INTERVAL)
+            continue
+        process_recommendation_refresh(refresh)
+
+# --- Poster Backfill ---
+def tmdb_poster_path(media_type, tmdb_id):
+    """Poster path for a TMDB title ('' if it has none), or None if TMDB is unavailable."""
+    def load():
+        resp = upstream_request('tmdb', 'GET', f"{TMDB_API_BASE}/3/{media_type}/{tmdb_id}", params={'api_key': TMDB_API_KEY})
+        if resp is None or resp.status_code not in (200, 404):
+            return None
+        return {'poster_path': (resp.json().get('poster_path') or '') if resp.status_code == 200 else ''}
+    result = cached_call('tmdb_poster', f"{media_type}:{tmdb_id}", TMDB_SEARCH_CACHE_TTL, load)
+    return result['poster_path'] if result else None
+
+def backfill_movie_posters(batch_size=100, limit=None):
+    """Fill movies.poster_path from the stored tmdb_id. Returns the number of rows updated."""
+    rate_limiter = TokenBucket(POSTER_BACKFILL_PER_SECOND, max(1, POSTER_BACKFILL_PER_SECOND))
+    updated, last_id = 0, 0
+    while limit is None or updated < limit:
+        with get_db_connection() as conn:
+            if not conn:
+                raise RuntimeError("Database connection failed.")
+            cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+            try:
+                cursor.execute(
+                    "SELECT id, user_id, tmdb_id, media_type FROM movies WHERE tmdb_id IS NOT NULL AND poster_path IS NULL AND id > %s ORDER BY id LIMIT %s",
+                    (last_id, batch_size),
+                )
+                rows = cursor.fetchall()
+                conn.commit()
+            finally:
+                cursor.close()
+        if not rows:
+            break
+        last_id = rows[-1]['id']
+        # The same title is often on many lists; look each one up once.
+        by_title = {}
+        for row in rows:
+            by_title.setdefault((row['media_type'] or 'movie', row['tmdb_id']), []).append(row)
+        posters = {}
+        for (media_type, tmdb_id), title_rows in by_title.items():
+            rate_limiter.acquire()
+            poster_path = tmdb_poster_path(media_type, tmdb_id)
+            if poster_path is not None:
+                posters[(media_type, tmdb_id)] = poster_path
+        with get_db_connection() as conn:
+            if not conn:
+                raise RuntimeError("Database connection failed.")
+            cursor = conn.cursor()
+            try:
+                user_ids = set()
+                for key, poster_path in posters.items():
+                    ids = [row['id'] for row in by_title[key]]
+                    cursor.execute("UPDATE movies SET poster_path = %s WHERE id = ANY(%s) AND poster_path IS NULL", (poster_path, ids))
+                    updated += cursor.rowcount
+                    if poster_path:
+                        user_ids.update(row['user_id'] for row in by_title[key])
+                for user_id in sorted(user_ids):
+                    bump_items_version(cursor, user_id)
+                conn.commit()
+            except psycopg2.Error:
+                conn.rollback()
+                raise
+            finally:
+                cursor.close()
+        log_event('poster_backfill_progress', updated=updated, last_id=last_id)
+    return updated
+
+@app.cli.command('backfill-posters')
+@click.option('--batch-size', default=100, show_default=True, help='Movies read per batch.')
+@click.option('--limit', type=int, default=None, help='Stop after updating this many rows.')
+def backfill_posters_command(batch_size, limit):
+    """Fill in TMDB posters for movies added before posters were stored."""
+    updated = backfill_movie_posters(batch_size=batch_size, limit=limit)
+    print(f"Updated {updated} movie(s).")
+
+@app.cli.command('recommendation-worker')
+@click.option('--once', is_flag=True, help='Exit when no refresh is due instead of polling.')
+def recommendation_worker_command(once):
+    """Run the background recommendation queue builder."""
+    run_recommendation_worker(once=once)
+
 if __name__ == "__main__":
     port = int(os.environ.get("PORT", 5000))
     app.run(debug=False, host="0.0.0.0", port=port)
\ No newline at end of file
@@ -0,0 +1,235 @@
+"""Local stand-ins for TMDB, Spotify and Groq, with latency and error injection.
+
+One threaded HTTP server answers every upstream the app talks to; their paths
+do not overlap, so the app's TMDB_API_BASE, SPOTIFY_API_BASE,
+SPOTIFY_ACCOUNTS_BASE and GROQ_BASE_URL can all point at it.
+
+    python bench/mock_upstreams.py --port 9100 --latency tmdb=80,spotify=60,groq=400 --error-rate 0.01
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+DEFAULT_LATENCY_MS = {'tmdb': 80, 'spotify': 60, 'spotify_accounts': 40, 'groq': 400}
+
+
+def parse_latency(spec):
+    """'tmdb=80,groq=400' -> {'tmdb': 80.0, 'groq': 400.0} on top of the defaults."""
+    latency = dict(DEFAULT_LATENCY_MS)
+    for part in filter(None, (spec or '').split(',')):
+        name, value = part.split('=', 1)
+        latency[name.strip()] = float(value)
+    return latency
+
+
+def _track(seed):
+    return {
+        'id': f"mock{seed:018d}"[:22],
+        'name': f"Mock Song {seed}",
+        'artists': [{'id': f"artist{seed % 97:016d}"[:22], 'name': f"Mock Artist {seed % 97}"}],
+        'album': {'images': [{'url': f"https://example.invalid/art/{seed}/640.jpg"}, {'url': f"https://example.invalid/art/{seed}/64.jpg"}]},
+        'external_urls': {'spotify': f"https://open.spotify.com/track/mock{seed}"},
+    }
+
+
+def _movie(seed, media_type='movie'):
+    return {
+        'id': seed,
+        'media_type': media_type,
+        'title' if media_type == 'movie' else 'name': f"Mock {media_type.title()} {seed}",
+        'release_date' if media_type == 'movie' else 'first_air_date': f"{1980 + seed % 45}-01-01",
+        'poster_path': f"/mock{seed}.jpg",
+    }
+
+
+def _seed_from(text):
+    return sum(map(ord, text)) * 31 % 100000
+
+
+class MockUpstreams:
+    def __init__(self, latency_ms, jitter=0.25, error_rate=0.0):
+        self.latency_ms = latency_ms
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.calls = {}
+        self._lock = threading.Lock()
+
+    def record(self, upstream, route):
+        with self._lock:
+            key = f"{upstream} {route}"
+            self.calls[key] = self.calls.get(key, 0) + 1
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.calls)
+
+    def reset(self):
+        with self._lock:
+            self.calls.clear()
+
+    def delay(self, upstream):
+        base = self.latency_ms.get(upstream, 0) / 1000
+        time.sleep(max(0.0, random.uniform(base * (1 - self.jitter), base * (1 + self.jitter))))
+
+    def should_fail(self):
+        return self.error_rate and random.random() < self.error_rate
+
+    def make_handler(self):
+        mocks = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send_json(self, payload, status=200):
+                body = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _read_json(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                raw = self.rfile.read(length) if length else b''
+                try:
+                    return json.loads(raw or b'{}')
+                except ValueError:
+                    return {}
+
+            def _route(self, method):
+                url = urlparse(self.path)
+                parts = [part for part in url.path.split('/') if part]
+                query = {key: values[0] for key, values in parse_qs(url.query).items()}
+                if parts[:2] == ['api', 'token']:
+                    return 'spotify_accounts', 'token', lambda: {'access_token': 'mock-token', 'token_type': 'Bearer', 'expires_in': 3600}
+                if parts[:1] == ['v1']:
+                    return ('spotify',) + self._spotify(parts[1:], query)
+                if parts[:1] == ['3']:
+                    return ('tmdb',) + self._tmdb(parts[1:], query)
+                if parts[-2:] == ['chat', 'completions'] and method == 'POST':
+                    return 'groq', 'chat.completions', None
+                return None, None, None
+
+            def _spotify(self, parts, query):
+                if parts == ['search']:
+                    seed = _seed_from(query.get('q', ''))
+                    limit = int(query.get('limit', 5))
+                    return 'search', lambda: {'tracks': {'items': [_track(seed + i) for i in range(limit)]}}
+                if parts[:1] == ['tracks'] and len(parts) == 2:
+                    return 'tracks', lambda: _track(_seed_from(parts[1]))
+                if parts == ['recommendations']:
+                    seed = _seed_from(query.get('seed_tracks', ''))
+                    return 'recommendations', lambda: {'tracks': [_track(seed + i) for i in range(int(query.get('limit', 10)))]}
+                if parts[:1] == ['artists'] and parts[-1:] == ['top-tracks']:
+                    seed = _seed_from(parts[1])
+                    return 'top-tracks', lambda: {'tracks': [_track(seed + i) for i in range(10)]}
+                return None, None
+
+            def _tmdb(self, parts, query):
+                if parts == ['search', 'multi']:
+                    seed = _seed_from(query.get('query', ''))
+                    return 'search/multi', lambda: {'results': [_movie(seed + i, 'movie' if i % 3 else 'tv') for i in range(10)]}
+                if len(parts) == 3 and parts[2] == 'recommendations':
+                    seed = int(parts[1]) if parts[1].isdigit() else _seed_from(parts[1])
+                    return 'recommendations', lambda: {'results': [_movie(seed * 7 + i, parts[0]) for i in range(20)]}
+                if len(parts) == 2 and parts[0] in ('movie', 'tv'):
+                    seed = int(parts[1]) if parts[1].isdigit() else _seed_from(parts[1])
+                    return 'details', lambda: _movie(seed, parts[0])
+                return None, None
+
+            def _groq(self):
+                request = self._read_json()
+                prompt = ' '.join(str(message.get('content', '')) for message in request.get('messages', []))
+                if 'book' in prompt.lower() and 'recommend' in prompt.lower():
+                    content = {'recommendations': [{'title': f"Mock Book {i}", 'author': f"Mock Author {i}", 'reason': 'Mock reason.'} for i in range(10)]}
+                else:
+                    content = {'suggestions': [{'title': f"Mock Idea {i}", 'category': ['movie', 'song', 'book'][i % 3], 'reason': 'Mock reason.'} for i in range(3)]}
+                text = json.dumps(content)
+                usage = {'prompt_tokens': len(prompt) // 4, 'completion_tokens': len(text) // 4, 'total_tokens': (len(prompt) + len(text)) // 4}
+                if not request.get('stream'):
+                    return self._send_json({
+                        'id': 'mock', 'object': 'chat.completion', 'created': int(time.time()), 'model': request.get('model', 'mock'),
+                        'choices': [{'index': 0, 'finish_reason': 'stop', 'message': {'role': 'assistant', 'content': text}}],
+                        'usage': usage,
+                    })
+                # Stream a handful of characters per chunk, like a real token stream.
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.end_headers()
+                pieces = [text[i:i + 12] for i in range(0, len(text), 12)]
+                for index, piece in enumerate(pieces):
+                    chunk = {
+                        'id': 'mock', 'object': 'chat.completion.chunk', 'created': int(time.time()), 'model': request.get('model', 'mock'),
+                        'choices': [{'index': 0, 'delta': {'content': piece}, 'finish_reason': None}],
+                    }
+                    if index == len(pieces) - 1:
+                        chunk['x_groq'] = {'usage': usage}
+                    self._write_chunk(f"data: {json.dumps(chunk)}\n\n")
+                    time.sleep(0.005)
+                self._write_chunk("data: [DONE]\n\n")
+                self.wfile.write(b"0\r\n\r\n")
+
+            def _write_chunk(self, text):
+                data = text.encode()
+                self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+
+            def _handle(self, method):
+                upstream, route, respond = self._route(method)
+                if upstream is None or route is None:
+                    return self._send_json({'error': 'not mocked', 'path': self.path}, status=404)
+                mocks.record(upstream, route)
+                mocks.delay(upstream)
+                if mocks.should_fail():
+                    if method == 'POST':
+                        self._read_json()
+                    return self._send_json({'error': 'injected failure'}, status=random.choice([429, 500, 503]))
+                if upstream == 'groq':
+                    return self._groq()
+                if method == 'POST':
+                    self._read_json()
+                return self._send_json(respond())
+
+            def do_GET(self):
+                if self.path == '/_stats':
+                    return self._send_json(mocks.snapshot())
+                self._handle('GET')
+
+            def do_POST(self):
+                if self.path == '/_reset':
+                    mocks.reset()
+                    return self._send_json({'status': 'ok'})
+                self._handle('POST')
+
+        return Handler
+
+
+def start_mock_server(port=0, latency_ms=None, jitter=0.25, error_rate=0.0):
+    """Serve the mocks on a background thread. Returns (server, mocks); server.server_port has the port."""
+    mocks = MockUpstreams(latency_ms or dict(DEFAULT_LATENCY_MS), jitter=jitter, error_rate=error_rate)
+    server = ThreadingHTTPServer(('127.0.0.1', port), mocks.make_handler())
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True, name='mock-upstreams').start()
+    return server, mocks
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=9100)
+    parser.add_argument('--latency', help='per-upstream latency in ms, e.g. tmdb=80,spotify=60,groq=400')
+    parser.add_argument('--jitter', type=float, default=0.25, help='latency varies uniformly by +/- this fraction')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of upstream calls answered with 429/5xx')
+    args = parser.parse_args()
+    server, _ = start_mock_server(args.port, parse_latency(args.latency), args.jitter, args.error_rate)
+    print(f"Mock upstreams listening on http://127.0.0.1:{server.server_port}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
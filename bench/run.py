@@ -0,0 +1,344 @@
+"""Benchmark harness: boots app.py under gunicorn against local upstream mocks and drives a request mix.
+
+Needs a throwaway PostgreSQL database; the base schema (bench/schema.sql) and
+the app's migrations are applied to it. Upstreams are always the local mocks
+from bench/mock_upstreams.py, so no API keys are used and runs are repeatable.
+
+    python bench/run.py --database-url postgresql://localhost/laterlist_bench --duration 30
+    python bench/run.py --database-url ... --mode both            # sync vs gevent workers
+    python bench/run.py --database-url ... --json run.json --baseline previous.json
+
+Per route it reports requests, errors, RPS, p50/p95/p99 latency and the mean
+DB statements and upstream calls per request (from the X-DB-Queries /
+X-Upstream-Calls headers the app adds with EXPOSE_REQUEST_COUNTERS=1), plus
+the calls each mock upstream received.
+"""
+import argparse
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import psycopg2
+import psycopg2.extras
+import requests
+
+from mock_upstreams import parse_latency, start_mock_server
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_MIX = 'home=40,add_item=20,recommend=25,generate_ideas=15'
+WORDS = ['midnight', 'river', 'echo', 'garden', 'signal', 'neon', 'quiet', 'storm', 'paper', 'orbit', 'velvet', 'harbor']
+MOODS = ['something cozy for a rainy day', 'high energy workout', 'a mind-bending weekend', 'calm focus music', 'feel-good classics']
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+# --- Request mix ---
+def route_home(client):
+    return client.get('/home')
+
+
+def route_add_item(client):
+    section = random.choice(['movies', 'songs', 'books'])
+    title = ' '.join(random.sample(WORDS, 2)).title()
+    return client.post('/api/add_item', json={'section': section, 'title': title})
+
+
+def route_recommend(client):
+    return client.post(f"/api/recommend/{random.choice(['movies', 'songs', 'books'])}")
+
+
+def route_generate_ideas(client):
+    return client.post('/generate_ideas', json={'prompt': random.choice(MOODS)})
+
+
+def route_search(client):
+    return client.get('/api/search', params={'q': random.choice(WORDS)[:random.randint(2, 6)]})
+
+
+def route_autocomplete(client):
+    return client.get(f"/api/autocomplete/{random.choice(['movies', 'songs'])}", params={'q': random.choice(WORDS)[:random.randint(2, 6)]})
+
+
+ROUTES = {
+    'home': route_home,
+    'add_item': route_add_item,
+    'recommend': route_recommend,
+    'generate_ideas': route_generate_ideas,
+    'search': route_search,
+    'autocomplete': route_autocomplete,
+}
+
+
+class Client:
+    """requests.Session bound to the app's base URL and one logged-in user."""
+    def __init__(self, base_url, cookies):
+        self.base_url = base_url
+        self.session = requests.Session()
+        self.session.cookies.update(cookies)
+
+    def get(self, path, **kwargs):
+        return self.session.get(self.base_url + path, allow_redirects=False, timeout=60, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.session.post(self.base_url + path, allow_redirects=False, timeout=60, **kwargs)
+
+
+# --- Setup ---
+def prepare_database(database_url):
+    with psycopg2.connect(database_url) as conn, conn.cursor() as cursor:
+        with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'schema.sql')) as schema:
+            cursor.execute(schema.read())
+
+
+def run_migrations(env):
+    subprocess.run([sys.executable, '-m', 'flask', '--app', 'app', 'migrate'], cwd=REPO_ROOT, env=env, check=True)
+
+
+def seed_items(database_url, usernames, items_per_user):
+    """Bulk-insert items for the benchmark users, with mock upstream IDs so recommendations work."""
+    with psycopg2.connect(database_url) as conn, conn.cursor() as cursor:
+        cursor.execute("SELECT id FROM users WHERE username = ANY(%s)", (usernames,))
+        user_ids = [row[0] for row in cursor.fetchall()]
+        per_section = max(1, items_per_user // 4)
+        for user_id in user_ids:
+            titles = [f"{random.choice(WORDS).title()} {random.choice(WORDS).title()} {n}" for n in range(per_section)]
+            psycopg2.extras.execute_values(cursor, "INSERT INTO movies (user_id, title, link, tmdb_id, media_type) VALUES %s", [
+                (user_id, title, f"https://www.themoviedb.org/movie/{1000 + n}", 1000 + n, 'movie') for n, title in enumerate(titles)
+            ])
+            psycopg2.extras.execute_values(cursor, "INSERT INTO songs (user_id, title, link, spotify_id) VALUES %s", [
+                (user_id, f"{title} by Mock Artist", f"https://open.spotify.com/track/seed{n}", f"seed{user_id:08d}{n:010d}"[:22]) for n, title in enumerate(titles)
+            ])
+            for section in ('books', 'bookmarks'):
+                psycopg2.extras.execute_values(cursor, f"INSERT INTO {section} (user_id, title, link) VALUES %s", [
+                    (user_id, title, f"https://www.google.com/search?q={n}") for n, title in enumerate(titles)
+                ])
+
+
+def boot_app(mode, workers, port, env):
+    command = [sys.executable, '-m', 'gunicorn', '-w', str(workers), '-b', f"127.0.0.1:{port}", '--timeout', '120', '--log-level', 'warning']
+    if mode == 'gevent':
+        command += ['-k', 'gevent', '--worker-connections', '1000']
+    process = subprocess.Popen(command + ['app:app'], cwd=REPO_ROOT, env=env)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(f"http://127.0.0.1:{port}/health", timeout=1).status_code == 200:
+                return process
+        except requests.RequestException:
+            pass
+        if process.poll() is not None:
+            raise RuntimeError(f"gunicorn exited with status {process.returncode}")
+        time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError('App did not become healthy within 30s.')
+
+
+def register_users(base_url, usernames):
+    cookies = {}
+    for username in usernames:
+        session = requests.Session()
+        response = session.post(f"{base_url}/register", data={'username': username, 'password': 'bench-password'}, allow_redirects=False, timeout=30)
+        if response.status_code not in (200, 302) or 'session' not in session.cookies:
+            raise RuntimeError(f"Could not register {username}: HTTP {response.status_code}")
+        cookies[username] = session.cookies.get_dict()
+    return cookies
+
+
+# --- Load ---
+def drive(base_url, cookies, mix, concurrency, duration, warmup):
+    """Run `concurrency` closed-loop clients; returns {route: [(latency_ms, status, db_queries, upstream_calls)]}."""
+    names, weights = zip(*mix.items())
+    samples = {name: [] for name in names}
+    lock = threading.Lock()
+    start = time.monotonic()
+    measure_from, stop_at = start + warmup, start + warmup + duration
+    user_cookies = list(cookies.values())
+
+    def worker(index):
+        client = Client(base_url, user_cookies[index % len(user_cookies)])
+        while True:
+            now = time.monotonic()
+            if now >= stop_at:
+                return
+            name = random.choices(names, weights)[0]
+            began = time.perf_counter()
+            try:
+                response = ROUTES[name](client)
+                status = response.status_code
+                db_queries = int(response.headers.get('X-DB-Queries', 0))
+                upstream_calls = int(response.headers.get('X-Upstream-Calls', 0))
+            except requests.RequestException:
+                status, db_queries, upstream_calls = 0, 0, 0
+            elapsed_ms = (time.perf_counter() - began) * 1000
+            if now >= measure_from:
+                with lock:
+                    samples[name].append((elapsed_ms, status, db_queries, upstream_calls))
+
+    threads = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return samples
+
+
+def summarize(samples, duration):
+    report = {}
+    for name, rows in samples.items():
+        latencies = sorted(row[0] for row in rows)
+        count = len(rows)
+        report[name] = {
+            'requests': count,
+            'errors': sum(1 for row in rows if row[1] == 0 or row[1] >= 500),
+            'client_errors': sum(1 for row in rows if 400 <= row[1] < 500),
+            'rps': round(count / duration, 2),
+            'p50_ms': round(percentile(latencies, 50), 2),
+            'p95_ms': round(percentile(latencies, 95), 2),
+            'p99_ms': round(percentile(latencies, 99), 2),
+            'db_queries_per_request': round(sum(row[2] for row in rows) / count, 2) if count else 0.0,
+            'upstream_calls_per_request': round(sum(row[3] for row in rows) / count, 2) if count else 0.0,
+        }
+    return report
+
+
+def print_report(title, result):
+    print(f"\n== {title}: {result['total_rps']} req/s over {result['duration']}s, concurrency {result['concurrency']} ==")
+    header = f"{'route':<16}{'reqs':>8}{'5xx':>6}{'4xx':>6}{'rps':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'db/req':>8}{'up/req':>8}"
+    print(header)
+    print('-' * len(header))
+    for name, row in result['routes'].items():
+        print(f"{name:<16}{row['requests']:>8}{row['errors']:>6}{row['client_errors']:>6}{row['rps']:>9}{row['p50_ms']:>9}{row['p95_ms']:>9}{row['p99_ms']:>9}{row['db_queries_per_request']:>8}{row['upstream_calls_per_request']:>8}")
+    print("Mock upstream calls: " + ', '.join(f"{key}={value}" for key, value in sorted(result['upstream_calls'].items())))
+
+
+def compare_to_baseline(result, baseline, max_regression):
+    """Regressions where p95 or the error rate got worse by more than max_regression."""
+    regressions = []
+    for name, row in result['routes'].items():
+        before = baseline['routes'].get(name)
+        if not before or not before['requests'] or not row['requests']:
+            continue
+        if before['p95_ms'] and row['p95_ms'] > before['p95_ms'] * (1 + max_regression):
+            regressions.append(f"{name}: p95 {before['p95_ms']}ms -> {row['p95_ms']}ms")
+        if row['errors'] / row['requests'] > before['errors'] / before['requests'] + max_regression / 10:
+            regressions.append(f"{name}: 5xx rate {before['errors']}/{before['requests']} -> {row['errors']}/{row['requests']}")
+    return regressions
+
+
+def run_once(args, mode, mocks, mock_url, mix):
+    port = free_port()
+    env = {
+        **os.environ,
+        'DATABASE_URL': args.database_url,
+        'FLASK_SECRET_KEY': 'bench-secret',
+        'TMDB_API_KEY': 'mock', 'SPOTIFY_CLIENT_ID': 'mock', 'SPOTIFY_CLIENT_SECRET': 'mock', 'GROQ_API_KEY': 'mock',
+        'TMDB_API_BASE': mock_url, 'SPOTIFY_API_BASE': mock_url, 'SPOTIFY_ACCOUNTS_BASE': mock_url, 'GROQ_BASE_URL': mock_url,
+        'EXPOSE_REQUEST_COUNTERS': '1',
+        'LOG_REQUESTS': '0',
+        # Every benchmark user registers from 127.0.0.1.
+        'LOGIN_ATTEMPTS_PER_MINUTE_PER_IP': '100000', 'LOGIN_BURST_PER_IP': '100000',
+    }
+    run_migrations(env)
+    process = boot_app(mode, args.workers, port, env)
+    try:
+        base_url = f"http://127.0.0.1:{port}"
+        prefix = f"bench_{mode}_{int(time.time())}"
+        usernames = [f"{prefix}_{n}" for n in range(args.users)]
+        cookies = register_users(base_url, usernames)
+        seed_items(args.database_url, usernames, args.seed_items)
+        mocks.reset()
+        samples = drive(base_url, cookies, mix, args.concurrency, args.duration, args.warmup)
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+    routes = summarize(samples, args.duration)
+    return {
+        'mode': mode, 'duration': args.duration, 'concurrency': args.concurrency, 'workers': args.workers,
+        'total_rps': round(sum(row['requests'] for row in routes.values()) / args.duration, 2),
+        'routes': routes,
+        'upstream_calls': mocks.snapshot(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database-url', default=os.getenv('BENCH_DATABASE_URL'), help='throwaway PostgreSQL database (or BENCH_DATABASE_URL)')
+    parser.add_argument('--mode', choices=['sync', 'gevent', 'both'], default='sync')
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn worker processes')
+    parser.add_argument('--concurrency', type=int, default=32, help='concurrent closed-loop clients')
+    parser.add_argument('--duration', type=float, default=30, help='measured seconds')
+    parser.add_argument('--warmup', type=float, default=5, help='unmeasured seconds before measuring')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help=f"route weights, from: {', '.join(ROUTES)}")
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--seed-items', type=int, default=200, help='items per user, spread over the four sections')
+    parser.add_argument('--latency', help='mock latency in ms per upstream, e.g. tmdb=80,spotify=60,groq=400')
+    parser.add_argument('--jitter', type=float, default=0.25)
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of mock upstream calls that fail with 429/5xx')
+    parser.add_argument('--json', help='write results to this file')
+    parser.add_argument('--baseline', help='results file from an earlier run to compare against')
+    parser.add_argument('--max-regression', type=float, default=0.25, help='allowed fractional p95 slowdown before failing')
+    args = parser.parse_args()
+    if not args.database_url:
+        parser.error('--database-url (or BENCH_DATABASE_URL) is required')
+    mix = {}
+    for part in args.mix.split(','):
+        name, weight = part.split('=')
+        if name not in ROUTES:
+            parser.error(f"unknown route in --mix: {name}")
+        mix[name] = float(weight)
+
+    server, mocks = start_mock_server(0, parse_latency(args.latency), args.jitter, args.error_rate)
+    mock_url = f"http://127.0.0.1:{server.server_port}"
+    prepare_database(args.database_url)
+
+    results = []
+    for mode in (['sync', 'gevent'] if args.mode == 'both' else [args.mode]):
+        result = run_once(args, mode, mocks, mock_url, mix)
+        print_report(f"{mode} workers", result)
+        results.append(result)
+    server.shutdown()
+
+    if len(results) == 2:
+        print("\n== sync vs gevent ==")
+        print(f"{'route':<16}{'sync rps':>10}{'gevent rps':>12}{'sync p99':>10}{'gevent p99':>12}")
+        for name in mix:
+            sync_row, gevent_row = results[0]['routes'][name], results[1]['routes'][name]
+            print(f"{name:<16}{sync_row['rps']:>10}{gevent_row['rps']:>12}{sync_row['p99_ms']:>10}{gevent_row['p99_ms']:>12}")
+    if args.json:
+        with open(args.json, 'w') as out:
+            json.dump(results if len(results) > 1 else results[0], out, indent=2)
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        baselines = baseline if isinstance(baseline, list) else [baseline]
+        regressions = []
+        for result in results:
+            match = next((b for b in baselines if b['mode'] == result['mode']), None)
+            if match:
+                regressions += [f"[{result['mode']}] {line}" for line in compare_to_baseline(result, match, args.max_regression)]
+        if regressions:
+            print("\nRegressions against baseline:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print("\nNo regressions against baseline.")
+
+
+if __name__ == '__main__':
+    main()
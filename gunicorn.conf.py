@@ -0,0 +1,14 @@
+"""Gunicorn hooks, loaded automatically when gunicorn is started from this directory."""
+
+
+def post_worker_init(worker):
+    # Gevent workers monkey-patch after the app may already be imported (--preload),
+    # so async mode has to be switched on here, once patching is done.
+    try:
+        from gunicorn.workers.ggevent import GeventWorker
+    except ImportError:
+        return
+    if isinstance(worker, GeventWorker):
+        import app
+        if not app.enable_async_serving():
+            raise RuntimeError("gevent worker started without patched sockets; refusing to serve with blocking DB calls.")